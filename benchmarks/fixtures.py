@@ -0,0 +1,153 @@
+"""Synthetic, reproducible portfolios for the offline benchmarks.
+
+Prices follow a one-factor geometric Brownian motion on business days, so tickers
+are realistically correlated; the same arguments always give the same data.
+"""
+from pathlib import Path
+from typing import Dict, List
+import zlib
+
+import pandas as pd
+import numpy as np
+
+END_DATE = "2024-12-31"
+ASSET_CLASSES = {
+    "Stocks": ["World Stocks", "EMs Stocks", "US Stocks", "EU Stocks"],
+    "Bonds": ["World Bonds", "EU Short Term Bonds", "EU Long Term Bonds"],
+    "Commodities": ["Gold"],
+}
+
+
+def get_tickers(n_tickers: int) -> List[str]:
+    return [f"ETF{i_:04d}.MI" for i_ in range(n_tickers)]
+
+
+def make_price_history(
+    n_tickers: int, n_years: int, seed: int = 42
+) -> Dict[str, pd.Series]:
+    # Same shape as input_output.get_full_price_history: one Close series per ticker
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=END_DATE, periods=n_years * 252)
+    market = rng.normal(0.0003, 0.01, size=(len(dates), 1))
+    betas = rng.uniform(0.2, 1.2, size=(1, n_tickers))
+    noise = rng.normal(0, 0.006, size=(len(dates), n_tickers))
+    log_prices = np.cumsum(market * betas + noise, axis=0)
+    prices = rng.uniform(10, 200, size=n_tickers) * np.exp(log_prices)
+    return {
+        ticker_: pd.Series(prices[:, i_], index=dates, name=ticker_)
+        for i_, ticker_ in enumerate(get_tickers(n_tickers))
+    }
+
+
+def make_registry(n_tickers: int, seed: int = 42) -> pd.DataFrame:
+    # Securities master table, as returned by input_output.load_data
+    rng = np.random.default_rng(seed)
+    pairs = [
+        (macro_, class_)
+        for macro_, classes_ in ASSET_CLASSES.items()
+        for class_ in classes_
+    ]
+    picks = rng.integers(0, len(pairs), size=n_tickers)
+    tickers = get_tickers(n_tickers)
+    return pd.DataFrame(
+        {
+            "exchange": "MI",
+            "ticker": [t_.split(".")[0] for t_ in tickers],
+            "name": [f"Synthetic ETF {i_}" for i_ in range(n_tickers)],
+            "asset_class": [pairs[p_][1] for p_ in picks],
+            "macro_asset_class": [pairs[p_][0] for p_ in picks],
+            "ticker_yf": tickers,
+        }
+    )
+
+
+def make_transactions(
+    price_history: Dict[str, pd.Series], n_transactions: int, seed: int = 42
+) -> pd.DataFrame:
+    # Transactions history, as returned by input_output.load_data: every ticker is
+    # bought at least once, then about 5% of the transactions sell a single share
+    rng = np.random.default_rng(seed)
+    tickers = np.array(list(price_history))
+    df_prices = pd.concat(price_history.values(), axis=1)
+    ticker_idx = np.concatenate(
+        [np.arange(len(tickers)), rng.integers(0, len(tickers), n_transactions)]
+    )[:n_transactions]
+    date_idx = rng.integers(0, len(df_prices) // 2, size=n_transactions)
+    shares = rng.integers(1, 20, size=n_transactions).astype(float)
+    # Sales happen in the second half of the history, after all the first purchases
+    is_sale = rng.random(n_transactions) < 0.05
+    is_sale[: len(tickers)] = False
+    date_idx = np.where(is_sale, date_idx + len(df_prices) // 2, date_idx)
+    shares = np.where(is_sale, -1.0, shares)
+    prices = df_prices.to_numpy()[date_idx, ticker_idx]
+    df_transactions = pd.DataFrame(
+        {
+            "exchange": "MI",
+            "ticker": np.char.partition(tickers[ticker_idx], ".")[:, 0],
+            "transaction_date": df_prices.index[date_idx],
+            "shares": shares,
+            "price": prices,
+            "fees": np.where(rng.random(n_transactions) < 0.3, 1.5, 0.0),
+            "ap_amount": shares * prices,
+            "ticker_yf": tickers[ticker_idx],
+        }
+    )
+    return df_transactions.sort_values("transaction_date", ignore_index=True)
+
+
+def make_offline_price_history(
+    ticker_list: List[str], n_years: int = 20, end: str | None = None
+) -> Dict[str, pd.Series]:
+    # Prices for arbitrary tickers, e.g. the ones of a real workbook: each ticker
+    # gets its own seed, so it always has the same history whatever it is fetched with
+    dates = pd.bdate_range(
+        end=end or pd.Timestamp.today().normalize(), periods=n_years * 252
+    )
+    market = np.random.default_rng(0).normal(0.0003, 0.01, size=len(dates))
+    history = {}
+    for ticker_ in ticker_list:
+        rng = np.random.default_rng(zlib.crc32(ticker_.encode()))
+        log_rets = market * rng.uniform(0.2, 1.2) + rng.normal(0, 0.006, len(dates))
+        history[ticker_] = pd.Series(
+            rng.uniform(10, 200) * np.exp(np.cumsum(log_rets)),
+            index=dates,
+            name=ticker_,
+        )
+    return history
+
+
+def make_workbook(
+    path: Path, n_tickers: int, n_years: int, n_transactions: int, seed: int = 42
+) -> None:
+    # Workbook in the format of data/in/template.xlsx
+    price_history = make_price_history(n_tickers, n_years, seed=seed)
+    df_transactions = make_transactions(price_history, n_transactions, seed=seed)
+    df_registry = make_registry(n_tickers, seed=seed)
+    with pd.ExcelWriter(path) as writer:
+        df_transactions[
+            ["exchange", "ticker", "transaction_date", "shares", "price", "fees"]
+        ].rename(
+            columns={
+                "exchange": "Exchange",
+                "ticker": "Ticker",
+                "transaction_date": "Transaction Date",
+                "shares": "Shares",
+                "price": "Price (€)",
+                "fees": "Fees (€)",
+            }
+        ).to_excel(
+            writer, sheet_name="Transactions History", index=False
+        )
+        df_registry[
+            ["exchange", "ticker", "name", "asset_class", "macro_asset_class"]
+        ].rename(
+            columns={
+                "exchange": "Exchange",
+                "ticker": "Ticker",
+                "name": "Security Name",
+                "asset_class": "Asset Class",
+                "macro_asset_class": "Macro Asset Class",
+            }
+        ).to_excel(
+            writer, sheet_name="Securities Master Table", index=False
+        )
@@ -0,0 +1,139 @@
+"""Memory of a session's data, in the default and in the compact representation.
+
+For synthetic portfolios of growing size, reports the bytes taken by the
+transactions (object vs categorical tickers), by the price panel (one float64
+Series per ticker, concatenated, vs a single float32 array on a shared index) and
+by the holdings behind the wealth history (a dense calendar days x tickers matrix vs
+transaction events), plus the peak memory of get_wealth_history with float64 and
+float32 prices:
+
+    python benchmarks/memory.py --output memory.json
+"""
+import argparse
+import inspect
+import json
+import sys
+import tracemalloc
+import warnings
+from functools import partial
+from pathlib import Path
+from typing import Dict, List
+
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+warnings.simplefilter("ignore", category=FutureWarning)
+
+import fixtures  # noqa: E402
+import input_output  # noqa: E402
+import aggregation  # noqa: E402
+from panel import PricePanel  # noqa: E402
+from cache import clear_caches  # noqa: E402
+
+# (tickers, years, transactions)
+SIZES = [(10, 5, 1_000), (100, 20, 10_000), (1_000, 20, 100_000)]
+TICKER_COLUMNS = {"exchange": "category", "ticker": "category", "ticker_yf": "category"}
+
+
+def get_frame_bytes(df: pd.DataFrame | pd.Series) -> int:
+    # Values and dates only: memory_usage would also count the lookup tables that
+    # pandas builds lazily on an index, once for every object sharing it
+    return df.to_numpy().nbytes + df.index.nbytes
+
+
+def get_wealth_peak_bytes(df_transactions: pd.DataFrame, ticker_list: List[str]) -> int:
+    clear_caches()
+    tracemalloc.start()
+    aggregation.get_wealth_history(df_transactions, ticker_list)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def measure(n_tickers: int, n_years: int, n_transactions: int) -> List[Dict]:
+    price_history = fixtures.make_price_history(n_tickers, n_years)
+    ticker_list = list(price_history)
+    df_transactions = fixtures.make_transactions(price_history, n_transactions)
+    df_compact = df_transactions.astype(TICKER_COLUMNS)
+
+    df_prices = pd.concat([price_history[t_] for t_ in ticker_list], axis=1)
+    panel = PricePanel.from_series(price_history, ticker_list, dtype=np.float32)
+
+    n_days = (
+        pd.Timestamp.now().normalize() - df_transactions["transaction_date"].min()
+    ).days + 1
+    n_events = df_transactions.groupby(
+        ["transaction_date", "ticker_yf"], observed=True
+    ).ngroups
+    rows = [
+        (
+            "transactions",
+            df_transactions.memory_usage(index=True, deep=True).sum(),
+            df_compact.memory_usage(index=True, deep=True).sum(),
+        ),
+        (
+            "price panel",
+            sum(get_frame_bytes(s_) for s_ in price_history.values())
+            + get_frame_bytes(df_prices),
+            panel.nbytes,
+        ),
+        (
+            # Dense float64 matrix vs events (date, ticker, shares); the blocks the
+            # events are expanded into, a few tickers at a time, count in the peak
+            "holdings",
+            n_days * n_tickers * 8,
+            n_events * (8 + 8 + 8),
+        ),
+    ]
+
+    def get_price_history(ticker_list_: List[str]) -> Dict:
+        return {t_: price_history[t_].copy() for t_ in ticker_list_}
+
+    # The panel is built inside the measure, bypassing its cache
+    input_output.get_full_price_history = get_price_history
+    build_price_panel = inspect.unwrap(input_output.get_price_panel)
+    aggregation.get_price_panel = partial(build_price_panel, dtype="float64")
+    peak_default = get_wealth_peak_bytes(df_transactions, ticker_list)
+    aggregation.get_price_panel = partial(build_price_panel, dtype="float32")
+    peak_compact = get_wealth_peak_bytes(df_compact, ticker_list)
+    aggregation.get_price_panel = input_output.get_price_panel
+    rows.append(("get_wealth_history peak", peak_default, peak_compact))
+
+    return [
+        {
+            "case": f"{n_tickers}x{n_years}y/{n_transactions}tx",
+            "item": item_,
+            "default_mb": default_ / 2**20,
+            "compact_mb": compact_ / 2**20,
+            "reduction": 1 - compact_ / default_,
+        }
+        for item_, default_, compact_ in rows
+    ]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", type=Path, help="where to write the report")
+    args = parser.parse_args()
+
+    report = [row_ for size_ in SIZES for row_ in measure(*size_)]
+    print(
+        pd.DataFrame(report).to_string(
+            index=False,
+            formatters={
+                "default_mb": "{:.2f}".format,
+                "compact_mb": "{:.2f}".format,
+                "reduction": "{:.0%}".format,
+            },
+        )
+    )
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""Headless rerun profiler of the app pages, built on Streamlit's AppTest.
+
+Loads the demo workbook (or a generated one) through the Home page, then renders
+each page and drives its main widgets, with prices served offline by fixtures.py.
+Every rerun is timed as a whole and by section, a section being the part of the
+script between two markdown headings:
+
+    python benchmarks/profile_pages.py --output pages.json
+    python benchmarks/profile_pages.py --tickers 200 --transactions 20000
+"""
+import argparse
+import json
+import logging
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+SRC_PATH = Path(__file__).resolve().parents[1] / "src"
+sys.path.insert(0, str(SRC_PATH))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import streamlit as st  # noqa: E402
+from streamlit import logger as st_logger  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import fixtures  # noqa: E402
+import var  # noqa: E402
+from cache import clear_caches  # noqa: E402
+
+st_logger.set_log_level(logging.ERROR)
+warnings.simplefilter("ignore", category=FutureWarning)
+
+HOME = SRC_PATH / "0_🏠_Home.py"
+PAGES = {
+    "Asset Allocation & PnL": SRC_PATH / "pages" / "1_🎯_Asset_Allocation_&_PnL.py",
+    "Return Analysis": SRC_PATH / "pages" / "2_📈_Return_Analysis.py",
+    "Risk Analysis": SRC_PATH / "pages" / "3_⚠️_Risk_Analysis.py",
+}
+
+
+def _widget(widgets, label: str):
+    return next(w_ for w_ in widgets if w_.label == label)
+
+
+def _move_time_slice(at: AppTest) -> None:
+    # Keep the second half of the available history
+    slider = at.select_slider[0]
+    options = slider.options
+    slider.set_range(options[len(options) // 2], options[-1])
+
+
+INTERACTIONS: Dict[str, List[Tuple[str, Callable[[AppTest], object]]]] = {
+    "Asset Allocation & PnL": [
+        ("fees", lambda at: _widget(at.checkbox, "Take fees into account").check()),
+        (
+            "pnl level",
+            lambda at: _widget(at.radio, "Evaluate PnL with respect to:").set_value(
+                "Asset Classes"
+            ),
+        ),
+    ],
+    "Return Analysis": [
+        ("level", lambda at: at.radio(key="level").set_value("Asset Classes")),
+        ("frequency", lambda at: at.radio(key="freq").set_value("Week")),
+        ("time slice", _move_time_slice),
+        (
+            "rolling window",
+            lambda at: _widget(at.slider, "Choose a rolling window:").set_value(60),
+        ),
+        (
+            "kendall",
+            lambda at: _widget(at.radio, "Correlation coefficient:").set_value(
+                "Kendall"
+            ),
+        ),
+    ],
+    "Risk Analysis": [
+        (
+            "level",
+            lambda at: _widget(at.radio, "Aggregate by:").set_value("Asset Classes"),
+        ),
+        (
+            "frequency",
+            lambda at: _widget(at.radio, "Frequency of returns:").set_value("Week"),
+        ),
+        ("time slice", _move_time_slice),
+    ],
+}
+
+
+class SectionClock:
+    """Timestamps of the markdown headings written during a rerun."""
+
+    def __init__(self):
+        self.marks: List[Tuple[str, float]] = []
+        self._markdown = st.markdown
+
+    def __enter__(self) -> "SectionClock":
+        def markdown(body, *args, **kwargs):
+            if isinstance(body, str) and body.lstrip().startswith("#"):
+                self.marks.append(
+                    (body.strip().lstrip("#").strip(), time.perf_counter())
+                )
+            return self._markdown(body, *args, **kwargs)
+
+        st.markdown = markdown
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        st.markdown = self._markdown
+
+    def get_sections(self, start: float, end: float) -> Dict[str, float]:
+        # Time from each heading to the next one; what comes before the first
+        # heading (imports, data loading, global settings) is the "setup"
+        sections = {}
+        bounds = [("setup", start)] + self.marks + [("", end)]
+        for (name_, begin_), (_, end_) in zip(bounds[:-1], bounds[1:]):
+            sections[name_] = sections.get(name_, 0) + end_ - begin_
+        return sections
+
+
+def timed_run(at: AppTest, action: Callable[[AppTest], object] | None = None) -> dict:
+    with SectionClock() as clock:
+        start = time.perf_counter()
+        if action is not None:
+            action(at)
+        at.run()
+        end = time.perf_counter()
+    return dict(
+        wall_s=end - start,
+        sections_s=clock.get_sections(start, end),
+        exceptions=[e_.message for e_ in at.exception],
+    )
+
+
+def patch_price_provider(n_years: int) -> None:
+    # Offline prices for any ticker, in place of every download in the app
+    def get_full_price_history(ticker_list: List[str]) -> Dict:
+        return fixtures.make_offline_price_history(ticker_list, n_years=n_years)
+
+    def get_last_closing_price(ticker_list: List[str]) -> pd.DataFrame:
+        history = get_full_price_history(ticker_list)
+        return pd.DataFrame(
+            {
+                "ticker_yf": ticker_list,
+                "last_closing_date": [
+                    str(history[t_].index[-1])[:10] for t_ in ticker_list
+                ],
+                "price": [history[t_].iloc[-1] for t_ in ticker_list],
+            }
+        )
+
+    import input_output
+    import aggregation, returns, risk, benchmark, performance  # noqa: F401, E401
+
+    patches = {
+        "get_full_price_history": get_full_price_history,
+        "get_last_closing_price": get_last_closing_price,
+        "get_treasury_bill_rate": lambda: 3.0,
+        "get_risk_free_rate_last_value": lambda decimal=False: 0.03 if decimal else 3,
+    }
+    for module_ in list(sys.modules.values()):
+        for name_, func_ in patches.items():
+            if hasattr(module_, name_):
+                setattr(module_, name_, func_)
+    assert input_output.get_full_price_history is get_full_price_history
+
+
+def profile(timeout: float, repeat: int) -> dict:
+    results = []
+    for i_ in range(repeat):
+        clear_caches()
+        home = AppTest.from_file(str(HOME), default_timeout=timeout)
+        first = timed_run(home)
+        load = timed_run(home, lambda at: at.button(key="load_mock_df").click())
+        results.append(dict(page="Home", step="first render", run=i_, **first))
+        results.append(dict(page="Home", step="load data", run=i_, **load))
+        if "data" not in home.session_state:
+            raise RuntimeError(
+                f"the workbook could not be loaded: {load['exceptions']}"
+            )
+        for page_, path_ in PAGES.items():
+            at = AppTest.from_file(str(path_), default_timeout=timeout)
+            for key_ in ["data", "dimensions", "benchmarks"]:
+                at.session_state[key_] = home.session_state[key_]
+            steps = [("first render", None)] + INTERACTIONS[page_]
+            for step_, action_ in steps:
+                try:
+                    result = timed_run(at, action_)
+                except StopIteration:
+                    # The widget to change was not rendered, e.g. the page stopped
+                    break
+                results.append(dict(page=page_, step=step_, run=i_, **result))
+                print(
+                    f"{page_:>24} {step_:<15} {result['wall_s'] * 1000:10.1f} ms"
+                    + (" EXCEPTION" if result["exceptions"] else ""),
+                    flush=True,
+                )
+    return results
+
+
+def summarise(results: List[dict]) -> List[dict]:
+    # Median wall time of each (page, step) across the repetitions
+    df = pd.DataFrame(results)
+    return [
+        dict(page=page_, step=step_, median_s=statistics.median(group_["wall_s"]))
+        for (page_, step_), group_ in df.groupby(["page", "step"], sort=False)
+    ]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tickers", type=int, help="generate a workbook this large")
+    parser.add_argument("--transactions", type=int, default=10_000)
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", type=Path, help="where to write the results")
+    args = parser.parse_args()
+
+    patch_price_provider(n_years=args.years)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.tickers is not None:
+            # The Home page loads its demo workbook from DATA_PATH
+            shutil.copy(var.DATA_PATH / "template.xlsx", tmp_dir)
+            fixtures.make_workbook(
+                Path(tmp_dir) / "demo.xlsx",
+                n_tickers=args.tickers,
+                n_years=args.years,
+                n_transactions=args.transactions,
+            )
+            var.DATA_PATH = Path(tmp_dir)
+        results = profile(timeout=args.timeout, repeat=args.repeat)
+
+    output = dict(
+        metadata=dict(
+            timestamp=datetime.now().isoformat(timespec="seconds"),
+            workbook="demo" if args.tickers is None else "generated",
+            tickers=args.tickers,
+            transactions=args.transactions if args.tickers else None,
+            years=args.years,
+            repeat=args.repeat,
+        ),
+        summary=summarise(results),
+        runs=results,
+    )
+    if args.output is not None:
+        args.output.write_text(json.dumps(output, indent=2))
+    n_failed = sum(bool(r_["exceptions"]) for r_ in results)
+    if n_failed:
+        print(f"{n_failed} rerun(s) raised an exception, see the output for details")
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
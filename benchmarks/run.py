@@ -0,0 +1,305 @@
+"""Offline benchmarks of the analytics hot paths.
+
+Every benchmark runs on synthetic fixture prices (see fixtures.py), with the price
+download patched out, and with the caches cleared before each run, so the
+timings are those of a cold rerun. Results are written as JSON and can be compared
+with a baseline to flag regressions:
+
+    python benchmarks/run.py --grid sweep --output results.json
+    python benchmarks/run.py --output new.json --baseline results.json
+    python benchmarks/run.py --results new.json --baseline results.json
+"""
+import argparse
+import fnmatch
+import itertools as it
+import json
+import platform
+import statistics
+import sys
+import time
+import warnings
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+warnings.simplefilter("ignore", category=FutureWarning)
+
+import fixtures  # noqa: E402
+from cache import clear_caches  # noqa: E402
+from var import DICT_FREQ_RESAMPLE, DICT_GROUPBY_LEVELS  # noqa: E402
+from aggregation import (  # noqa: E402
+    aggregate_by_ticker,
+    get_wealth_history,
+    get_portfolio_pivot,
+)
+from returns import (  # noqa: E402
+    get_period_returns,
+    get_rolling_returns,
+    correlation_analysis,
+)
+from risk import (  # noqa: E402
+    compute_metrics,
+    compute_rolling_metrics,
+    get_drawdown,
+    get_portfolio_relative_risk_contribution,
+)
+from projection import simulate_future_growth  # noqa: E402
+
+GRIDS = {
+    # One case per size of each dimension, the others at the middle value
+    "sweep": [
+        (100, 20, 10_000),
+        (10, 20, 10_000),
+        (1_000, 20, 10_000),
+        (100, 5, 10_000),
+        (100, 40, 10_000),
+        (100, 20, 1_000),
+        (100, 20, 100_000),
+    ],
+    "full": list(it.product([10, 100, 1_000], [5, 20, 40], [1_000, 10_000, 100_000])),
+    "quick": [(10, 5, 1_000)],
+}
+# Functions whose cost explodes with the number of tickers are run on smaller
+# portfolios only (pairwise rolling correlations, per-value Python loops)
+MAX_TICKERS = {"correlation_analysis": 100, "compute_rolling_metrics": 10}
+
+
+class Case:
+    """Fixture data of one (tickers, years, transactions) portfolio."""
+
+    def __init__(self, n_tickers: int, n_years: int, n_transactions: int):
+        self.params = dict(
+            n_tickers=n_tickers, n_years=n_years, n_transactions=n_transactions
+        )
+        self.price_history = fixtures.make_price_history(n_tickers, n_years)
+        self.df_registry = fixtures.make_registry(n_tickers)
+        self.df_transactions = fixtures.make_transactions(
+            self.price_history, n_transactions
+        )
+        self.ticker_list = list(self.price_history)
+        self.df_prices = pd.concat(self.price_history.values(), axis=1)
+        self.df_shares = self.df_transactions.groupby("ticker_yf").agg(
+            n_shares=("shares", "sum")
+        )
+        df_pf = aggregate_by_ticker(self.df_transactions, in_pf_only=True)
+        self.df_j = df_pf[["ticker_yf", "dca", "shares"]].merge(
+            self.df_prices.iloc[-1].rename("price"),
+            how="left",
+            left_on="ticker_yf",
+            right_index=True,
+        )
+        self.df_j["position_value"] = self.df_j["shares"] * self.df_j["price"]
+        self.df_rets = self.df_prices.pct_change().iloc[1:]
+
+    @property
+    def name(self) -> str:
+        return "{n_tickers}x{n_years}y/{n_transactions}tx".format(**self.params)
+
+
+def get_benchmarks(case: Case) -> Dict[str, Callable[[], object]]:
+    benchmarks = {
+        "aggregate_by_ticker": lambda: aggregate_by_ticker(case.df_transactions),
+        "get_wealth_history": lambda: get_wealth_history(
+            df_transactions=case.df_transactions, ticker_list=case.ticker_list
+        ),
+        "get_portfolio_pivot": lambda: get_portfolio_pivot(
+            df=case.df_j,
+            df_dimensions=case.df_registry,
+            pf_actual_value=case.df_j["position_value"].sum(),
+            aggregation_level="ticker",
+        ),
+    }
+    for freq_, level_ in it.product(DICT_FREQ_RESAMPLE, DICT_GROUPBY_LEVELS):
+        benchmarks[
+            f"get_period_returns[{freq_}, {level_}]"
+        ] = lambda freq_=freq_, level_=level_: get_period_returns(
+            df=case.df_prices,
+            df_registry=case.df_registry,
+            tickers_to_evaluate=case.ticker_list,
+            period=DICT_FREQ_RESAMPLE[freq_],
+            level=DICT_GROUPBY_LEVELS[level_],
+        )
+    for level_ in DICT_GROUPBY_LEVELS:
+        benchmarks[
+            f"get_rolling_returns[{level_}]"
+        ] = lambda level_=level_: get_rolling_returns(
+            df_prices=case.df_prices,
+            df_registry=case.df_registry,
+            tickers_to_evaluate=case.ticker_list,
+            window=30,
+            level=DICT_GROUPBY_LEVELS[level_],
+        )
+    benchmarks.update(
+        {
+            "correlation_analysis": lambda: correlation_analysis(
+                case.df_rets, lookback_window=63
+            ),
+            "compute_metrics": lambda: compute_metrics(
+                df_returns=case.df_rets, risk_free_rate=3.0
+            ),
+            "compute_rolling_metrics": lambda: compute_rolling_metrics(
+                df_returns=case.df_rets
+            ),
+            "get_drawdown": lambda: get_drawdown(case.df_rets),
+            "get_portfolio_relative_risk_contribution": lambda: (
+                get_portfolio_relative_risk_contribution(
+                    df_prices=case.df_prices,
+                    df_shares=case.df_shares,
+                    df_registry=case.df_registry,
+                    level="asset_class",
+                )
+            ),
+            "simulate_future_growth": lambda: simulate_future_growth(
+                initial_wealth=case.df_j["position_value"].sum(),
+                annualised_return=0.05,
+                inflation=0.02,
+                monthly_investment=500,
+                years=30,
+                increase_investment=0.05,
+            ),
+        }
+    )
+    return benchmarks
+
+
+def patch_price_download(case: Case) -> None:
+    # Every module that imported get_full_price_history gets the fixture prices
+    def get_full_price_history(ticker_list: List[str]) -> Dict:
+        return {t_: case.price_history[t_] for t_ in ticker_list}
+
+    for module_ in list(sys.modules.values()):
+        if hasattr(module_, "get_full_price_history"):
+            setattr(module_, "get_full_price_history", get_full_price_history)
+
+
+def time_call(func: Callable[[], object], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run(grid: str, repeat: int, pattern: str) -> dict:
+    results = []
+    for params in GRIDS[grid]:
+        case = Case(*params)
+        patch_price_download(case)
+        for name_, func_ in get_benchmarks(case).items():
+            if not fnmatch.fnmatch(name_, pattern):
+                continue
+            base_name = name_.split("[")[0]
+            result = dict(benchmark=name_, case=case.name, **case.params)
+            if case.params["n_tickers"] > MAX_TICKERS.get(base_name, np.inf):
+                result["skipped"] = f"more than {MAX_TICKERS[base_name]} tickers"
+            else:
+                timings = time_call(func_, repeat=repeat)
+                result.update(
+                    median_s=statistics.median(timings),
+                    min_s=min(timings),
+                    runs_s=timings,
+                )
+            results.append(result)
+            print(
+                f"{case.name:>20} {name_:<55} "
+                + (
+                    f"{result['median_s'] * 1000:10.1f} ms"
+                    if "median_s" in result
+                    else f"{'skipped':>13}"
+                ),
+                flush=True,
+            )
+    return dict(
+        metadata=dict(
+            timestamp=datetime.now().isoformat(timespec="seconds"),
+            grid=grid,
+            repeat=repeat,
+            python=platform.python_version(),
+            pandas=pd.__version__,
+            numpy=np.__version__,
+            platform=platform.platform(),
+            processor=platform.processor(),
+        ),
+        results=results,
+    )
+
+
+def compare(
+    results: dict, baseline: dict, tolerance: float, noise_floor_s: float
+) -> List[dict]:
+    """Benchmarks whose median time grew by more than tolerance (as a fraction of
+    the baseline) and by more than noise_floor_s seconds."""
+    baseline_times = {
+        (r_["benchmark"], r_["case"]): r_["median_s"]
+        for r_ in baseline["results"]
+        if "median_s" in r_
+    }
+    regressions = []
+    for result_ in results["results"]:
+        key = (result_["benchmark"], result_["case"])
+        if "median_s" not in result_ or key not in baseline_times:
+            continue
+        before, after = baseline_times[key], result_["median_s"]
+        if after > before * (1 + tolerance) and after - before > noise_floor_s:
+            regressions.append(
+                dict(
+                    benchmark=key[0],
+                    case=key[1],
+                    baseline_s=before,
+                    median_s=after,
+                    ratio=after / before,
+                )
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--grid", choices=list(GRIDS), default="sweep")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only", default="*", help="glob on the benchmark names, e.g. 'get_period*'"
+    )
+    parser.add_argument("--output", type=Path, help="where to write the results")
+    parser.add_argument(
+        "--results", type=Path, help="compare these results instead of running"
+    )
+    parser.add_argument("--baseline", type=Path, help="results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--noise-floor-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.results is not None:
+        results = json.loads(args.results.read_text())
+    else:
+        results = run(grid=args.grid, repeat=args.repeat, pattern=args.only)
+        if args.output is not None:
+            args.output.write_text(json.dumps(results, indent=2))
+
+    if args.baseline is None:
+        return 0
+    regressions = compare(
+        results,
+        json.loads(args.baseline.read_text()),
+        tolerance=args.tolerance,
+        noise_floor_s=args.noise_floor_ms / 1000,
+    )
+    for regression_ in regressions:
+        print(
+            "REGRESSION {benchmark} [{case}]: {baseline_s:.4f}s -> {median_s:.4f}s "
+            "(x{ratio:.2f})".format(**regression_)
+        )
+    print(f"{len(regressions)} regression(s) over {args.tolerance:.0%} tolerance")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,8 @@ from pathlib import Path
 
 import streamlit as st
 
-from input_output import load_data, write_disclaimer
+from input_output import load_benchmarks
+from ui import load_data, write_disclaimer
 from var import (
     GLOBAL_STREAMLIT_STYLE,
     DATA_PATH,
@@ -11,6 +12,7 @@ from var import (
     APP_VERSION,
     COVER,
 )
+from perf import start_rerun, start_section, end_rerun
 
 st.set_page_config(
     page_title="PFN",
@@ -18,6 +20,7 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="auto",
 )
+start_rerun("Home")
 
 st.markdown(GLOBAL_STREAMLIT_STYLE, unsafe_allow_html=True)
 
@@ -54,6 +57,7 @@ col_l.image(COVER)
 
 st.markdown("***")
 
+start_section("What assets do you have in your portfolio?")
 st.markdown("## What assets do you have in your portfolio?")
 st.markdown(
     """
@@ -77,6 +81,7 @@ if uploaded_file is not None:
         df_storico, df_anagrafica = load_data(uploaded_file)
         st.session_state["data"] = df_storico
         st.session_state["dimensions"] = df_anagrafica
+        st.session_state["benchmarks"] = load_benchmarks(uploaded_file)
     except ValueError:
         st.error("Please check your file format and make sure it matches the template")
 
@@ -102,9 +107,11 @@ if st.button(
     df_storico, df_anagrafica = load_data(DATA_PATH / Path("demo.xlsx"))
     st.session_state["data"] = df_storico
     st.session_state["dimensions"] = df_anagrafica
+    st.session_state["benchmarks"] = load_benchmarks(DATA_PATH / Path("demo.xlsx"))
 
 st.markdown("***")
 
+start_section("How do I analyse my portfolio?")
 st.markdown("## How do I analyse my portfolio?")
 
 st.markdown(
@@ -148,3 +155,4 @@ st.markdown(
 )
 
 write_disclaimer()
+end_rerun()
@@ -1,18 +1,20 @@
 from datetime import datetime
 from typing import Literal
 
-import streamlit as st
 import pandas as pd
 import numpy as np
 
-from var import CACHE_EXPIRE_SECONDS
-from input_output import get_full_price_history
+from var import CACHE_EXPIRE_SECONDS, WEALTH_TICKERS_PER_BLOCK
+from cache import cache_data
+from input_output import get_price_panel
+from panel import ffill_rows, bfill_rows
+from perf import traced
 
 
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def aggregate_by_ticker(df: pd.DataFrame, in_pf_only: bool = False) -> pd.DataFrame:
     df_portfolio = (
-        df.groupby("ticker_yf")
+        df.groupby("ticker_yf", observed=True)
         .agg(
             shares=("shares", "sum"),
             ap_amount=("ap_amount", "sum"),
@@ -39,7 +41,8 @@ def aggregate_by_ticker(df: pd.DataFrame, in_pf_only: bool = False) -> pd.DataFr
     return df_portfolio.drop(columns="is_in_pf").reset_index(drop=True)
 
 
-@st.cache_data(ttl=10 * CACHE_EXPIRE_SECONDS, show_spinner=False)
+@traced
+@cache_data(ttl=10 * CACHE_EXPIRE_SECONDS)
 def get_wealth_history(
     df_transactions: pd.DataFrame, ticker_list: list[str]
 ) -> pd.DataFrame:
@@ -51,46 +54,52 @@ def get_wealth_history(
     # one or more purchases (as happened to MWRD on 17/01/2024); since in these cases
     # the history of the ‘old’ ETF is not retrieved, we assume that the first non-null
     # price found can be propagated (as a constant) backwards
-    df_prices = (
-        pd.concat(
-            [get_full_price_history(ticker_list)[t_] for t_ in ticker_list],
-            axis=1,
-        )
-        .loc[begin_date:]
-        .bfill()
-    )
-    df_prices.to_excel("df_prices.xlsx")
+    panel = get_price_panel(ticker_list).loc(start=begin_date)
+    prices = bfill_rows(panel.values)
+
+    # Calendar days plus trading days: on the days with no price, the value of each
+    # position is the last one available
+    dates = date_range.union(panel.dates)
+    price_pos = dates.get_indexer(panel.dates)
 
+    # Holdings are kept as events (date, ticker, shares), and turned into a dense
+    # dates x tickers block a few tickers at a time
     df_transactions = df_transactions[df_transactions["ticker_yf"].isin(ticker_list)]
+    event_date_pos = dates.get_indexer(df_transactions["transaction_date"])
+    event_ticker_pos = pd.Index(ticker_list).get_indexer(df_transactions["ticker_yf"])
+    event_shares = df_transactions["shares"].to_numpy(dtype=float)
+
+    daily_value = np.zeros(len(dates))
+    for first in range(0, len(ticker_list), WEALTH_TICKERS_PER_BLOCK):
+        last = min(first + WEALTH_TICKERS_PER_BLOCK, len(ticker_list))
+        in_block = (event_ticker_pos >= first) & (event_ticker_pos < last)
+        shares = np.zeros((len(dates), last - first))
+        np.add.at(
+            shares,
+            (event_date_pos[in_block], event_ticker_pos[in_block] - first),
+            event_shares[in_block],
+        )
+        position_value = np.full((len(dates), last - first), np.nan)
+        position_value[price_pos] = (
+            shares.cumsum(axis=0)[price_pos] * prices[:, first:last]
+        )
+        daily_value += np.nan_to_num(ffill_rows(position_value)).sum(axis=1)
 
-    df_asset_allocation = pd.DataFrame(index=date_range, columns=ticker_list, data=0)
-    df_cumulative_spent = pd.Series(index=date_range, data=0)
-
-    for (data, ticker), group in df_transactions.groupby(
-        ["transaction_date", "ticker_yf"]
-    ):
-        total_shares = group["shares"].sum()
-        total_spent = group["ap_amount"].sum()
-        df_asset_allocation.loc[data, ticker] += total_shares
-        df_cumulative_spent.loc[data] += total_spent
-
-    df_asset_allocation = df_asset_allocation.cumsum()
-    df_cumulative_spent = df_cumulative_spent.cumsum()
-
-    df_wealth = pd.DataFrame(
-        df_asset_allocation.multiply(df_prices.loc[begin_date:])
-        .ffill()
-        .sum(axis=1)
-        .rename("ap_daily_value")
-    )
+    cumulative_spent = np.bincount(
+        date_range.get_indexer(df_transactions["transaction_date"]),
+        weights=df_transactions["ap_amount"].to_numpy(dtype=float),
+        minlength=len(date_range),
+    ).cumsum()
+
+    df_wealth = pd.DataFrame({"ap_daily_value": daily_value}, index=dates)
     df_wealth["diff_previous_day"] = df_wealth["ap_daily_value"].diff()
-    df_wealth["ap_cum_spent"] = df_cumulative_spent
+    df_wealth["ap_cum_spent"] = pd.Series(cumulative_spent, index=date_range)
     df_wealth["ap_cum_pnl"] = df_wealth["ap_daily_value"] - df_wealth["ap_cum_spent"]
 
     return df_wealth
 
 
-@st.cache_data(ttl=10 * CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data(ttl=10 * CACHE_EXPIRE_SECONDS)
 def get_portfolio_pivot(
     df: pd.DataFrame,
     df_dimensions: pd.DataFrame,
@@ -123,7 +132,7 @@ def get_portfolio_pivot(
     return df_pivot
 
 
-@st.cache_data(ttl=10 * CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data(ttl=10 * CACHE_EXPIRE_SECONDS)
 def get_pnl_by_asset_class(
     df: pd.DataFrame,
     df_dimensions: pd.DataFrame,
@@ -133,3 +142,25 @@ def get_pnl_by_asset_class(
     df_pnl["pnl"] = ((df_pnl["price"] - df_pnl["dca"]) * df_pnl["shares"]).astype(float)
     df_pnl = df_pnl.groupby(group_by)["pnl"].sum().reset_index().sort_values([group_by])
     return df_pnl
+
+
+def get_holdings_history(
+    df_transactions: pd.DataFrame, ticker_list: list[str], dates: pd.DatetimeIndex
+) -> pd.DataFrame:
+    # Shares held at the end of each date; transactions made on non-trading days
+    # are carried to the next available date
+    df_holdings = (
+        df_transactions[df_transactions["ticker_yf"].isin(ticker_list)]
+        .pivot_table(
+            index="transaction_date",
+            columns="ticker_yf",
+            values="shares",
+            aggfunc="sum",
+            observed=True,
+        )
+        .reindex(columns=ticker_list)
+        .fillna(0)
+        .sort_index()
+        .cumsum()
+    )
+    return df_holdings.reindex(dates, method="ffill").fillna(0)
@@ -0,0 +1,456 @@
+"""Analyse a directory of portfolio workbooks from the command line.
+
+Every workbook (in the format of data/in/template.xlsx) goes through the pipeline of
+the pages: holdings and PnL, wealth history, returns, risk and a Monte Carlo
+projection. The prices of all the tickers, across workbooks, are downloaded once
+into a shared store; a pool of worker processes then analyses the workbooks, each
+one writing its tables (Parquet, or CSV when pyarrow is missing) and a static HTML
+report to its own folder. A summary of all the portfolios goes in the output root:
+
+    python src/batch.py data/in --output reports --workers 8
+"""
+import argparse
+import html
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pandas as pd
+import numpy as np
+
+from input_output import (
+    read_workbook,
+    get_last_closing_price,
+    get_price_history,
+    get_treasury_bill_rate,
+    PRICE_HISTORY_CACHE,
+    LAST_CLOSING_PRICE_CACHE,
+)
+from aggregation import aggregate_by_ticker, get_wealth_history
+from performance import get_money_weighted_returns
+from returns import get_period_returns
+from risk import (
+    compute_metrics,
+    get_drawdown,
+    get_portfolio_relative_risk_contribution,
+    get_portfolio_var_cvar,
+)
+from projection import (
+    simulate_future_growth,
+    get_flow_adjusted_monthly_returns,
+    simulate_bootstrap_growth,
+)
+from panel import get_available_average
+from plot import plot_wealth, plot_drawdown, plot_projection_bands
+from var import TRADING_DAYS_YEAR
+
+try:
+    import pyarrow  # noqa: F401
+
+    TABLE_FORMAT = "parquet"
+except ImportError:
+    TABLE_FORMAT = "csv"
+
+WORKBOOK_SUFFIXES = (".xlsx", ".xlsm", ".xls")
+# Tables shown in the HTML report, all of them are written to files
+REPORT_TABLES = {
+    "holdings": "Holdings",
+    "risk_metrics": "Last year risk metrics",
+    "risk_contribution": "Relative risk contribution",
+    "var": "Value at Risk",
+}
+
+
+def find_workbooks(directory: Path) -> List[Path]:
+    # Excel lock files (~$name.xlsx) and the empty template are left out
+    return sorted(
+        path_
+        for path_ in directory.iterdir()
+        if path_.suffix.lower() in WORKBOOK_SUFFIXES
+        and not path_.name.startswith("~$")
+        and path_.name != "template.xlsx"
+    )
+
+
+def read_portfolio(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame] | str:
+    # The data of the workbook, or the reason why it cannot be read
+    try:
+        return read_workbook(path)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def write_price_store(path: Path, ticker_list: List[str]) -> Dict[str, str]:
+    """Fetch every ticker once, concurrently, whatever the number of workbooks
+    holding it, and store the market data for the workers.
+
+    A ticker whose download raises is left out of the store; returns the error of
+    each of them, so that only the portfolios holding it fail.
+    """
+    store, errors = dict(), dict()
+    for name_, cache_ in [
+        ("price_history", PRICE_HISTORY_CACHE),
+        ("last_closing", LAST_CLOSING_PRICE_CACHE),
+    ]:
+        values = cache_.get_many(ticker_list, return_exceptions=True)
+        store[name_] = dict()
+        for ticker_, value_ in values.items():
+            if isinstance(value_, BaseException):
+                errors.setdefault(ticker_, f"{type(value_).__name__}: {value_}")
+            else:
+                store[name_][ticker_] = value_
+    pd.to_pickle(store, path)
+    return errors
+
+
+def load_price_store(path: Path) -> None:
+    # Initializer of the workers: the market data come from the store, the
+    # downloads in the analytics become cache hits. The entries never expire, so
+    # that long batches do not download them again
+    warnings.simplefilter("ignore", category=FutureWarning)
+    store = pd.read_pickle(path)
+    PRICE_HISTORY_CACHE.put_many(store["price_history"], ttl_seconds=float("inf"))
+    LAST_CLOSING_PRICE_CACHE.put_many(store["last_closing"], ttl_seconds=float("inf"))
+
+
+def analyse_portfolio(
+    df_transactions: pd.DataFrame,
+    df_registry: pd.DataFrame,
+    risk_free_rate: float,
+    years: int,
+    annualised_return: float,
+    inflation: float,
+    monthly_investment: float,
+    increase_investment: float,
+) -> Tuple[Dict[str, pd.DataFrame], Dict]:
+    """Tables of a portfolio, as computed by the pages, and its headline figures."""
+    df_pf = aggregate_by_ticker(df_transactions, in_pf_only=True)
+    ticker_list = df_pf["ticker_yf"].to_list()
+    df_last_closing = get_last_closing_price(ticker_list=ticker_list)
+
+    df_holdings = df_pf.merge(
+        df_last_closing[["ticker_yf", "last_closing_date", "price"]],
+        how="left",
+        on="ticker_yf",
+    ).merge(
+        df_registry.drop_duplicates("ticker_yf")[
+            ["ticker_yf", "name", "asset_class", "macro_asset_class"]
+        ],
+        how="left",
+        on="ticker_yf",
+    )
+    df_holdings["price"] = df_holdings["price"].astype(float)
+    df_holdings["position_value"] = df_holdings["shares"] * df_holdings["price"]
+    df_holdings["pnl"] = df_holdings["position_value"] - (
+        df_holdings["shares"] * df_holdings["dca"]
+    )
+    pf_value = df_holdings["position_value"].sum()
+    df_holdings["weight_pf"] = df_holdings["position_value"] / pf_value
+
+    df_wealth = get_wealth_history(df_transactions, ticker_list)
+    df_prices = get_price_history(ticker_list=ticker_list)
+    df_rets = get_period_returns(
+        df=df_prices,
+        df_registry=df_registry,
+        tickers_to_evaluate=ticker_list,
+        period=None,
+        level="ticker",
+    )
+    df_monthly_rets = get_period_returns(
+        df=df_prices,
+        df_registry=df_registry,
+        tickers_to_evaluate=ticker_list,
+        period="M",
+        level="ticker",
+    )
+
+    weights = df_holdings.set_index("ticker_yf")["position_value"]
+    pf_rets = pd.Series(
+        get_available_average(
+            df_rets.to_numpy(dtype=float),
+            weights.reindex(df_rets.columns).fillna(0).to_numpy(),
+        ),
+        index=df_rets.index,
+        name="Portfolio",
+    )
+    df_last_year = df_rets.join(pf_rets).iloc[-TRADING_DAYS_YEAR:]
+    df_metrics = compute_metrics(
+        df_returns=df_last_year,
+        risk_free_rate=risk_free_rate,
+        trading_days=len(df_last_year),
+    )
+    df_drawdown = get_drawdown(pf_rets.to_frame())
+    df_rrc = get_portfolio_relative_risk_contribution(
+        df_prices=df_prices,
+        df_shares=df_holdings.set_index("ticker_yf")[["shares"]],
+        df_registry=df_registry[df_registry["ticker_yf"].isin(ticker_list)],
+        level="ticker",
+    )
+    df_var = get_portfolio_var_cvar(df_rets=df_rets, weights=weights)
+
+    future_wealth, _ = simulate_future_growth(
+        pf_value,
+        annualised_return,
+        inflation,
+        monthly_investment,
+        years,
+        increase_investment,
+    )
+    df_bands, prob_target = simulate_bootstrap_growth(
+        monthly_returns=get_flow_adjusted_monthly_returns(df_wealth),
+        initial_wealth=pf_value,
+        inflation=inflation,
+        monthly_investment=monthly_investment,
+        years=years,
+        increase_investment=increase_investment,
+        target_wealth=float(round(future_wealth[-1], -3)),
+    )
+    df_projection = df_bands.assign(
+        deterministic=future_wealth, prob_target=prob_target
+    )
+
+    invested = (df_holdings["shares"] * df_holdings["dca"]).sum()
+    summary = {
+        "n_transactions": len(df_transactions),
+        "n_tickers": len(ticker_list),
+        "value": pf_value,
+        "invested": invested,
+        "pnl": pf_value - invested,
+        "roi": pf_value / invested - 1 if invested else np.nan,
+        "mwr": get_money_weighted_returns(
+            df_transactions=df_transactions, df_last_closing=df_last_closing
+        )["Portfolio"],
+        "volatility": df_metrics.loc["Portfolio", "Volatility"],
+        "max_drawdown": df_drawdown["Portfolio"].min(),
+        "var_95_1d": df_var.iloc[0].get("VaR 95%", np.nan),
+        "target_wealth": round(future_wealth[-1], -3),
+        "prob_target": prob_target.iloc[-1],
+    }
+    tables = {
+        "holdings": df_holdings,
+        "wealth": df_wealth,
+        "daily_returns": df_rets.assign(Portfolio=pf_rets),
+        "monthly_returns": df_monthly_rets,
+        "risk_metrics": df_metrics,
+        "risk_contribution": df_rrc,
+        "var": df_var,
+        "drawdown": df_drawdown,
+        "projection": df_projection,
+    }
+    return tables, summary
+
+
+def write_table(df: pd.DataFrame, path: Path) -> Path:
+    path = path.with_suffix(f".{TABLE_FORMAT}")
+    if TABLE_FORMAT == "parquet":
+        # Parquet wants string column names
+        df.rename(columns=str).to_parquet(path)
+    else:
+        df.to_csv(path)
+    return path
+
+
+def write_report(
+    path: Path, name: str, tables: Dict[str, pd.DataFrame], summary: Dict
+) -> None:
+    # One self-contained page; plotly.js is loaded once, from its CDN
+    figures = [
+        ("Wealth", plot_wealth(df=tables["wealth"])),
+        ("Drawdown", plot_drawdown(df=tables["drawdown"])),
+        (
+            "Projection",
+            plot_projection_bands(
+                tables["projection"].drop(columns=["deterministic", "prob_target"]),
+                tables["projection"]["deterministic"].to_numpy(),
+            ),
+        ),
+    ]
+    body = [
+        f"<h1>{html.escape(name)}</h1>",
+        pd.Series(summary, name="value")
+        .to_frame()
+        .to_html(float_format="{:,.4g}".format),
+    ]
+    for i_, (title_, fig_) in enumerate(figures):
+        body.append(f"<h2>{title_}</h2>")
+        body.append(
+            fig_.to_html(full_html=False, include_plotlyjs="cdn" if i_ == 0 else False)
+        )
+    for table_, title_ in REPORT_TABLES.items():
+        body.append(f"<h2>{title_}</h2>")
+        body.append(tables[table_].to_html(float_format="{:,.4g}".format))
+    path.write_text(
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<title>{html.escape(name)}</title></head><body>"
+        + "\n".join(body)
+        + "</body></html>",
+        encoding="utf-8",
+    )
+
+
+def run_portfolio(
+    name: str,
+    df_transactions: pd.DataFrame,
+    df_registry: pd.DataFrame,
+    output_dir: Path,
+    options: Dict,
+) -> Dict:
+    # Analysis and outputs of one workbook, in a worker: failures are reported in
+    # the summary, so that one bad workbook does not stop the batch
+    start = time.perf_counter()
+    row = {"portfolio": name, "status": "ok", "error": ""}
+    try:
+        if df_transactions.empty:
+            row["status"] = "empty"
+        else:
+            tables, summary = analyse_portfolio(df_transactions, df_registry, **options)
+            portfolio_dir = output_dir / name
+            portfolio_dir.mkdir(parents=True, exist_ok=True)
+            for table_, df_ in tables.items():
+                write_table(df_, portfolio_dir / table_)
+            write_report(portfolio_dir / "report.html", name, tables, summary)
+            row.update(summary)
+    except Exception:
+        row["status"] = "error"
+        row["error"] = traceback.format_exc(limit=-3)
+    row["seconds"] = time.perf_counter() - start
+    return row
+
+
+def write_index(path: Path, df_summary: pd.DataFrame) -> None:
+    links = df_summary["portfolio"].map(
+        lambda name_: f"<a href='{html.escape(name_)}/report.html'>{html.escape(name_)}</a>"
+    )
+    path.write_text(
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Portfolios</title>"
+        "</head><body><h1>Portfolios</h1>"
+        + df_summary.drop(columns="error")
+        .assign(portfolio=links)
+        .to_html(index=False, escape=False, float_format="{:,.4g}".format)
+        + "</body></html>",
+        encoding="utf-8",
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", type=Path, help="folder of the workbooks")
+    parser.add_argument("--output", type=Path, default=Path("reports"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--years", type=int, default=10, help="years to project")
+    parser.add_argument("--annualised-return", type=float, default=0.05)
+    parser.add_argument("--inflation", type=float, default=0.02)
+    parser.add_argument("--monthly-investment", type=float, default=500)
+    parser.add_argument(
+        "--increase-investment",
+        type=float,
+        default=0.05,
+        help="increase of the monthly investment every 5 years",
+    )
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", category=FutureWarning)
+
+    paths = find_workbooks(args.directory)
+    if not paths:
+        print(f"No workbooks in {args.directory}", file=sys.stderr)
+        return 1
+    args.output.mkdir(parents=True, exist_ok=True)
+    # Fresh interpreters: the parent holds the download threads, unsafe to fork
+    context = multiprocessing.get_context("spawn")
+
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as executor:
+        portfolios = dict(
+            zip([p_.stem for p_ in paths], executor.map(read_portfolio, paths))
+        )
+    rows = [
+        {"portfolio": name_, "status": "error", "error": data_}
+        for name_, data_ in portfolios.items()
+        if isinstance(data_, str)
+    ]
+    for row_ in rows:
+        print(f"{row_['portfolio']}: {row_['error']}", file=sys.stderr)
+    portfolios = {n_: d_ for n_, d_ in portfolios.items() if not isinstance(d_, str)}
+
+    portfolio_tickers = {
+        name_: aggregate_by_ticker(df_transactions_, in_pf_only=True)["ticker_yf"]
+        for name_, (df_transactions_, _) in portfolios.items()
+    }
+    ticker_list = sorted(set().union(*portfolio_tickers.values()))
+    options = dict(
+        risk_free_rate=get_treasury_bill_rate(),
+        years=args.years,
+        annualised_return=args.annualised_return,
+        inflation=args.inflation,
+        monthly_investment=args.monthly_investment,
+        increase_investment=args.increase_investment,
+    )
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as store_dir:
+        store_path = Path(store_dir) / "prices.pkl"
+        ticker_errors = write_price_store(store_path, ticker_list)
+        print(
+            f"{len(ticker_list)} tickers of {len(portfolios)} portfolios downloaded"
+            f" in {time.perf_counter() - start:.1f} s",
+            flush=True,
+        )
+        for ticker_, error_ in ticker_errors.items():
+            print(f"{ticker_}: {error_}", file=sys.stderr)
+        # The portfolios holding a ticker that could not be downloaded fail alone
+        for name_, tickers_ in portfolio_tickers.items():
+            failed = [t_ for t_ in tickers_ if t_ in ticker_errors]
+            if failed:
+                rows.append(
+                    {
+                        "portfolio": name_,
+                        "status": "error",
+                        "error": "; ".join(
+                            f"{t_}: {ticker_errors[t_]}" for t_ in failed
+                        ),
+                        "seconds": 0.0,
+                    }
+                )
+                print(f"{name_:<40} {'error':<6} {0:8.1f} s", flush=True)
+                del portfolios[name_]
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=context,
+            initializer=load_price_store,
+            initargs=(store_path,),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    run_portfolio,
+                    name_,
+                    *data_,
+                    output_dir=args.output,
+                    options=options,
+                )
+                for name_, data_ in portfolios.items()
+            ]
+            for future_ in futures:
+                row = future_.result()
+                rows.append(row)
+                print(
+                    f"{row['portfolio']:<40} {row['status']:<6} {row['seconds']:8.1f} s",
+                    flush=True,
+                )
+
+    df_summary = pd.DataFrame(rows)
+    write_table(df_summary.set_index("portfolio"), args.output / "summary")
+    write_index(args.output / "index.html", df_summary)
+    print(
+        f"{len(rows)} workbooks in {time.perf_counter() - start:.1f} s,"
+        f" reports in {args.output}"
+    )
+    return int(df_summary["status"].eq("error").any())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
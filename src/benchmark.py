@@ -0,0 +1,83 @@
+from typing import List
+
+import pandas as pd
+import numpy as np
+
+from input_output import get_full_price_history
+from var import CACHE_EXPIRE_SECONDS
+from cache import cache_data
+
+
+@cache_data(ttl=10 * CACHE_EXPIRE_SECONDS)
+def get_benchmark_history(benchmark_list: List[str]) -> pd.DataFrame:
+    full_history = get_full_price_history(benchmark_list)
+    return pd.concat([full_history[b_] for b_ in benchmark_list], axis=1)
+
+
+def align_to_dates(df_prices: pd.DataFrame, dates: pd.DatetimeIndex) -> pd.DataFrame:
+    # Prices on the given dates, the last known value carried over the days on
+    # which the security was not quoted
+    return df_prices.reindex(df_prices.index.union(dates)).ffill().loc[dates]
+
+
+@cache_data()
+def get_benchmark_metrics(
+    df_rets: pd.DataFrame,
+    df_benchmark_rets: pd.DataFrame,
+    periods_per_year: int,
+) -> pd.DataFrame:
+    """Beta, alpha, tracking error, information ratio and up/down capture of every
+    column of df_rets against every benchmark.
+
+    All the single-factor regressions are solved at once from the first and second
+    moments of the aligned returns, so the cost is a few matrix products rather than
+    a regression per pair. Each pair uses the dates on which both returns exist, so a
+    recently listed series does not shorten the history of the others. Alpha,
+    tracking error and information ratio are annualised.
+    """
+    df_aligned = df_rets.join(df_benchmark_rets, how="inner", rsuffix="_benchmark")
+    rets = df_aligned.iloc[:, : df_rets.shape[1]].to_numpy(dtype=float)
+    bench = df_aligned.iloc[:, df_rets.shape[1] :].to_numpy(dtype=float)
+    # Masks of the available returns, and returns with zeros in place of the NaNs:
+    # every (benchmarks x series) moment below is restricted to the common dates
+    has_rets = (~np.isnan(rets)).astype(float)
+    has_bench = (~np.isnan(bench)).astype(float)
+    rets, bench = np.nan_to_num(rets), np.nan_to_num(bench)
+    n_obs = has_bench.T @ has_rets
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sum_rets, sum_bench = has_bench.T @ rets, bench.T @ has_rets
+        mean_rets, mean_bench = sum_rets / n_obs, sum_bench / n_obs
+        cov = (bench.T @ rets - sum_bench * mean_rets) / (n_obs - 1)
+        var_bench = ((bench**2).T @ has_rets - sum_bench * mean_bench) / (n_obs - 1)
+        var_rets = (has_bench.T @ rets**2 - sum_rets * mean_rets) / (n_obs - 1)
+        beta = cov / var_bench
+        alpha = mean_rets - beta * mean_bench
+        # Var(r - b) = Var(r) + Var(b) - 2 Cov(r, b)
+        tracking_error = np.sqrt(np.clip(var_rets + var_bench - 2 * cov, 0, None))
+        active_return = mean_rets - mean_bench
+        information_ratio = active_return * np.sqrt(periods_per_year) / tracking_error
+        # Average return in the periods in which the benchmark rose (fell), over the
+        # average return of the benchmark in the same periods
+        is_up, is_down = (bench > 0).astype(float), (bench < 0).astype(float)
+        up_capture = (is_up.T @ rets / (is_up.T @ has_rets)) / (
+            (bench * is_up).T @ has_rets / (is_up.T @ has_rets)
+        )
+        down_capture = (is_down.T @ rets / (is_down.T @ has_rets)) / (
+            (bench * is_down).T @ has_rets / (is_down.T @ has_rets)
+        )
+
+    metrics = {
+        "beta": beta,
+        "alpha": alpha * periods_per_year,
+        "tracking_error": tracking_error * np.sqrt(periods_per_year),
+        "information_ratio": information_ratio,
+        "up_capture": up_capture,
+        "down_capture": down_capture,
+    }
+    index = pd.MultiIndex.from_product(
+        [df_benchmark_rets.columns, df_rets.columns], names=["benchmark", "series"]
+    )
+    return pd.DataFrame(
+        {name_: values_.ravel() for name_, values_ in metrics.items()}, index=index
+    )
@@ -0,0 +1,362 @@
+"""Central policy of the analytics caches.
+
+Every cached function goes through cache_data, which sets its entry limit: the one in
+DICT_CACHE_MAX_ENTRIES or, failing that, the default CACHE_MAX_ENTRIES. Both can be
+overridden from the environment, with PFN_CACHE_MAX_ENTRIES_<FUNCTION NAME> for a
+single function and with PFN_CACHE_MAX_ENTRIES for the default (0 meaning no limit).
+
+The caching itself is done by a pluggable backend, looked up at each call, so that it
+can be set after the analytics are imported. The default one, used by the app as well
+as by notebooks, scripts and worker processes, keeps the results in the process and
+does not involve Streamlit.
+
+It keeps the entries pickled, in storages made by the same manager. All the storages
+share a memory budget (PFN_CACHE_BUDGET_MB, or CACHE_MEMORY_BUDGET_MB): once it is
+exceeded, the least recently used entries are evicted, whatever the function they
+belong to.
+"""
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+import pandas as pd
+import numpy as np
+
+from var import (
+    CACHE_EXPIRE_SECONDS,
+    CACHE_MAX_ENTRIES,
+    CACHE_MEMORY_BUDGET_MB,
+    CACHE_BUDGET_ENV_VAR,
+    CACHE_MAX_ENTRIES_ENV_VAR,
+    DICT_CACHE_MAX_ENTRIES,
+)
+
+
+def _get_env_int(name: str, default: int) -> int:
+    value = os.environ.get(name, "").strip()
+    return int(value) if value else default
+
+
+def get_max_entries(function_name: str) -> int | None:
+    default = _get_env_int(CACHE_MAX_ENTRIES_ENV_VAR, CACHE_MAX_ENTRIES)
+    max_entries = _get_env_int(
+        f"{CACHE_MAX_ENTRIES_ENV_VAR}_{function_name.upper()}",
+        DICT_CACHE_MAX_ENTRIES.get(function_name, default),
+    )
+    return max_entries if max_entries > 0 else None
+
+
+class BudgetedMemoryStorage:
+    """In-memory storage of a cached function, whose entries live in its manager."""
+
+    def __init__(
+        self,
+        manager: "BudgetedStorageManager",
+        function_key: str,
+        function_name: str,
+        ttl_seconds: float | None,
+        max_entries: int | None,
+    ):
+        self.manager = manager
+        self.function_key = function_key
+        self.function_name = function_name
+        self.ttl_seconds = ttl_seconds or float("inf")
+        self.max_entries = max_entries
+        # Keys of the function, from the least to the most recently used
+        self.keys: OrderedDict[str, None] = OrderedDict()
+
+    def get(self, key: str) -> bytes:
+        # KeyError if the entry is missing or expired
+        return self.manager.get_entry(self, key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.manager.set_entry(self, key, value)
+
+    def delete(self, key: str) -> None:
+        self.manager.delete_entry(self, key)
+
+    def clear(self) -> None:
+        self.manager.clear_storage(self)
+
+    def close(self) -> None:
+        # The storage is being replaced: its entries can no longer be reached
+        self.manager.clear_storage(self)
+
+    def get_entry_sizes(self) -> List[int]:
+        return self.manager.get_entry_sizes(self)
+
+
+class BudgetedStorageManager:
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.size_bytes = 0
+        self.n_evictions = 0
+        self._lock = threading.Lock()
+        # (function key, key) -> (pickled value, expiry time, storage), from the least
+        # to the most recently used
+        self._entries: OrderedDict[Tuple[str, str], Tuple] = OrderedDict()
+        self._storages: Dict[str, BudgetedMemoryStorage] = {}
+
+    def create_storage(
+        self,
+        function_key: str,
+        function_name: str,
+        ttl_seconds: float | None,
+        max_entries: int | None,
+    ) -> BudgetedMemoryStorage:
+        storage = BudgetedMemoryStorage(
+            manager=self,
+            function_key=function_key,
+            function_name=function_name,
+            ttl_seconds=ttl_seconds,
+            max_entries=max_entries,
+        )
+        replaced = self._storages.get(function_key)
+        if replaced is not None:
+            replaced.close()
+        with self._lock:
+            self._storages[function_key] = storage
+        return storage
+
+    def clear_all(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            for storage_ in self._storages.values():
+                storage_.keys.clear()
+            self.size_bytes = 0
+
+    def _pop(self, storage: BudgetedMemoryStorage, key: str) -> None:
+        value, _, _ = self._entries.pop((storage.function_key, key))
+        storage.keys.pop(key, None)
+        self.size_bytes -= len(value)
+
+    def get_entry(self, storage: BudgetedMemoryStorage, key: str) -> bytes:
+        entry_key = (storage.function_key, key)
+        with self._lock:
+            if entry_key not in self._entries:
+                raise KeyError("Key not found in mem cache")
+            value, expiry, _ = self._entries[entry_key]
+            if time.monotonic() > expiry:
+                self._pop(storage, key)
+                raise KeyError("Key expired in mem cache")
+            self._entries.move_to_end(entry_key)
+            storage.keys.move_to_end(key)
+            return value
+
+    def set_entry(self, storage: BudgetedMemoryStorage, key: str, value: bytes) -> None:
+        entry_key = (storage.function_key, key)
+        with self._lock:
+            if entry_key in self._entries:
+                self._pop(storage, key)
+            self._entries[entry_key] = (
+                value,
+                time.monotonic() + storage.ttl_seconds,
+                storage,
+            )
+            storage.keys[key] = None
+            self.size_bytes += len(value)
+            # The entry limit of the function first, then the global budget; the new
+            # entry is never evicted, even if it exceeds the budget on its own
+            while storage.max_entries and len(storage.keys) > storage.max_entries:
+                self._pop(storage, next(iter(storage.keys)))
+                self.n_evictions += 1
+            while self.size_bytes > self.budget_bytes and len(self._entries) > 1:
+                (_, lru_key), (_, _, lru_storage) = next(iter(self._entries.items()))
+                self._pop(lru_storage, lru_key)
+                self.n_evictions += 1
+
+    def delete_entry(self, storage: BudgetedMemoryStorage, key: str) -> None:
+        with self._lock:
+            if (storage.function_key, key) in self._entries:
+                self._pop(storage, key)
+
+    def clear_storage(self, storage: BudgetedMemoryStorage) -> None:
+        with self._lock:
+            for key_ in list(storage.keys):
+                self._pop(storage, key_)
+
+    def get_entry_sizes(self, storage: BudgetedMemoryStorage) -> List[int]:
+        with self._lock:
+            return [
+                len(self._entries[(storage.function_key, key_)][0])
+                for key_ in storage.keys
+            ]
+
+    def get_report(self) -> pd.DataFrame:
+        with self._lock:
+            rows = [
+                (
+                    storage_.function_name,
+                    len(storage_.keys),
+                    storage_.max_entries,
+                    sum(
+                        len(self._entries[(storage_.function_key, key_)][0])
+                        for key_ in storage_.keys
+                    ),
+                )
+                for storage_ in self._storages.values()
+            ]
+        return (
+            pd.DataFrame(
+                rows, columns=["function", "entries", "max_entries", "size_mb"]
+            )
+            .assign(size_mb=lambda df_: df_["size_mb"] / 2**20)
+            .query("entries > 0")
+            .sort_values("size_mb", ascending=False)
+            .reset_index(drop=True)
+        )
+
+
+STORAGE_MANAGER = BudgetedStorageManager(
+    budget_bytes=_get_env_int(CACHE_BUDGET_ENV_VAR, CACHE_MEMORY_BUDGET_MB) * 2**20
+)
+
+
+def _update_hash(hasher: Any, value: Any) -> None:
+    # TypeError (or a pickling error) if the value cannot be hashed
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        hasher.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+        if isinstance(value, pd.DataFrame):
+            _update_hash(hasher, value.columns)
+            hasher.update(repr(value.dtypes.tolist()).encode())
+        else:
+            hasher.update(repr((value.name, value.dtype)).encode())
+    elif isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        hasher.update(repr((value.dtype, value.shape)).encode())
+        hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f"{type(value).__name__}:{len(value)}".encode())
+        for item_ in value:
+            _update_hash(hasher, item_)
+    elif isinstance(value, dict):
+        hasher.update(f"dict:{len(value)}".encode())
+        for key_, item_ in value.items():
+            _update_hash(hasher, key_)
+            _update_hash(hasher, item_)
+    else:
+        hasher.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def get_value_key(arguments: Dict[str, Any]) -> str:
+    # As in st.cache_data, the arguments named with a leading underscore are not hashed
+    hasher = hashlib.blake2b(digest_size=16)
+    for name_, value_ in arguments.items():
+        if not name_.startswith("_"):
+            hasher.update(name_.encode())
+            _update_hash(hasher, value_)
+    return hasher.hexdigest()
+
+
+def memory_cache_backend(
+    func: Callable, ttl: float | None, max_entries: int | None
+) -> Callable:
+    """Cache of func in the process, on a storage of STORAGE_MANAGER.
+
+    Results are pickled like in st.cache_data, so that a caller modifying one does
+    not alter the cached entry. Calls whose arguments or result cannot be hashed or
+    pickled are simply not cached.
+    """
+    function_name = f"{func.__module__}.{func.__qualname__}"
+    storage = STORAGE_MANAGER.create_storage(
+        function_key=function_name,
+        function_name=function_name,
+        ttl_seconds=ttl,
+        max_entries=max_entries,
+    )
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def cached(*args, **kwargs):
+        try:
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            key = get_value_key(arguments.arguments)
+        except (TypeError, pickle.PicklingError, AttributeError):
+            return func(*args, **kwargs)
+        try:
+            return pickle.loads(storage.get(key))
+        except KeyError:
+            pass
+        value = func(*args, **kwargs)
+        try:
+            storage.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except (TypeError, pickle.PicklingError, AttributeError):
+            pass
+        return value
+
+    cached.clear = storage.clear
+    return cached
+
+
+_backend = memory_cache_backend
+
+
+def set_cache_backend(backend: Callable) -> None:
+    """Cache the functions with backend(func, ttl, max_entries) from their next call.
+
+    The backend returns the cached version of func, with a clear method.
+    """
+    global _backend
+    _backend = backend
+
+
+class CachedFunction:
+    """A function cached by the backend in use at the time of each call."""
+
+    def __init__(self, func: Callable, ttl: float | None):
+        functools.update_wrapper(self, func)
+        # Called on a cache miss; perf.traced replaces it to tell a hit from a miss
+        self.func = func
+        self.ttl = ttl
+        self.max_entries = get_max_entries(func.__name__)
+        self._lock = threading.Lock()
+        self._backend = None
+        self._cached = None
+
+    def _get_cached(self) -> Callable:
+        backend = _backend
+        with self._lock:
+            if self._backend is not backend:
+
+                @functools.wraps(self.func)
+                def compute(*args, **kwargs):
+                    return self.func(*args, **kwargs)
+
+                self._cached = backend(compute, self.ttl, self.max_entries)
+                self._backend = backend
+            return self._cached
+
+    def __call__(self, *args, **kwargs):
+        return self._get_cached()(*args, **kwargs)
+
+    def __reduce__(self) -> str:
+        # Pickled by reference, like the function it replaces (e.g. to be sent to
+        # a worker process)
+        return self.__qualname__
+
+    def clear(self) -> None:
+        if self._cached is not None:
+            self._cached.clear()
+
+
+def cache_data(ttl: float = CACHE_EXPIRE_SECONDS) -> Callable:
+    def decorator(func: Callable) -> CachedFunction:
+        return CachedFunction(func, ttl=ttl)
+
+    return decorator
+
+
+def clear_caches() -> None:
+    """Drop the entries of every cached function, whatever its backend."""
+    STORAGE_MANAGER.clear_all()
+
+
+def get_cache_report() -> pd.DataFrame:
+    """Entries and memory of each cached function, the largest first."""
+    return STORAGE_MANAGER.get_report()
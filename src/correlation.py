@@ -0,0 +1,157 @@
+import pandas as pd
+import numpy as np
+
+from cache import cache_data
+from covariance import get_pairwise_comoments
+
+
+def get_average_linkage(distance: np.ndarray) -> np.ndarray:
+    """Agglomerative clustering with average linkage, in the (n-1) x 4 format of
+    scipy's linkage: merged cluster ids, merge distance and size of the new cluster.
+
+    Distances to a merged cluster follow the Lance-Williams update, so each of the
+    n-1 merges costs one O(n^2) scan of the distance matrix.
+    """
+    n_obs = distance.shape[0]
+    distance = distance.astype(float, copy=True)
+    np.fill_diagonal(distance, np.inf)
+    cluster_ids = np.arange(n_obs)
+    sizes = np.ones(n_obs)
+    linkage = np.zeros((n_obs - 1, 4))
+    for step in range(n_obs - 1):
+        i, j = np.unravel_index(np.argmin(distance), distance.shape)
+        i, j = min(i, j), max(i, j)
+        linkage[step] = [
+            cluster_ids[i],
+            cluster_ids[j],
+            distance[i, j],
+            sizes[i] + sizes[j],
+        ]
+        # Row i becomes the merged cluster, row j is switched off
+        merged = (sizes[i] * distance[i] + sizes[j] * distance[j]) / (
+            sizes[i] + sizes[j]
+        )
+        distance[i, :] = distance[:, i] = merged
+        distance[j, :] = distance[:, j] = np.inf
+        distance[i, i] = np.inf
+        cluster_ids[i] = n_obs + step
+        sizes[i] += sizes[j]
+    return linkage
+
+
+def _get_leaf_order(linkage: np.ndarray) -> list[int]:
+    # Leaves from left to right, visiting the dendrogram from its root
+    n_obs = linkage.shape[0] + 1
+    order, stack = [], [2 * n_obs - 2]
+    while stack:
+        node = stack.pop()
+        if node < n_obs:
+            order.append(node)
+        else:
+            left, right = linkage[node - n_obs, :2].astype(int)
+            stack.extend([right, left])
+    return order
+
+
+def _cut_tree(linkage: np.ndarray, n_clusters: int) -> np.ndarray:
+    # Cluster label of each leaf, stopping the merges when n_clusters are left
+    n_obs = linkage.shape[0] + 1
+    members = {leaf_: [leaf_] for leaf_ in range(n_obs)}
+    for step, (left, right) in enumerate(linkage[: n_obs - n_clusters, :2].astype(int)):
+        members[n_obs + step] = members.pop(left) + members.pop(right)
+    labels = np.empty(n_obs, dtype=int)
+    for label_, leaves_ in enumerate(members.values()):
+        labels[leaves_] = label_
+    return labels
+
+
+@cache_data()
+def get_correlation_matrix(
+    df_rets: pd.DataFrame, method: str = "pearson"
+) -> pd.DataFrame:
+    """Correlation of each pair of columns on the dates on which both have a return.
+
+    Pearson's comes from the pairwise co-moments in a few matrix products; the rank
+    correlations are left to pandas, which is pairwise-complete as well.
+    """
+    if method != "pearson":
+        return df_rets.corr(method=method)
+    _, comoment, sq_deviations = get_pairwise_comoments(df_rets.to_numpy(dtype=float))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = comoment / np.sqrt(sq_deviations * sq_deviations.T)
+    return pd.DataFrame(
+        np.clip(corr, -1, 1), index=df_rets.columns, columns=df_rets.columns
+    )
+
+
+@cache_data()
+def get_clustered_correlation(
+    df_corr: pd.DataFrame, max_size: int = 40
+) -> tuple[pd.DataFrame, pd.Series]:
+    """Correlation matrix reordered by hierarchical clustering, so that correlated
+    series lie next to each other.
+
+    Above max_size series, the tree is cut into max_size clusters and the matrix is
+    collapsed into blocks holding the average correlation between (and within)
+    clusters, which keeps the heatmap size bounded. Returns the matrix and the
+    series in each of its rows.
+    """
+    corr = df_corr.to_numpy(dtype=float)
+    distance = np.sqrt(np.clip(0.5 * (1 - np.nan_to_num(corr)), 0, None))
+    linkage = get_average_linkage(distance)
+    order = _get_leaf_order(linkage)
+    names = df_corr.columns[order]
+    if len(order) <= max_size:
+        return df_corr.iloc[order, order], pd.Series(
+            [[name_] for name_ in names], index=names, name="members"
+        )
+
+    labels = _cut_tree(linkage, n_clusters=max_size)[order]
+    # Clusters numbered by their first appearance in the leaf order
+    _, first_seen = np.unique(labels, return_index=True)
+    labels = np.argsort(np.argsort(first_seen))[labels]
+    one_hot = np.eye(max_size)[labels]
+    sizes = one_hot.sum(axis=0)
+    corr_ordered = np.nan_to_num(corr[np.ix_(order, order)])
+    block_sum = one_hot.T @ corr_ordered @ one_hot
+    # The diagonal of a block excludes the trivial self-correlations
+    pairs = np.outer(sizes, sizes) - np.diag(sizes)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        block_corr = (block_sum - np.diag(sizes)) / pairs
+    block_corr[np.diag_indices(max_size)] = np.where(sizes > 1, np.diag(block_corr), 1)
+    block_names = [
+        names[labels == k_][0]
+        if size_ == 1
+        else f"{names[labels == k_][0]} & {size_ - 1:.0f} more"
+        for k_, size_ in enumerate(sizes)
+    ]
+    members = pd.Series(
+        [names[labels == k_].to_list() for k_ in range(max_size)],
+        index=block_names,
+        name="members",
+    )
+    return (
+        pd.DataFrame(block_corr, index=block_names, columns=block_names),
+        members,
+    )
+
+
+def get_top_correlation_pairs(
+    df_corr: pd.DataFrame, k: int = 10, strongest: bool = True
+) -> pd.DataFrame:
+    # k pairs with the highest (or lowest) correlation, from the upper triangle only
+    corr = df_corr.to_numpy(dtype=float)
+    rows, cols = np.triu_indices_from(corr, k=1)
+    values = corr[rows, cols]
+    values = np.where(np.isnan(values), -np.inf if strongest else np.inf, values)
+    k = min(k, len(values))
+    keys = -values if strongest else values
+    top = np.argpartition(keys, k - 1)[:k] if k > 0 else np.array([], dtype=int)
+    top = top[np.argsort(keys[top])]
+    return pd.DataFrame(
+        {
+            "first": df_corr.index[rows[top]],
+            "second": df_corr.columns[cols[top]],
+            "correlation": corr[rows[top], cols[top]],
+        }
+    )
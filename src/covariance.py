@@ -0,0 +1,210 @@
+from typing import Literal
+
+import pandas as pd
+import numpy as np
+
+from var import COVARIANCE_EWMA_HALFLIFE
+from cache import cache_data
+
+
+class CovarianceEngine:
+    """Covariance of returns that can be updated one bar at a time.
+
+    Observations are weighted by decay^age, with decay = 1 for the sample estimator
+    and decay = 0.5^(1/halflife) for the exponentially weighted one. The engine keeps
+    the weighted mean and co-moment matrix, so that update costs O(N^2) instead of
+    recomputing the O(T N^2) covariance from scratch.
+
+    Returns may be NaN, e.g. before a ticker was listed: each covariance is then
+    estimated on the dates on which both returns exist (pairwise-complete), and the
+    matrix is repaired to be positive semi-definite. The engine then keeps the weights
+    and means of each pair, so that an update still gives the covariance of a refit.
+    """
+
+    def __init__(
+        self,
+        method: Literal["sample", "ewma"] = "sample",
+        halflife: float = COVARIANCE_EWMA_HALFLIFE,
+        shrinkage: Literal["ledoit_wolf"] | float | None = None,
+    ):
+        self.method = method
+        self.halflife = halflife
+        self.shrinkage = shrinkage
+        self.decay = 1.0 if method == "sample" else 0.5 ** (1 / halflife)
+
+    def fit(self, df_rets: pd.DataFrame) -> "CovarianceEngine":
+        rets = df_rets.to_numpy(dtype=float)
+        weights = self.decay ** np.arange(rets.shape[0] - 1, -1, -1)
+        self.columns = df_rets.columns
+        self.n_obs = rets.shape[0]
+        self.is_pairwise = bool(np.isnan(rets).any())
+        if self.is_pairwise:
+            # Sums of weights, co-moments and means are (columns x columns) matrices:
+            # entry (i, j) is over the dates on which both returns exist, and the
+            # pairs with no common date start from zero
+            sum_weights, comoment, _ = get_pairwise_comoments(rets, weights)
+            is_valid = ~np.isnan(rets)
+            weighted_mask = is_valid * weights[:, np.newaxis]
+            has_common = sum_weights > 0
+            self._sum_weights = sum_weights
+            self._comoment = np.where(has_common, comoment, 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # (i, j): mean of column i on the dates it shares with column j
+                pair_means = np.where(is_valid, rets, 0).T @ weighted_mask / sum_weights
+            self._pair_means = np.where(has_common, pair_means, 0)
+            self._mean = (weights @ np.where(is_valid, rets, 0)) / (weights @ is_valid)
+            deviations = np.where(is_valid, rets - self._mean, 0)
+        else:
+            self._sum_weights = weights.sum()
+            self._mean = weights @ rets / self._sum_weights
+            deviations = rets - self._mean
+            self._comoment = (deviations * weights[:, np.newaxis]).T @ deviations
+        # The shrinkage intensity is estimated once here and kept through updates
+        if self.shrinkage == "ledoit_wolf":
+            self.shrinkage_intensity = get_ledoit_wolf_intensity(deviations)
+        else:
+            self.shrinkage_intensity = float(self.shrinkage or 0)
+        return self
+
+    def update(self, new_rets: pd.Series | np.ndarray) -> "CovarianceEngine":
+        # Weighted West update: past weights decay, the new bar enters with weight 1
+        new_rets = np.asarray(new_rets, dtype=float)
+        if self.is_pairwise:
+            self._update_pairwise(new_rets)
+        else:
+            self._sum_weights = self.decay * self._sum_weights + 1
+            delta = new_rets - self._mean
+            self._mean = self._mean + delta / self._sum_weights
+            self._comoment = self.decay * self._comoment + np.outer(
+                delta, new_rets - self._mean
+            )
+        self.n_obs += 1
+        return self
+
+    def _update_pairwise(self, new_rets: np.ndarray) -> None:
+        # The same update for every pair, with its own weights and means, on the
+        # pairs whose two returns exist in the new bar (NaNs are allowed); the others
+        # only decay. The result matches a refit and stays symmetric
+        is_valid = ~np.isnan(new_rets)
+        is_pair_valid = np.outer(is_valid, is_valid)
+        self._sum_weights = self.decay * self._sum_weights + is_pair_valid
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # (i, j): deviation of column i from its mean on the dates shared with j
+            delta = np.where(
+                is_pair_valid, new_rets[:, np.newaxis] - self._pair_means, 0
+            )
+            self._pair_means = self._pair_means + np.where(
+                is_pair_valid, delta / self._sum_weights, 0
+            )
+            # (x_i - old mean) (x_j - new mean) = delta_ij delta_ji (1 - 1 / W_ij)
+            self._comoment = self.decay * self._comoment + np.where(
+                is_pair_valid, delta * delta.T * (1 - 1 / self._sum_weights), 0
+            )
+        self._mean = np.diag(self._pair_means).copy()
+
+    @property
+    def mean(self) -> pd.Series:
+        return pd.Series(self._mean, index=self.columns)
+
+    @property
+    def covariance(self) -> pd.DataFrame:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self.method == "sample":
+                covariance = self._comoment / (self._sum_weights - 1)
+            else:
+                covariance = self._comoment / self._sum_weights
+        if self.is_pairwise:
+            # Pairs of columns with no common dates are taken as uncorrelated
+            covariance = get_nearest_psd(
+                np.nan_to_num(covariance, nan=0, posinf=0, neginf=0)
+            )
+        if self.shrinkage_intensity > 0:
+            # Shrink towards a scaled identity, i.e. the average variance on the diagonal
+            target = np.trace(covariance) / covariance.shape[0]
+            covariance = (1 - self.shrinkage_intensity) * covariance
+            covariance[np.diag_indices_from(covariance)] += (
+                self.shrinkage_intensity * target
+            )
+        return pd.DataFrame(covariance, index=self.columns, columns=self.columns)
+
+
+def get_pairwise_comoments(
+    rets: np.ndarray, weights: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Weighted moments of every pair of columns over the rows on which both are
+    not NaN.
+
+    Returns three (columns x columns) matrices: the sum of the weights of the common
+    rows, the co-moment, and the sum of squared deviations of the row column on the
+    rows it shares with the other (so entry (i, j) and (j, i) of the last one differ).
+    Each is a product of masked matrices, with no loop over the pairs.
+    """
+    if weights is None:
+        weights = np.ones(rets.shape[0])
+    is_valid = ~np.isnan(rets)
+    mask = is_valid.astype(float)
+    weighted_mask = mask * weights[:, np.newaxis]
+    # Centred on the mean of each column, to limit cancellation in the products
+    counts = is_valid.sum(axis=0)
+    means = np.where(is_valid, rets, 0).sum(axis=0) / np.maximum(counts, 1)
+    centred = np.where(is_valid, rets - means, 0)
+
+    sum_weights = mask.T @ weighted_mask
+    # (i, j): weighted sum of column i on the rows it shares with column j
+    sums = centred.T @ weighted_mask
+    with np.errstate(divide="ignore", invalid="ignore"):
+        comoment = (
+            centred.T @ (centred * weights[:, np.newaxis]) - sums * sums.T / sum_weights
+        )
+        sq_deviations = (centred**2).T @ weighted_mask - sums**2 / sum_weights
+    return sum_weights, comoment, sq_deviations
+
+
+def get_nearest_psd(covariance: np.ndarray) -> np.ndarray:
+    # Pairwise estimates need not make a positive semi-definite matrix: negative
+    # eigenvalues are raised to a small fraction of the largest one
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    floor = 1e-10 * max(eigenvalues.max(initial=0), 0)
+    if eigenvalues.min(initial=floor) >= floor:
+        return covariance
+    return (eigenvectors * np.maximum(eigenvalues, floor)) @ eigenvectors.T
+
+
+def get_ledoit_wolf_intensity(deviations: np.ndarray) -> float:
+    # Ledoit & Wolf (2004) optimal intensity towards the scaled identity, computed
+    # from demeaned returns in O(T N^2) with no T x N x N intermediate
+    n_obs, n_assets = deviations.shape
+    sample_cov = deviations.T @ deviations / n_obs
+    target = np.trace(sample_cov) / n_assets
+    dispersion = np.sum(sample_cov**2) - 2 * target * np.trace(sample_cov)
+    dispersion += n_assets * target**2
+    if dispersion <= 0:
+        return 0.0
+    sq_norms = np.sum(deviations**2, axis=1)
+    estimation_error = (
+        np.sum(sq_norms**2) - n_obs * np.sum(sample_cov**2)
+    ) / n_obs**2
+    return float(min(estimation_error, dispersion) / dispersion)
+
+
+@cache_data()
+def get_covariance_engine(
+    df_rets: pd.DataFrame,
+    method: Literal["sample", "ewma"] = "sample",
+    halflife: float = COVARIANCE_EWMA_HALFLIFE,
+    shrinkage: Literal["ledoit_wolf"] | float | None = None,
+) -> CovarianceEngine:
+    return CovarianceEngine(method=method, halflife=halflife, shrinkage=shrinkage).fit(
+        df_rets
+    )
+
+
+def get_covariance_matrix(
+    df_rets: pd.DataFrame,
+    method: Literal["sample", "ewma"] = "sample",
+    halflife: float = COVARIANCE_EWMA_HALFLIFE,
+    shrinkage: Literal["ledoit_wolf"] | float | None = None,
+) -> pd.DataFrame:
+    return get_covariance_engine(
+        df_rets=df_rets, method=method, halflife=halflife, shrinkage=shrinkage
+    ).covariance
@@ -0,0 +1,212 @@
+from typing import Literal
+
+import pandas as pd
+import numpy as np
+
+from var import FRONTIER_MAX_CONDITION, FRONTIER_RIDGE
+from cache import cache_data
+from covariance import get_covariance_matrix
+from panel import get_available_average
+
+
+def get_level_returns(
+    df_rets: pd.DataFrame,
+    position_value: pd.Series,
+    df_registry: pd.DataFrame,
+    level: Literal["ticker", "asset_class", "macro_asset_class"],
+) -> tuple[pd.DataFrame, pd.Series]:
+    """Returns of the level and current portfolio weights.
+
+    The return of a class is the mix of the returns of its tickers, weighted by
+    their current position value, i.e. the return of the class as it is held today;
+    on the dates on which some of them were not listed yet, the mix of the others.
+    """
+    position_value = position_value.reindex(df_rets.columns).fillna(0).astype(float)
+    if level == "ticker":
+        return df_rets, position_value.div(position_value.sum()).rename("pf_weight")
+    ticker_to_class = (
+        df_registry.drop_duplicates("ticker_yf")
+        .set_index("ticker_yf")[level]
+        .reindex(df_rets.columns)
+    )
+    class_value = position_value.groupby(ticker_to_class, sort=False).sum()
+    weight_in_class = position_value / ticker_to_class.map(class_value)
+    # (tickers x classes) weights, one column per class
+    class_weights = (
+        pd.get_dummies(ticker_to_class)
+        .reindex(columns=class_value.index)
+        .mul(weight_in_class.fillna(0), axis=0)
+    )
+    df_level_rets = pd.DataFrame(
+        get_available_average(
+            df_rets.to_numpy(dtype=float), class_weights.to_numpy(dtype=float)
+        ),
+        index=df_rets.index,
+        columns=class_value.index,
+    )
+    return df_level_rets, class_value.div(class_value.sum()).rename("pf_weight")
+
+
+def has_too_few_dates(df_rets: pd.DataFrame) -> bool:
+    # With no more dates than assets, the covariance matrix is singular
+    return df_rets.dropna(how="all").shape[0] <= df_rets.shape[1]
+
+
+def _get_invertible_covariance(sigma: np.ndarray, too_few_dates: bool) -> np.ndarray:
+    # A singular Σ (too few dates, or collinear assets) has no inverse: a ridge
+    # proportional to the average variance makes it invertible, shrinking it slightly
+    # towards uncorrelated assets
+    if not too_few_dates and np.linalg.cond(sigma) < FRONTIER_MAX_CONDITION:
+        return sigma
+    average_variance = max(np.trace(sigma) / len(sigma), np.finfo(float).tiny)
+    return sigma + FRONTIER_RIDGE * average_variance * np.eye(len(sigma))
+
+
+def _get_two_fund_weights(
+    sigma: np.ndarray, mu: np.ndarray, target_returns: np.ndarray
+) -> np.ndarray:
+    # With short selling, every frontier portfolio mixes the minimum variance
+    # portfolio and the one proportional to inv(Σ)μ (Merton, 1972)
+    inv_sigma_one = np.linalg.solve(sigma, np.ones_like(mu))
+    inv_sigma_mu = np.linalg.solve(sigma, mu)
+    a, b, c = inv_sigma_one.sum(), inv_sigma_mu.sum(), mu @ inv_sigma_mu
+    d = a * c - b**2
+    lambda_ = (c - b * target_returns) / d
+    gamma = (a * target_returns - b) / d
+    return np.outer(lambda_, inv_sigma_one) + np.outer(gamma, inv_sigma_mu)
+
+
+def _solve_long_only(
+    sigma: np.ndarray,
+    mu: np.ndarray,
+    risk_tolerance: float,
+    weights: np.ndarray,
+    tol: float = 1e-12,
+) -> np.ndarray:
+    """Primal active-set solver of min 1/2 w'Σw - t μ'w s.t. sum(w) = 1, w >= 0.
+
+    weights must be feasible; starting from the solution at a nearby t, only a few
+    assets enter or leave the active set, so very few KKT solves are needed.
+    """
+    n_assets = len(mu)
+    weights = weights.copy()
+    at_zero = weights <= 0
+    for _ in range(10 * n_assets):
+        free = np.flatnonzero(~at_zero)
+        n_free = len(free)
+        kkt = np.zeros((n_free + 1, n_free + 1))
+        kkt[:n_free, :n_free] = sigma[np.ix_(free, free)]
+        kkt[:n_free, n_free] = -1
+        kkt[n_free, :n_free] = 1
+        rhs = np.append(risk_tolerance * mu[free], 1)
+        solution = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+        step = np.zeros(n_assets)
+        step[free] = solution[:n_free] - weights[free]
+        if np.max(np.abs(step), initial=0) < 1e-12:
+            # Multipliers of the assets held at zero: drop the most negative one
+            multipliers = sigma @ weights - risk_tolerance * mu - solution[n_free]
+            multipliers[~at_zero] = np.inf
+            worst = int(np.argmin(multipliers))
+            if multipliers[worst] >= -tol:
+                break
+            at_zero[worst] = False
+            continue
+        # Largest step that keeps the weights non-negative
+        is_blocking = (step < 0) & ~at_zero
+        ratios = np.full(n_assets, np.inf)
+        ratios[is_blocking] = -weights[is_blocking] / step[is_blocking]
+        blocking = int(np.argmin(ratios))
+        alpha = min(1.0, ratios[blocking])
+        weights += alpha * step
+        if alpha < 1:
+            weights[blocking] = 0
+            at_zero[blocking] = True
+    return np.clip(weights, 0, None) / np.clip(weights, 0, None).sum()
+
+
+def _get_long_only_weights(
+    sigma: np.ndarray, mu: np.ndarray, n_points: int
+) -> np.ndarray:
+    # Trace the frontier by increasing the risk tolerance t from the minimum variance
+    # portfolio (t = 0) to the asset with the highest expected return
+    scale = np.trace(sigma) / len(mu) / max(np.ptp(mu), 1e-12)
+    risk_tolerances = np.append(0, np.geomspace(1e-3, 1e3, n_points - 2) * scale)
+    weights = np.full(len(mu), 1 / len(mu))
+    frontier = []
+    for risk_tolerance in risk_tolerances:
+        weights = _solve_long_only(sigma, mu, risk_tolerance, weights)
+        frontier.append(weights)
+    frontier.append(np.eye(len(mu))[np.argmax(mu)])
+    return np.array(frontier)
+
+
+@cache_data()
+def get_efficient_frontier(
+    df_rets: pd.DataFrame,
+    periods_per_year: int,
+    allow_short: bool = False,
+    n_points: int = 60,
+) -> pd.DataFrame:
+    """Annualised volatility, expected return and weights of the frontier portfolios.
+
+    With short selling the frontier is analytic, on a covariance matrix made
+    invertible if needed (see has_too_few_dates); otherwise it is traced by a
+    warm-started active-set quadratic programme. The assets with fewer than two
+    returns have no variance and get a null weight; ValueError if none is left.
+    """
+    df_valid_rets = df_rets.loc[:, df_rets.notna().sum().ge(2)]
+    # Each asset contributes its whole history: the covariance is pairwise-complete
+    sigma = get_covariance_matrix(df_valid_rets).to_numpy() * periods_per_year
+    mu = df_valid_rets.mean().to_numpy() * periods_per_year
+    if df_valid_rets.empty or not np.isfinite(sigma).all():
+        raise ValueError(
+            "The selected time slice has too few returns to estimate the efficient "
+            "frontier: choose a longer slice or a higher frequency"
+        )
+    # With a single asset, the only portfolio holds all of it
+    if allow_short and len(mu) > 1:
+        sigma = _get_invertible_covariance(
+            sigma, too_few_dates=has_too_few_dates(df_valid_rets)
+        )
+        inv_sigma_one = np.linalg.solve(sigma, np.ones_like(mu))
+        min_var_return = mu @ inv_sigma_one / inv_sigma_one.sum()
+        target_returns = np.linspace(
+            min_var_return, max(mu.max(), min_var_return) * 1.5, n_points
+        )
+        weights = _get_two_fund_weights(sigma, mu, target_returns)
+    else:
+        weights = _get_long_only_weights(sigma, mu, n_points)
+    # On a singular Σ, rounding can make the variance of a portfolio slightly negative
+    variances = np.einsum("pi,ij,pj->p", weights, sigma, weights)
+    df_frontier = pd.DataFrame(
+        {
+            "volatility": np.sqrt(np.clip(variances, 0, None)),
+            "return": weights @ mu,
+        }
+    )
+    df_frontier = pd.concat(
+        [
+            df_frontier,
+            pd.DataFrame(weights, columns=df_valid_rets.columns).reindex(
+                columns=df_rets.columns, fill_value=0
+            ),
+        ],
+        axis=1,
+    )
+    # Points on the inefficient side or repeated along the trace are dropped
+    df_frontier = df_frontier.round(12).drop_duplicates(subset=["volatility", "return"])
+    return df_frontier[
+        df_frontier["return"].ge(
+            df_frontier.loc[df_frontier["volatility"].idxmin(), "return"]
+        )
+    ].sort_values("volatility", ignore_index=True)
+
+
+def get_portfolio_point(
+    df_rets: pd.DataFrame, weights: pd.Series, periods_per_year: int
+) -> tuple[float, float]:
+    # Annualised volatility and expected return of a given allocation
+    weights = weights.reindex(df_rets.columns).fillna(0).to_numpy()
+    sigma = get_covariance_matrix(df_rets).to_numpy() * periods_per_year
+    mu = df_rets.mean().to_numpy() * periods_per_year
+    return float(np.sqrt(weights @ sigma @ weights)), float(weights @ mu)
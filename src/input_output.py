@@ -2,54 +2,21 @@ from pathlib import Path
 from datetime import datetime, timedelta
 from typing import Tuple, Dict, List
 
-import streamlit as st
 import yfinance as yf
 import pandas as pd
 
-from var import CACHE_EXPIRE_SECONDS
+from var import CACHE_EXPIRE_SECONDS, COMPACT_DTYPES, PRICE_DTYPE
+from cache import cache_data
+from perf import traced, record_network_call
+from reporting import report_error
+from market_data import TickerCache
+from panel import PricePanel
 
 
-def write_disclaimer() -> None:
-    st.markdown("***")
-    st.markdown(
-        '<center> <span style="font-size:0.7em; font-style:italic">\
-        This content is for educational purposes only and is under no circumstances intended\
-        to be used or considered as financial or investment advice\
-        </span> </center>',
-        unsafe_allow_html=True,
-    )
-
-
-def write_load_message(df_data: pd.DataFrame, df_dimensions: pd.DataFrame) -> None:
-    n_transactions = df_data.shape[0]
-    n_tickers = df_data["ticker"].nunique()
-    min_date, max_date = (
-        str(df_data["transaction_date"].min())[:10],
-        str(df_data["transaction_date"].max())[:10],
-    )
-    set_data_tickers = sorted(df_data["ticker"].unique())
-    set_dimensions_tickers = sorted(df_dimensions["ticker"].unique())
-    n_data_na = df_data.isnull().sum().sum()
-    n_dimensions_na = df_dimensions.isnull().sum().sum()
-
-    if n_data_na > 0 or n_dimensions_na > 0:
-        st.error(
-            f"There are null values: {n_data_na} among transactions, {n_dimensions_na} among tickers' descriptions"
-        )
-        st.stop()
-
-    if set_data_tickers != set_dimensions_tickers:
-        st.warning(
-            "There is some inconsistency between the tickers traded and the tickers' descriptions"
-        )
-
-    st.success(
-        f"Successfully loaded **{n_transactions} transactions** relating to **{n_tickers} tickers** and spanning from {min_date} to {max_date}"
-    )
-
-
-
-def load_data(full_path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+def read_workbook(
+    full_path: Path, compact: bool = COMPACT_DTYPES
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    # Transactions and securities of a workbook in the format of template.xlsx
     df_storico = pd.read_excel(
         full_path,
         sheet_name="Transactions History",
@@ -74,6 +41,9 @@ def load_data(full_path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
     )
     # filter out tickers that start with ^
     df_storico = df_storico[~df_storico["ticker"].str.startswith("^")]
+    # The amount is optional in the template: if missing, it is shares times price
+    if "ap_amount" not in df_storico.columns:
+        df_storico["ap_amount"] = df_storico["shares"] * df_storico["price"]
 
     df_storico['exchange'] = df_storico['exchange'].fillna('')
     df_storico["ticker_yf"] = df_storico.apply(
@@ -95,6 +65,9 @@ def load_data(full_path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
     )
     # filter out tickers that start with ^
     df_anagrafica = df_anagrafica[~df_anagrafica["ticker"].str.startswith("^")]
+    # Sector pages are optional in the template
+    if "sector_url" not in df_anagrafica.columns:
+        df_anagrafica["sector_url"] = ""
     # add the exchange to the ticker to match the yfinance format if exchange is not empty
     df_anagrafica = df_anagrafica.fillna("")
     df_anagrafica["ticker_yf"] = df_anagrafica.apply(
@@ -106,54 +79,76 @@ def load_data(full_path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
     df_storico = df_storico.drop(
         columns=[col_ for col_ in df_storico.columns if col_.startswith("Unnamed")]
     )
-    df_storico.to_excel("df_storico.xlsx", index=False)
-    df_anagrafica.to_excel("df_anagrafica.xlsx", index=False)
-    write_load_message(df_data=df_storico, df_dimensions=df_anagrafica)
+    if compact:
+        # A few distinct tickers repeated over many transactions
+        df_storico = df_storico.astype(
+            {"exchange": "category", "ticker": "category", "ticker_yf": "category"}
+        )
     return df_storico, df_anagrafica
 
 
-
-def get_last_closing_price(ticker_list: List[str]) -> pd.DataFrame:
-    df_last_closing = pd.DataFrame(
-        columns=["ticker_yf", "last_closing_date", "price"],
-        index=range(len(ticker_list)),
+def load_benchmarks(full_path: Path) -> List[str]:
+    # Index tickers (starting with ^) listed among the securities, to be used as
+    # benchmarks rather than holdings
+    if hasattr(full_path, "seek"):
+        full_path.seek(0)
+    df_anagrafica = pd.read_excel(
+        full_path, sheet_name="Securities Master Table", dtype=str
     )
-    for i, ticker_ in zip(range(len(ticker_list)), ticker_list):
-        print(f"Processing {ticker_}")
-        ticker_data = (
-            yf.Ticker(ticker_)
+    tickers = df_anagrafica["Ticker"].dropna()
+    return tickers[tickers.str.startswith("^")].unique().tolist()
+
+
+def fetch_last_closing_price(ticker: str) -> List | None:
+    # Date and price of the last close, or None if no source has it
+    print(f"Processing {ticker}")
+    ticker_data = yf.Ticker(ticker)
+    try:
+        return (
+            ticker_data.history(
+                period="1d",
+                interval="1d",
+            )["Close"]
+            .reset_index()
+            .values.tolist()[0]
         )
+    except:
         try:
-            closing_date_ = (
+            return (
                 ticker_data.history(
-                    period="1d",
+                    period="1mo",
                     interval="1d",
                 )["Close"]
                 .reset_index()
-                .values.tolist()
+                .values.tolist()[-1]
             )
-            df_last_closing.iloc[i] = [ticker_] + closing_date_[0]
         except:
             try:
-                closing_date_ = (
-                    ticker_data.history(
-                        period="1mo",
-                        interval="1d",
-                    )["Close"]
-                    .reset_index()
-                    .values.tolist()
-                )
-                df_last_closing.iloc[i] = [ticker_] + closing_date_[-1]
+                return get_last_closing_price_from_api(ticker=ticker)[0]
             except:
-                try:
-                    closing_date_ = get_last_closing_price_from_api(ticker=ticker_)
-                    df_last_closing.iloc[i] = [ticker_] + closing_date_[0]
-                except:
-                    print(f'Error in {ticker_}')
-                    st.error(
-                        f"{ticker_}: latest data not available. Please check your internet connection or try again later",
-                        icon="😔",
-                    )
+                print(f"Error in {ticker}")
+                return None
+
+
+LAST_CLOSING_PRICE_CACHE = TickerCache(
+    fetch=fetch_last_closing_price, ttl_seconds=CACHE_EXPIRE_SECONDS
+)
+
+
+@traced
+def get_last_closing_price(ticker_list: List[str]) -> pd.DataFrame:
+    df_last_closing = pd.DataFrame(
+        columns=["ticker_yf", "last_closing_date", "price"],
+        index=range(len(ticker_list)),
+    )
+    last_closing = LAST_CLOSING_PRICE_CACHE.get_many(ticker_list)
+    for i, ticker_ in zip(range(len(ticker_list)), ticker_list):
+        if last_closing[ticker_] is not None:
+            df_last_closing.iloc[i] = [ticker_] + last_closing[ticker_]
+        else:
+            report_error(
+                f"{ticker_}: latest data not available. Please check your internet connection or try again later"
+            )
 
     df_last_closing["last_closing_date"] = (
         df_last_closing["last_closing_date"].astype(str).str.slice(0, 10)
@@ -162,7 +157,6 @@ def get_last_closing_price(ticker_list: List[str]) -> pd.DataFrame:
     return df_last_closing
 
 
-
 def get_last_closing_price_from_api(ticker: str, days_of_delay: int = 5) -> List:
     today = datetime.utcnow()
     delayed = today - timedelta(days=days_of_delay)
@@ -191,38 +185,56 @@ def get_last_closing_price_from_api(ticker: str, days_of_delay: int = 5) -> List
 
 
 
-def get_full_price_history(ticker_list: List[str]) -> Dict:
-    df_history = dict()
+def fetch_price_history(ticker: str) -> pd.Series:
+    ticker_data = yf.Ticker(ticker)
+    price_history = ticker_data.history(
+        period="max",
+        interval="1d",
+    )[
+        "Close"
+    ].rename(ticker)
+    # Dates of the exchange, without the time zone
+    price_history.index = price_history.index.tz_localize(None).normalize()
+    return price_history
 
-    for ticker_ in ticker_list:
-        ticker_data = yf.Ticker(ticker_)
-        df_history[ticker_] = ticker_data.history(
-            period="max",
-            interval="1d",
-        )[
-            "Close"
-        ].rename(ticker_)
 
-        df_history[ticker_].index = pd.to_datetime(df_history[ticker_].index.date)
+PRICE_HISTORY_CACHE = TickerCache(
+    fetch=fetch_price_history, ttl_seconds=10 * CACHE_EXPIRE_SECONDS
+)
 
-    return df_history
 
+def get_full_price_history(ticker_list: List[str]) -> Dict:
+    # Copies, since the cached series are shared by all the sessions
+    full_history = PRICE_HISTORY_CACHE.get_many(ticker_list)
+    return {t_: full_history[t_].copy() for t_ in ticker_list}
 
 
-def get_max_common_history(ticker_list: List[str]) -> pd.DataFrame:
-    full_history = get_full_price_history(ticker_list)
-    df_full_history = pd.concat(
-        [full_history[t_] for t_ in ticker_list],
-        axis=1,
+@traced
+@cache_data(ttl=10 * CACHE_EXPIRE_SECONDS)
+def get_price_panel(ticker_list: List[str], dtype: str = PRICE_DTYPE) -> PricePanel:
+    # Built once per list of tickers, then shared by the pages and the analyses
+    return PricePanel.from_series(
+        get_full_price_history(ticker_list), ticker_list=ticker_list, dtype=dtype
     )
-    first_idx = df_full_history.apply(pd.Series.first_valid_index).max()
-    last_idx = df_full_history.apply(pd.Series.last_valid_index).min()
-    return df_full_history.loc[first_idx:last_idx]
 
 
-@st.cache_data(ttl=10 * CACHE_EXPIRE_SECONDS, show_spinner=False)
+def get_price_history(ticker_list: List[str]) -> pd.DataFrame:
+    # Whole history of every ticker, on the union of their dates: NaN before the
+    # first price of a ticker, the last price carried over the days it was not quoted
+    return get_price_panel(ticker_list).ffill().to_frame()
+
+
+@cache_data(ttl=10 * CACHE_EXPIRE_SECONDS)
+def get_treasury_bill_rate() -> float:
+    # Average yield (in %) of the 13-week US Treasury bill over the last year
+    record_network_call()
+    return yf.Ticker("^IRX").history(period="1y")["Close"].mean()
+
+
+@cache_data(ttl=10 * CACHE_EXPIRE_SECONDS)
 def get_risk_free_rate_last_value(decimal: bool = False) -> float:
     try:
+        record_network_call()
         df_ecb = pd.read_html(
             io="http://www.ecb.europa.eu/stats/financial_markets_and_interest_rates/euro_short-term_rate/html/index.en.html"
         )[0]
@@ -234,10 +246,11 @@ def get_risk_free_rate_last_value(decimal: bool = False) -> float:
     return risk_free_rate
 
 
-@st.cache_data(ttl=10 * CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data(ttl=10 * CACHE_EXPIRE_SECONDS)
 def get_risk_free_rate_history(decimal: bool = False) -> pd.DataFrame:
     euro_str_link = "https://sdw.ecb.europa.eu/quickviewexport.do?SERIES_KEY=438.EST.B.EU000A2X2A25.WT&type=csv"
     try:
+        record_network_call()
         df_ecb = (
             pd.read_csv(
                 euro_str_link,
@@ -260,12 +273,13 @@ def get_summary(df_storico, df_anagrafica):
     # df_anagrafica contains the asset information
 
     # compute # of shares for each asset
-    number_of_shares = df_storico.groupby("ticker_yf")["shares"].sum()
+    number_of_shares = df_storico.groupby("ticker_yf", observed=True)["shares"].sum()
     df_anagrafica = df_anagrafica.merge(number_of_shares, left_on="ticker_yf", right_index=True, how="left")
 
     # compute avg shares cost for each asset weighted by the number of shares
     avg_weighted_cost = (
-        df_storico.groupby("ticker_yf")["ap_amount"].sum() / df_storico.groupby("ticker_yf")["shares"].sum()
+        df_storico.groupby("ticker_yf", observed=True)["ap_amount"].sum()
+        / df_storico.groupby("ticker_yf", observed=True)["shares"].sum()
     ).to_frame("avg_shares_cost")
     df_anagrafica = df_anagrafica.merge(avg_weighted_cost, left_on="ticker_yf", right_index=True, how="left")
 
@@ -275,7 +289,11 @@ def get_summary(df_storico, df_anagrafica):
     df_anagrafica = df_anagrafica.merge(last_closing_price, left_on="ticker_yf", right_on="ticker_yf", how="left")
 
     # compute total cost for each asset
-    total_cost = df_storico.groupby("ticker_yf")["ap_amount"].sum().to_frame("total_cost")
+    total_cost = (
+        df_storico.groupby("ticker_yf", observed=True)["ap_amount"]
+        .sum()
+        .to_frame("total_cost")
+    )
     df_anagrafica = df_anagrafica.merge(total_cost, left_on="ticker_yf", right_index=True, how="left")
 
     # compute current value for each asset
@@ -316,32 +334,3 @@ def get_summary(df_storico, df_anagrafica):
     df_anagrafica.loc["Total"] = total_series
 
     return df_anagrafica
-    
-
-# Future projections setup with Plotly
-def simulate_future_growth(initial_wealth, annualised_return, inflation, monthly_investment, years, increase_investment):
-    # Calculate the number of months
-    months = years * 12
-    future_wealth = []
-    wealth_without_investment = []
-    annualised_return_adjusted = annualised_return - inflation
-
-    for month in range(months):
-        # Calculate the future wealth with investment each month with annualised return adjusted for inflation
-        current_wealth = initial_wealth if month == 0 else future_wealth[-1]
-        future_wealth.append(
-            current_wealth * (1 + annualised_return_adjusted / 12) + monthly_investment
-        )
-
-        # Calculate the future wealth without investment each month with inflation
-        current_wealth_without_investment = initial_wealth if month == 0 else wealth_without_investment[-1]
-        wealth_without_investment.append(
-            current_wealth_without_investment * (1 - inflation / 12) + monthly_investment
-        )
-        
-        # Increase the monthly investment every 5 years (60 months)
-        increase_interval_years = 5
-        if (month + 1) % (increase_interval_years * 12) == 0 and month > 0:
-            monthly_investment *= (1 + increase_investment)
-
-    return future_wealth, wealth_without_investment
\ No newline at end of file
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from var import MARKET_DATA_MAX_TICKERS, MARKET_DATA_MAX_WORKERS
+from perf import record_network_call
+
+# Shared by all the caches, so that the provider never gets more than
+# MARKET_DATA_MAX_WORKERS requests at once from the process
+_executor = ThreadPoolExecutor(
+    max_workers=MARKET_DATA_MAX_WORKERS, thread_name_prefix="market_data"
+)
+
+
+class TickerCache:
+    """Per-ticker values shared by all the sessions of the process.
+
+    Each session asks for its own list of tickers, and gets it assembled from the
+    shared entries: only the tickers that nobody fetched yet reach the provider,
+    concurrently. A ticker requested by several sessions at once is fetched once
+    (single flight), the others wait for it. Fetches returning None, or raising,
+    are not cached.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Any],
+        ttl_seconds: float,
+        max_tickers: int = MARKET_DATA_MAX_TICKERS,
+    ):
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.max_tickers = max_tickers
+        self._lock = threading.Lock()
+        # ticker -> (value, expiry time), from the least to the most recently used
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, ticker: str, value: Any, ttl_seconds: float | None = None) -> None:
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            if value is not None:
+                self._entries[ticker] = (value, time.monotonic() + ttl_seconds)
+                self._entries.move_to_end(ticker)
+                while len(self._entries) > self.max_tickers:
+                    self._entries.popitem(last=False)
+            self._in_flight.pop(ticker, None)
+
+    def _fetch_and_store(self, ticker: str, future: Future) -> None:
+        try:
+            value = self.fetch(ticker)
+        except BaseException as e:
+            self._store(ticker, None)
+            future.set_exception(e)
+        else:
+            self._store(ticker, value)
+            future.set_result(value)
+
+    def put_many(
+        self, values: Dict[str, Any], ttl_seconds: float | None = None
+    ) -> None:
+        # Values fetched elsewhere, e.g. by the parent of a worker process, which
+        # can keep them for longer than the cache TTL (float("inf") for ever)
+        for ticker_, value_ in values.items():
+            self._store(ticker_, value_, ttl_seconds=ttl_seconds)
+
+    def get_many(
+        self, ticker_list: List[str], return_exceptions: bool = False
+    ) -> Dict[str, Any]:
+        # With return_exceptions, a ticker whose fetch raised gets the exception as
+        # its value, instead of failing the whole list
+        values, waiting, to_fetch = dict(), dict(), dict()
+        now = time.monotonic()
+        with self._lock:
+            for ticker_ in dict.fromkeys(ticker_list):
+                entry = self._entries.get(ticker_)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(ticker_)
+                    values[ticker_] = entry[0]
+                elif ticker_ in self._in_flight:
+                    waiting[ticker_] = self._in_flight[ticker_]
+                else:
+                    waiting[ticker_] = to_fetch[ticker_] = Future()
+                    self._in_flight[ticker_] = to_fetch[ticker_]
+
+        for _ in to_fetch:
+            record_network_call()
+        if len(to_fetch) == 1:
+            self._fetch_and_store(*next(iter(to_fetch.items())))
+        else:
+            for ticker_, future_ in to_fetch.items():
+                _executor.submit(self._fetch_and_store, ticker_, future_)
+        for ticker_, future_ in waiting.items():
+            if return_exceptions and future_.exception() is not None:
+                values[ticker_] = future_.exception()
+            else:
+                values[ticker_] = future_.result()
+        return values
+
+    def get(self, ticker: str) -> Any:
+        return self.get_many([ticker])[ticker]
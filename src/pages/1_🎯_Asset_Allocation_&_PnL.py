@@ -1,6 +1,5 @@
-from datetime import datetime
-
 import streamlit as st
+import pandas as pd
 
 from var import (
     GLOBAL_STREAMLIT_STYLE,
@@ -9,16 +8,47 @@ from var import (
     FAVICON,
     DICT_GROUPBY_LEVELS,
 )
-from input_output import write_disclaimer, get_last_closing_price, get_summary, simulate_future_growth
+from ui import write_disclaimer
+from input_output import (
+    get_last_closing_price,
+    get_summary,
+    get_price_history,
+)
+from performance import (
+    get_money_weighted_returns,
+    get_time_weighted_return,
+    get_ticker_time_weighted_returns,
+)
+from projection import (
+    simulate_future_growth,
+    get_final_wealth_sensitivity,
+    get_flow_adjusted_monthly_returns,
+    get_allocation_monthly_returns,
+    simulate_bootstrap_growth,
+    get_required_monthly_investment,
+    get_required_years,
+    get_required_return,
+)
 from aggregation import (
     aggregate_by_ticker,
     get_pnl_by_asset_class,
     get_portfolio_pivot,
     get_wealth_history,
 )
-from plot import plot_sunburst, plot_wealth, plot_pnl_by_asset_class, plot_sector_allocation, plot_correlation, plot_projection
+from plot import (
+    plot_sunburst,
+    plot_wealth,
+    plot_pnl_by_asset_class,
+    plot_sector_allocation,
+    plot_correlation,
+    plot_projection,
+    plot_projection_bands,
+)
 from sector import retrieve_sector
-from returns import correlation_analysis
+from rebalancing import get_trade_fee, plan_integer_trades
+from returns import correlation_analysis, get_period_returns
+from stress import get_shock_engine
+from perf import start_rerun, start_section, end_rerun
 
 st.set_page_config(
     page_title="PFN | Asset Allocation & PnL",
@@ -26,6 +56,7 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="auto",
 )
+start_rerun("Asset Allocation & PnL")
 
 st.markdown(GLOBAL_STREAMLIT_STYLE, unsafe_allow_html=True)
 
@@ -48,6 +79,7 @@ df_j = df_pf[["ticker_yf", "dca", "shares"]].merge(
 expense = (df_j["shares"] * df_j["dca"]).sum()
 fees = df_storico["fees"].sum().round(2)
 
+start_section("Profit & Loss")
 st.markdown("## Profit & Loss")
 
 col_l, col_m, col_r = st.columns([1, 1, 1], gap="small")
@@ -76,16 +108,20 @@ col_m.metric(
     """,
 )
 
-first_transaction = df_storico["transaction_date"].sort_values()[0]
-n_years = (datetime.now() - first_transaction).days / 365.25
-annualised_ret = ((pf_actual_value / total_expense) ** (1 / n_years)) - 1
+df_mwr = get_money_weighted_returns(
+    df_transactions=df_storico,
+    df_last_closing=df_last_closing,
+    consider_fees=consider_fees,
+)
+annualised_ret = df_mwr["Portfolio"]
 
 col_r.metric(
     label="Annualised return",
-    value=f"{sign}{annualised_ret: .1%}",
+    value=f"{annualised_ret:+.1%}",
     help="""
     This measures the average yearly return, helping compare investments
-    held for different periods by standardising the return on an annual basis
+    held for different periods by standardising the return on an annual basis.
+    It is the money-weighted return (XIRR), so it accounts for when you invested
     """,
 )
 
@@ -98,6 +134,7 @@ df_pivot = get_portfolio_pivot(
 
 st.markdown("***")
 
+start_section("Summary")
 st.markdown("## Summary")
 
 df_summary = get_summary(df_storico, df_anagrafica)
@@ -135,6 +172,7 @@ st.dataframe(
 )
 st.markdown("***")
 
+start_section("Current portfolio asset allocation")
 st.markdown("## Current portfolio asset allocation")
 fig = plot_sunburst(df=df_pivot)
 st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG_NO_LOGO)
@@ -174,6 +212,7 @@ with st.expander("Show me a table"):
 
 st.markdown("***")
 
+start_section("Profit & Loss by asset class")
 st.markdown("## Profit & Loss by asset class")
 
 group_by = st.radio(
@@ -198,6 +237,93 @@ st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
 
 st.markdown("***")
 
+start_section("What-if scenario")
+st.markdown("## What-if scenario")
+
+st.markdown(
+    """
+    Apply instant price shocks to your macro asset classes and, optionally, to
+    single asset classes: shocks add up, so <i>Stocks -20%</i> and
+    <i>EMs Stocks -5%</i> move an emerging markets ETF by -25%.
+    """,
+    unsafe_allow_html=True,
+)
+
+shock_engine = get_shock_engine(df_positions=df_j, df_dimensions=df_anagrafica)
+
+cols = st.columns(len(shock_engine.macro_classes), gap="small")
+macro_shocks = {
+    macro_class: col.slider(
+        f"{macro_class} (%)",
+        min_value=-50,
+        max_value=50,
+        value=0,
+        step=1,
+        key=f"shock_macro_{macro_class}",
+    )
+    / 100
+    for col, macro_class in zip(cols, shock_engine.macro_classes)
+}
+with st.expander("Fine-tune by asset class"):
+    cols = st.columns(3, gap="small")
+    class_shocks = {
+        asset_class: cols[i % 3].slider(
+            f"{asset_class} (%)",
+            min_value=-50,
+            max_value=50,
+            value=0,
+            step=1,
+            key=f"shock_class_{asset_class}",
+        )
+        / 100
+        for i, asset_class in enumerate(shock_engine.classes)
+    }
+
+shock_pnl = shock_engine.get_total_impact(
+    macro_shocks=macro_shocks, class_shocks=class_shocks
+)
+sign = "+" if shock_pnl >= 0 else ""
+st.metric(
+    label="Portfolio value after the shock",
+    value=f"{pf_actual_value + shock_pnl: ,.1f} €",
+    delta=f"{sign}{shock_pnl: ,.1f} € ({sign}{shock_pnl / pf_actual_value:.1%})",
+)
+
+df_shock = shock_engine.get_impact(macro_shocks=macro_shocks, class_shocks=class_shocks)
+fig = plot_pnl_by_asset_class(
+    df_pnl=shock_engine.get_impact_by_level(df_shock, level=dict_group_by[group_by]),
+    group_by=dict_group_by[group_by],
+)
+st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
+
+with st.expander("Show me the impact on each position"):
+    st.dataframe(
+        df_shock.rename(
+            columns={
+                "ticker_yf": "Ticker",
+                "name": "Name",
+                "asset_class": "Asset Class",
+                "macro_asset_class": "Macro Asset Class",
+                "position_value": "Position Value",
+                "shock": "Shock",
+                "pnl": "PnL",
+                "value_after": "Value After Shock",
+            }
+        ).style.format(
+            {
+                "Position Value": "{:,.1f} €",
+                "Shock": "{:+.1%}",
+                "PnL": "{:+,.1f} €",
+                "Value After Shock": "{:,.1f} €",
+            }
+        ),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+st.markdown("***")
+
+start_section("Wealth history")
 st.markdown("## Wealth history")
 
 df_wealth = get_wealth_history(df_transactions=df_storico, ticker_list=ticker_list)
@@ -205,19 +331,62 @@ df_wealth = get_wealth_history(df_transactions=df_storico, ticker_list=ticker_li
 fig = plot_wealth(df=df_wealth)
 st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
 
+twr, twr_annualised = get_time_weighted_return(df_wealth)
+col_l, col_m, col_r = st.columns([1, 1, 1], gap="small")
+col_l.metric(
+    label="Time-weighted return",
+    value=f"{twr:+.1%}",
+    help="""
+    The return of your investments regardless of when and how much you invested,
+    i.e. the growth of 1€ invested at the beginning: use it to compare your
+    choices with a fund or an index
+    """,
+)
+col_m.metric(label="Annualised time-weighted return", value=f"{twr_annualised:+.1%}")
+col_r.metric(
+    label="Annualised money-weighted return",
+    value=f"{annualised_ret:+.1%}",
+    help="""
+    The return you actually earned on your money (XIRR): it rewards investing
+    more before the markets rise
+    """,
+)
+
+with st.expander("Show me the returns of each ticker"):
+    df_ticker_rets = get_ticker_time_weighted_returns(
+        df_transactions=df_storico, ticker_list=ticker_list
+    ).join(df_mwr)
+    st.dataframe(
+        df_ticker_rets.rename(
+            columns={
+                "twr": "Time-weighted Return",
+                "twr_annualised": "Annualised Time-weighted Return",
+                "xirr": "Annualised Money-weighted Return",
+            }
+        ).style.format("{:+.2%}"),
+        use_container_width=True,
+    )
+
 
 st.markdown("***")
 
+start_section("Sector allocation for equities")
 st.markdown("## Sector allocation for equities")
 
 df_sector = retrieve_sector(df_anagrafica)
 
-fig = plot_sector_allocation(df_sector, df_pivot)
-st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
+if isinstance(df_sector, pd.DataFrame) and not df_sector.empty:
+    fig = plot_sector_allocation(df_sector, df_pivot)
+    st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
+else:
+    st.info(
+        "No sector page was provided for the equities in the Securities Master Table."
+    )
 
 
 st.markdown("***")
 
+start_section("Simulation of future growth")
 st.markdown('## Simulation of future growth')
 
 # Main page layout with two columns for inputs
@@ -241,7 +410,69 @@ future_wealth, wealth_without_investment = simulate_future_growth(
     initial_wealth, annualised_return, inflation, monthly_investment, years, increase_investment
 )
 
-fig = plot_projection(years, future_wealth, wealth_without_investment)
+projection_mode = st.radio(
+    "Projection mode:",
+    options=["Deterministic", "Monte Carlo"],
+    horizontal=True,
+    help="""
+    Monte Carlo simulates 10,000 paths by resampling (in blocks of 12 consecutive
+    months) the historical monthly returns, instead of a fixed annualised return
+    """,
+)
+
+if projection_mode == "Deterministic":
+    fig = plot_projection(years, future_wealth, wealth_without_investment)
+else:
+    col_l, col_r = st.columns(2)
+    returns_source = col_l.radio(
+        "Resample monthly returns from:",
+        options=["Wealth history", "Current asset allocation"],
+        horizontal=True,
+    )
+    target_wealth = col_r.number_input(
+        "Target wealth (€)",
+        min_value=0.0,
+        value=float(round(future_wealth[-1], -3)),
+        step=1000.0,
+    )
+    if returns_source == "Wealth history":
+        monthly_returns = get_flow_adjusted_monthly_returns(df_wealth)
+    else:
+        df_monthly_rets = get_period_returns(
+            df=get_price_history(ticker_list=ticker_list),
+            df_registry=df_anagrafica,
+            tickers_to_evaluate=ticker_list,
+            period="M",
+            level="ticker",
+        )
+        monthly_returns = get_allocation_monthly_returns(
+            df_monthly_rets, weights=df_pivot.set_index("ticker_yf")["weight_pf"]
+        )
+    try:
+        df_bands, prob_target = simulate_bootstrap_growth(
+            monthly_returns=monthly_returns,
+            initial_wealth=initial_wealth,
+            inflation=inflation,
+            monthly_investment=monthly_investment,
+            years=years,
+            increase_investment=increase_investment,
+            target_wealth=target_wealth,
+        )
+    except ValueError as e:
+        st.info(str(e))
+        fig = plot_projection(years, future_wealth, wealth_without_investment)
+    else:
+        fig = plot_projection_bands(df_bands, future_wealth)
+        col_l.metric(
+            label="Probability of reaching the target",
+            value=f"{prob_target.iloc[-1]:.1%}",
+            help=f"Share of simulated paths worth at least {target_wealth:,.0f} € after {years} years",
+        )
+        col_r.metric(
+            label="Median final wealth",
+            value=f"{df_bands['p50'].iloc[-1]:,.0f} €",
+            delta=f"{df_bands['p50'].iloc[-1] - future_wealth[-1]:,.0f} € vs deterministic",
+        )
 
 st.plotly_chart(fig)
 
@@ -262,5 +493,172 @@ with col2:
     st.markdown(f"- **Years to Project**: {years}")
     st.markdown(f"- **Wealth without Investment**: €{wealth_without_investment[-1]:,.2f}")
 
+with st.expander(
+    "Show me how the final wealth changes with return and monthly investment"
+):
+    sensitivity_returns = [annualised_return + delta_ / 100 for delta_ in range(-3, 4)]
+    sensitivity_investments = sorted(
+        {max(0, monthly_investment + delta_) for delta_ in range(-300, 301, 100)}
+    )
+    df_sensitivity = pd.DataFrame(
+        get_final_wealth_sensitivity(
+            initial_wealth=initial_wealth,
+            annualised_returns=sensitivity_returns,
+            inflation=inflation,
+            monthly_investments=sensitivity_investments,
+            years=years,
+            increase_investment=increase_investment,
+        ),
+        index=[f"{return_:.1%}" for return_ in sensitivity_returns],
+        columns=[
+            f"{investment_:,.0f} €/month" for investment_ in sensitivity_investments
+        ],
+    )
+    df_sensitivity.index.name = "Annualized Return"
+    st.dataframe(
+        df_sensitivity.style.format("{:,.0f} €"),
+        use_container_width=True,
+    )
+
+st.markdown("### How do I reach my goal?")
+
+goal_wealth = st.number_input(
+    "Target wealth (€)",
+    min_value=0.0,
+    value=float(round(1.5 * future_wealth[-1], -3)),
+    step=1000.0,
+    key="goal_wealth",
+)
+
+required_investment = get_required_monthly_investment(
+    target_wealth=goal_wealth,
+    initial_wealth=initial_wealth,
+    annualised_return=annualised_return,
+    inflation=inflation,
+    years=years,
+    increase_investment=increase_investment,
+)
+required_years = get_required_years(
+    target_wealth=goal_wealth,
+    initial_wealth=initial_wealth,
+    annualised_return=annualised_return,
+    inflation=inflation,
+    monthly_investment=monthly_investment,
+    increase_investment=increase_investment,
+)
+required_return = get_required_return(
+    target_wealth=goal_wealth,
+    initial_wealth=initial_wealth,
+    inflation=inflation,
+    monthly_investment=monthly_investment,
+    years=years,
+    increase_investment=increase_investment,
+)
+
+col_l, col_m, col_r = st.columns([1, 1, 1], gap="small")
+col_l.metric(
+    label=f"Monthly investment needed in {years} years",
+    value=f"{required_investment:,.0f} €",
+    help="Initial monthly investment, still increased every 5 years as set above",
+)
+col_m.metric(
+    label=f"Years needed investing {monthly_investment:,.0f} €/month",
+    value="> 100" if pd.isna(required_years) else f"{required_years:.1f}",
+)
+col_r.metric(
+    label=f"Annualized return needed in {years} years",
+    value="n.a." if pd.isna(required_return) else f"{required_return:.2%}",
+    help="Nominal return, before subtracting the annualized inflation set above",
+)
+
+
+st.markdown("***")
+
+start_section("What should I buy with my next contribution?")
+st.markdown("## What should I buy with my next contribution?")
+
+st.markdown(
+    """
+    Set your target weights: PFN finds the whole-share orders that bring your
+    portfolio closest to them, given the cash to invest and a fee per order
+    (by default, the median fee of your transactions).
+    """,
+    unsafe_allow_html=True,
+)
+
+col_l, col_m, col_r = st.columns([1, 1, 1], gap="small")
+planner_level = col_l.radio(
+    label="Targets by:",
+    options=["Macro Asset Classes", "Asset Classes", "Tickers"],
+    index=1,
+    key="planner_level",
+)
+planner_cash = col_m.number_input(
+    "Cash to invest (€)", min_value=0.0, value=float(monthly_investment), step=50.0
+)
+planner_fee = col_r.number_input(
+    "Fee per order (€)", min_value=0.0, value=get_trade_fee(df_storico), step=0.5
+)
+allow_sell = col_r.checkbox("Allow sell orders")
+
+planner_level = {
+    "Macro Asset Classes": "macro_asset_class",
+    "Asset Classes": "asset_class",
+    "Tickers": "ticker_yf",
+}[planner_level]
+df_current_weights = df_pivot.groupby(planner_level)["weight_pf"].sum()
+df_target_weights = st.data_editor(
+    df_current_weights.rename("Target weight (%)").round(1).to_frame(),
+    use_container_width=True,
+    key=f"target_weights_{planner_level}",
+)
+
+# Empty cells count as 0; with no positive target there is nothing to aim at
+target_weights = df_target_weights["Target weight (%)"].fillna(0).clip(lower=0)
+if not target_weights.sum() > 0:
+    st.warning("Set a positive target weight for at least one row to plan the orders.")
+else:
+    df_orders, df_allocation, cash_left = plan_integer_trades(
+        df_pivot=df_pivot,
+        df_last_closing=df_last_closing,
+        target_weights=target_weights,
+        level=planner_level,
+        cash=planner_cash,
+        fee_per_trade=planner_fee,
+        allow_sell=allow_sell,
+    )
+
+    col_l, col_r = st.columns([1, 1], gap="small")
+    col_l.dataframe(
+        df_orders.rename(
+            columns={
+                "ticker_yf": "Ticker",
+                "macro_asset_class": "Macro Asset Class",
+                "asset_class": "Asset Class",
+                "order": "Order",
+                "quantity": "Shares",
+                "price": "Price",
+                "amount": "Amount",
+                "fees": "Fees",
+            }
+        ).style.format(
+            {"Price": "{:,.2f} €", "Amount": "{:,.2f} €", "Fees": "{:,.2f} €"}
+        ),
+        use_container_width=True,
+        hide_index=True,
+    )
+    col_l.markdown(f"Cash left: **{cash_left:,.2f} €**")
+    col_r.dataframe(
+        df_allocation.rename(
+            columns={
+                "current_weight": "Current Weight",
+                "target_weight": "Target Weight",
+                "weight_after": "Weight After Orders",
+            }
+        ).style.format("{:.1%}"),
+        use_container_width=True,
+    )
+
 
 write_disclaimer()
+end_rerun()
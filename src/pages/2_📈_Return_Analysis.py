@@ -1,16 +1,48 @@
 import streamlit as st
-
-from input_output import write_disclaimer, get_max_common_history
-from returns import get_period_returns, get_rolling_returns, correlation_analysis
-from plot import plot_correlation_map, plot_returns, plot_rolling_returns, plot_correlation
+import pandas as pd
+import numpy as np
+
+from ui import write_disclaimer
+from input_output import get_price_history
+from returns import (
+    get_period_returns,
+    get_rolling_returns,
+    get_rolling_returns_surface,
+    get_worst_rolling_returns,
+    correlation_analysis,
+)
+from benchmark import get_benchmark_history, get_benchmark_metrics, align_to_dates
+from correlation import (
+    get_correlation_matrix,
+    get_clustered_correlation,
+    get_top_correlation_pairs,
+)
+from frontier import (
+    get_level_returns,
+    get_efficient_frontier,
+    get_portfolio_point,
+    has_too_few_dates,
+)
+from plot import (
+    plot_correlation_map,
+    plot_returns,
+    plot_rolling_returns,
+    plot_correlation,
+    plot_efficient_frontier,
+    plot_rolling_returns_surface,
+    plot_worst_rolling_returns,
+)
 from var import (
     GLOBAL_STREAMLIT_STYLE,
     PLT_CONFIG_NO_LOGO,
     FAVICON,
     DICT_GROUPBY_LEVELS,
     DICT_FREQ_RESAMPLE,
+    DICT_FREQ_PERIODS_YEAR,
+    DICT_BENCHMARKS,
     PLT_CONFIG,
 )
+from perf import start_rerun, start_section, end_rerun
 
 st.set_page_config(
     page_title="PFN | Return Analysis",
@@ -18,6 +50,7 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="auto",
 )
+start_rerun("Return Analysis")
 
 st.markdown(GLOBAL_STREAMLIT_STYLE, unsafe_allow_html=True)
 
@@ -29,7 +62,7 @@ else:
     st.stop()
 
 df_n_shares = (
-    df_transactions.groupby("ticker_yf")
+    df_transactions.groupby("ticker_yf", observed=True)
     .agg(n_shares=("shares", "sum"))
     .sort_values("n_shares", ascending=False)
 )
@@ -38,8 +71,10 @@ ticker_list = df_n_shares.loc[~(df_n_shares == 0).all(axis=1)].index.unique().to
 #filter out tickers that start with ^
 ticker_list = [ticker for ticker in ticker_list if not ticker.startswith('^')]
 
-df_common_history = get_max_common_history(ticker_list=ticker_list)
+# Whole history of every ticker: the ones listed later are NaN before their listing
+df_prices = get_price_history(ticker_list=ticker_list)
 
+start_section("Global settings")
 st.markdown("## Global settings")
 
 col_l_up, col_r_up = st.columns([1, 1], gap="small")
@@ -66,10 +101,12 @@ first_transaction = df_transactions["transaction_date"].sort_values().values[0]
 
 first_day, last_day = col_c_mid.select_slider(
     "Select a time slice:",
-    options=df_common_history.index,
+    options=df_prices.index,
     value=[
-        max(df_common_history.index[0], first_transaction),
-        df_common_history.index[-1],
+        df_prices.index[
+            min(df_prices.index.searchsorted(first_transaction), len(df_prices) - 1)
+        ],
+        df_prices.index[-1],
     ],
     format_func=lambda value: str(value)[:10],
     label_visibility="collapsed",
@@ -77,6 +114,7 @@ first_day, last_day = col_c_mid.select_slider(
 
 st.markdown("***")
 
+start_section("Correlation of returns")
 st.markdown(f"## Correlation of {freq.lower().replace('day','dai')}ly returns")
 
 enhance_corr = st.radio(
@@ -95,21 +133,54 @@ coeff_corr = st.radio(
 
 
 df_rets = get_period_returns(
-    df=df_common_history.loc[first_day:last_day, :],
+    df=df_prices.loc[first_day:last_day, :],
     df_registry=df_registry,
     tickers_to_evaluate=ticker_list,
     period=DICT_FREQ_RESAMPLE[freq],
     level=DICT_GROUPBY_LEVELS[level],
 )
 
+df_corr = get_correlation_matrix(df_rets, method=coeff_corr.lower())
+df_corr_view, corr_members = get_clustered_correlation(df_corr)
+
 fig = plot_correlation_map(
-    df=df_rets.corr(method=coeff_corr.lower()),
+    df=df_corr_view,
     enhance_correlation=enhance_corr.lower(),
 )
 st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG_NO_LOGO)
 
+if corr_members.map(len).gt(1).any():
+    with st.expander("Show me the groups of the heatmap"):
+        st.markdown(
+            "Highly correlated series are grouped together; each cell shows the average correlation between two groups."
+        )
+        st.dataframe(
+            corr_members.map(", ".join).rename("Members"), use_container_width=True
+        )
+
+with st.expander("Show me the most and least correlated pairs"):
+    col_l, col_r = st.columns([1, 1], gap="small")
+    pair_kind = col_l.radio(
+        "Pairs to show:",
+        options=["Strongest", "Weakest"],
+        horizontal=True,
+    )
+    n_pairs = col_r.slider("Number of pairs:", min_value=1, max_value=50, value=10)
+    st.dataframe(
+        get_top_correlation_pairs(
+            df_corr, k=n_pairs, strongest=pair_kind == "Strongest"
+        )
+        .rename(
+            columns={"first": "First", "second": "Second", "correlation": "Correlation"}
+        )
+        .style.format({"Correlation": "{:.2f}"}),
+        use_container_width=True,
+        hide_index=True,
+    )
+
 st.markdown("***")
 
+start_section("Distribution of returns")
 st.markdown(f"## Distribution of {freq.lower().replace('day','dai')}ly returns")
 
 default_objs = df_rets.columns.to_list()
@@ -130,6 +201,7 @@ st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
 
 st.markdown("***")
 
+start_section("Rolling returns")
 st.markdown("## Rolling returns")
 
 col_l_lw, col_r_lw = st.columns([1.3, 1], gap="large")
@@ -144,12 +216,12 @@ cols = col_l_lw.multiselect(
 window = col_r_lw.slider(
     "Choose a rolling window:",
     min_value=1,
-    max_value=df_common_history.loc[first_day:last_day, :].shape[0] - 2,
+    max_value=df_prices.loc[first_day:last_day, :].shape[0] - 2,
     value=30,
 )
 
 df_roll_ret = get_rolling_returns(
-    df_prices=df_common_history.loc[first_day:last_day, :].ffill(),
+    df_prices=df_prices.loc[first_day:last_day, :],
     df_registry=df_registry,
     tickers_to_evaluate=ticker_list,
     level=DICT_GROUPBY_LEVELS[level],
@@ -160,6 +232,174 @@ fig = plot_rolling_returns(df_roll_ret, window)
 st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
 # TODO add start and end period in hover
 
+with st.expander("Compare all the rolling windows"):
+    surface_obj = st.selectbox(
+        "Choose what to analyse:",
+        options=default_objs,
+    )
+    max_window = df_prices.loc[first_day:last_day, :].shape[0] - 2
+    # linspace would give windows <= 0 on a slice of two dates or less
+    if max_window < 1:
+        st.info("The selected time slice is too short to compare rolling windows")
+    else:
+        windows = tuple(
+            int(w_) for w_ in np.unique(np.linspace(1, max_window, 120).astype(int))
+        )
+        df_surface = get_rolling_returns_surface(
+            df_prices=df_prices.loc[first_day:last_day, :],
+            df_registry=df_registry,
+            tickers_to_evaluate=ticker_list,
+            windows=windows,
+            level=DICT_GROUPBY_LEVELS[level],
+            column=surface_obj,
+        )
+        fig = plot_rolling_returns_surface(df_surface)
+        st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
+
+        st.markdown(
+            "What is the worst return I could have got, holding for N trading days?"
+        )
+        fig = plot_worst_rolling_returns(get_worst_rolling_returns(df_surface))
+        st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
+
+st.markdown("***")
+
+start_section("Efficient frontier")
+st.markdown("## Efficient frontier")
+
+st.markdown(
+    """
+    The frontier joins the allocations of your holdings with the lowest volatility
+    for each level of expected return, estimated on the selected time slice.
+    The star is your portfolio with today's weights: the further it lies below the
+    frontier, the more return you could get for the same risk.
+    """,
+    unsafe_allow_html=True,
+)
+
+allow_short = st.checkbox(
+    "Allow short selling",
+    help="Without short selling, no weight can be negative",
+)
+
+df_rets_tickers = get_period_returns(
+    df=df_prices.loc[first_day:last_day, :],
+    df_registry=df_registry,
+    tickers_to_evaluate=ticker_list,
+    period=DICT_FREQ_RESAMPLE[freq],
+    level="ticker",
+)
+df_level_rets, pf_weight = get_level_returns(
+    df_rets=df_rets_tickers,
+    position_value=df_prices.iloc[-1] * df_n_shares["n_shares"],
+    df_registry=df_registry,
+    level=DICT_GROUPBY_LEVELS[level],
+)
+try:
+    df_frontier = get_efficient_frontier(
+        df_rets=df_level_rets,
+        periods_per_year=DICT_FREQ_PERIODS_YEAR[freq],
+        allow_short=allow_short,
+    )
+except ValueError as e:
+    st.info(str(e))
+else:
+    if allow_short and has_too_few_dates(df_level_rets):
+        st.warning(
+            f"The selected time slice has too few dates for {df_level_rets.shape[1]} "
+            f"{level.lower()}: the frontier with short selling is only indicative"
+        )
+    df_assets = pd.DataFrame(
+        {
+            "volatility": df_level_rets.std() * DICT_FREQ_PERIODS_YEAR[freq] ** 0.5,
+            "return": df_level_rets.mean() * DICT_FREQ_PERIODS_YEAR[freq],
+        }
+    )
+    pf_point = get_portfolio_point(
+        df_rets=df_level_rets,
+        weights=pf_weight,
+        periods_per_year=DICT_FREQ_PERIODS_YEAR[freq],
+    )
+
+    fig = plot_efficient_frontier(
+        df_frontier=df_frontier, df_assets=df_assets, pf_point=pf_point
+    )
+    st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
+
+    with st.expander("Show me the frontier allocation with my volatility"):
+        frontier_point = df_frontier.iloc[
+            (df_frontier["volatility"] - pf_point[0]).abs().argmin()
+        ]
+        st.dataframe(
+            pd.DataFrame(
+                {
+                    "Current weight": pf_weight,
+                    "Frontier weight": frontier_point[df_level_rets.columns],
+                }
+            ).style.format("{:.1%}"),
+            use_container_width=True,
+        )
+
+st.markdown("***")
+
+start_section("Benchmark comparison")
+st.markdown("## Benchmark comparison")
+
+benchmark_options = list(
+    dict.fromkeys(st.session_state.get("benchmarks", []) + list(DICT_BENCHMARKS))
+)
+benchmarks = st.multiselect(
+    "Choose the indices to compare with:",
+    options=benchmark_options,
+    default=benchmark_options[0],
+    format_func=lambda ticker: DICT_BENCHMARKS.get(ticker, ticker),
+)
+
+if benchmarks:
+    df_benchmark_prices = align_to_dates(
+        get_benchmark_history(benchmark_list=benchmarks),
+        dates=df_prices.index,
+    )
+    df_benchmark_rets = get_period_returns(
+        df=df_benchmark_prices.loc[first_day:last_day, :],
+        df_registry=df_registry,
+        tickers_to_evaluate=benchmarks,
+        period=DICT_FREQ_RESAMPLE[freq],
+        level="ticker",
+    )
+    df_benchmark_metrics = get_benchmark_metrics(
+        df_rets=df_level_rets.assign(Portfolio=df_level_rets @ pf_weight),
+        df_benchmark_rets=df_benchmark_rets,
+
+        periods_per_year=DICT_FREQ_PERIODS_YEAR[freq],
+    )
+    st.dataframe(
+        df_benchmark_metrics.rename(
+            index=lambda ticker: DICT_BENCHMARKS.get(ticker, ticker), level=0
+        )
+        .rename(
+            columns={
+                "beta": "Beta",
+                "alpha": "Alpha",
+                "tracking_error": "Tracking Error",
+                "information_ratio": "Information Ratio",
+                "up_capture": "Up Capture",
+                "down_capture": "Down Capture",
+            }
+        )
+        .style.format(
+            {
+                "Beta": "{:.2f}",
+                "Alpha": "{:.2%}",
+                "Tracking Error": "{:.2%}",
+                "Information Ratio": "{:.2f}",
+                "Up Capture": "{:.0%}",
+                "Down Capture": "{:.0%}",
+            }
+        ),
+        use_container_width=True,
+    )
 
 
 write_disclaimer()
+end_rerun()
@@ -1,8 +1,22 @@
 import streamlit as st
 
-from input_output import write_disclaimer, get_max_common_history
-from risk import get_drawdown, get_max_dd, get_portfolio_relative_risk_contribution, compute_metrics, compute_rolling_metrics
+from ui import write_disclaimer
+from input_output import get_price_history
+from risk import (
+    get_drawdown,
+    get_max_dd,
+    get_portfolio_relative_risk_contribution,
+    compute_metrics,
+    compute_rolling_metrics,
+    get_rolling_relative_risk_contribution,
+    get_portfolio_covariance,
+    get_log_returns_and_weights,
+    get_portfolio_var_cvar,
+)
+from aggregation import aggregate_by_ticker
+from rebalancing import get_risk_budget_weights, get_rebalancing_trades
 from returns import get_period_returns
+from stress import get_stress_scenarios
 from plot import plot_drawdown, plot_horizontal_bar, plot_risk_metrics_over_time
 import pandas as pd
 from var import (
@@ -11,8 +25,11 @@ from var import (
     FAVICON,
     DICT_GROUPBY_LEVELS,
     DICT_FREQ_RESAMPLE,
+    DICT_COVARIANCE_ESTIMATORS,
+    DICT_STRESS_SCENARIOS,
     PLT_CONFIG,
 )
+from perf import start_rerun, start_section, end_rerun
 
 st.set_page_config(
     page_title="PFN | Risk Analysis",
@@ -20,6 +37,7 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="auto",
 )
+start_rerun("Risk Analysis")
 
 st.markdown(GLOBAL_STREAMLIT_STYLE, unsafe_allow_html=True)
 
@@ -31,14 +49,16 @@ else:
     st.stop()
 
 df_n_shares = (
-    df_transactions.groupby("ticker_yf")
+    df_transactions.groupby("ticker_yf", observed=True)
     .agg(n_shares=("shares", "sum"))
     .sort_values("n_shares", ascending=False)
 )
 ticker_list = df_n_shares.loc[~(df_n_shares == 0).all(axis=1)].index.unique().to_list()
 
-df_common_history = get_max_common_history(ticker_list=ticker_list)
+# Whole history of every ticker: the ones listed later are NaN before their listing
+df_prices = get_price_history(ticker_list=ticker_list)
 
+start_section("Global settings")
 st.markdown("## Global settings")
 
 col_l_up, col_r_up = st.columns([1, 1], gap="small")
@@ -65,10 +85,12 @@ first_transaction = df_transactions["transaction_date"].sort_values().values[0]
 
 first_day, last_day = col_c_mid.select_slider(
     "Select a time slice:",
-    options=df_common_history.index,
+    options=df_prices.index,
     value=[
-        max(df_common_history.index[0], first_transaction),
-        df_common_history.index[-1],
+        df_prices.index[
+            min(df_prices.index.searchsorted(first_transaction), len(df_prices) - 1)
+        ],
+        df_prices.index[-1],
     ],
     format_func=lambda value: str(value)[:10],
     label_visibility="collapsed",
@@ -76,10 +98,11 @@ first_day, last_day = col_c_mid.select_slider(
 
 st.markdown("***")
 
+start_section("Drawdown")
 st.markdown(f"## Drawdown in {freq.lower().replace('day','dai')}ly returns")
 
 df_rets = get_period_returns(
-    df=df_common_history.loc[first_day:last_day, :],
+    df=df_prices.loc[first_day:last_day, :],
     df_registry=df_registry,
     tickers_to_evaluate=ticker_list,
     period=DICT_FREQ_RESAMPLE[freq],
@@ -118,6 +141,7 @@ st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
 
 st.markdown("***")
 
+start_section("Relative risk contribution")
 st.markdown("## Relative risk contribution")
 
 st.markdown(
@@ -167,11 +191,23 @@ order_by = (
     "pf_weight" if order_by == "Portfolio weight" else "relative_risk_contribution"
 )
 
+covariance_estimator = st.radio(
+    "Covariance estimator:",
+    options=list(DICT_COVARIANCE_ESTIMATORS.keys()),
+    horizontal=True,
+    help="""
+    Exponentially weighted covariance gives more weight to recent returns
+    (half-life of 63 trading days); shrinkage pulls the sample covariance
+    towards a diagonal matrix, making it more stable when there are many assets
+    """,
+)
+
 df_rrc = get_portfolio_relative_risk_contribution(
-    df_prices=df_common_history.loc[first_day:last_day, :],
+    df_prices=df_prices.loc[first_day:last_day, :],
     df_shares=df_n_shares,
     df_registry=df_registry[df_registry["ticker_yf"].isin(ticker_list)],
     level=DICT_GROUPBY_LEVELS[level],
+    **DICT_COVARIANCE_ESTIMATORS[covariance_estimator],
 ).sort_values(by=order_by, ascending=False)
 
 fig = plot_horizontal_bar(
@@ -186,10 +222,245 @@ fig = plot_horizontal_bar(
 )
 st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG_NO_LOGO)
 
+st.markdown("### Risk parity rebalancing")
+
+st.markdown(
+    """
+    Which weights would make each asset (or asset class) contribute to portfolio
+    risk exactly as much as you want? By default, the risk budget is the same for
+    everyone, which is known as <b>risk parity</b> portfolio.
+    """,
+    unsafe_allow_html=True,
+)
+
+covariance, pf_weight = get_portfolio_covariance(
+    df_prices=df_prices.loc[first_day:last_day, :],
+    df_shares=df_n_shares,
+    df_registry=df_registry[df_registry["ticker_yf"].isin(ticker_list)],
+    level=DICT_GROUPBY_LEVELS[level],
+    **DICT_COVARIANCE_ESTIMATORS[covariance_estimator],
+)
+
+risk_budget = st.radio(
+    "Risk budgets:",
+    options=["Equal risk contribution", "Custom"],
+    horizontal=True,
+)
+if risk_budget == "Custom":
+    df_budgets = st.data_editor(
+        pd.DataFrame({"Risk budget (%)": 100 / len(pf_weight)}, index=pf_weight.index),
+        use_container_width=True,
+    )
+    risk_budgets = df_budgets["Risk budget (%)"].clip(lower=0)
+else:
+    risk_budgets = None
+
+try:
+    target_weights = get_risk_budget_weights(covariance, risk_budgets=risk_budgets)
+except ValueError as e:
+    st.info(str(e))
+else:
+    df_target = pd.DataFrame(
+        {
+            "Current weight": pf_weight,
+            "Current risk contribution": df_rrc["relative_risk_contribution"],
+            "Target weight": target_weights,
+        }
+    ).sort_values("Target weight", ascending=False)
+    st.dataframe(
+        df_target.style.format("{:.1%}"),
+        use_container_width=True,
+    )
+
+    with st.expander("Show me the trades"):
+        df_trades = get_rebalancing_trades(
+            df_holdings=aggregate_by_ticker(df_transactions, in_pf_only=True),
+            df_prices=df_prices.loc[first_day:last_day, :],
+            target_weights=target_weights,
+            df_registry=df_registry,
+            level=DICT_GROUPBY_LEVELS[level],
+        )
+        st.dataframe(
+            df_trades[
+                [
+                    "ticker_yf",
+                    "shares",
+                    "price",
+                    "current_value",
+                    "target_value",
+                    "trade_value",
+                    "trade_shares",
+                ]
+            ]
+            .rename(
+                columns={
+                    "ticker_yf": "Ticker",
+                    "shares": "Shares",
+                    "price": "Last Price",
+                    "current_value": "Current Value",
+                    "target_value": "Target Value",
+                    "trade_value": "Trade Value",
+                    "trade_shares": "Shares to Trade",
+                }
+            )
+            .style.format(
+                {
+                    "Shares": "{:,.0f}",
+                    "Last Price": "{:,.2f} €",
+                    "Current Value": "{:,.1f} €",
+                    "Target Value": "{:,.1f} €",
+                    "Trade Value": "{:+,.1f} €",
+                    "Shares to Trade": "{:+,.1f}",
+                }
+            ),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+st.markdown("### Relative risk contribution over time")
+
+st.markdown(
+    """
+    Each day, the covariance is estimated on the previous trading days of the
+    selected window, and the weights are those of the shares actually held on
+    that day according to your transactions.
+    """,
+    unsafe_allow_html=True,
+)
+
+rrc_window = st.radio(
+    "Specify a rolling time window:",
+    options=["3 months (63 days)", "6 months (126 days)", "1 year (252 days)"],
+    horizontal=True,
+    key="rrc_window",
+)
+
+df_rolling_rrc = get_rolling_relative_risk_contribution(
+    df_prices=df_prices.loc[first_day:last_day, :],
+    df_transactions=df_transactions,
+    df_registry=df_registry[df_registry["ticker_yf"].isin(ticker_list)],
+    level=DICT_GROUPBY_LEVELS[level],
+    window={
+        "3 months (63 days)": 63,
+        "6 months (126 days)": 126,
+        "1 year (252 days)": 252,
+    }[rrc_window],
+)
+
+# The first date with a contribution closes the first full window
+df_rolling_rrc = df_rolling_rrc.dropna(how="all")
+if df_rolling_rrc.empty:
+    st.info(
+        "The selected time slice is too short for the rolling window: choose a "
+        "longer slice or a shorter window"
+    )
+else:
+    fig = plot_risk_metrics_over_time(df=df_rolling_rrc)
+    st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
+
+st.markdown("***")
+
+start_section("Portfolio Value at Risk")
+st.markdown("## Portfolio Value at Risk")
+
+st.markdown(
+    """
+    With the current weights, the <b>Value at Risk</b> (VaR) is the loss that the
+    portfolio should not exceed over the horizon, with the given confidence;
+    the <b>Conditional VaR</b> (CVaR) is the average loss when the VaR is exceeded.
+    """,
+    unsafe_allow_html=True,
+)
+
+col_l, col_r = st.columns([1, 1], gap="small")
+var_method = col_l.radio(
+    "Method:",
+    options=["Historical", "Parametric", "Filtered simulation"],
+    horizontal=True,
+    help="""
+    Historical uses the returns of the time slice as they are; Parametric assumes
+    normally distributed returns; Filtered simulation resamples the historical
+    returns rescaled to today's (exponentially weighted) volatility
+    """,
+)
+confidence_levels = col_r.multiselect(
+    "Confidence levels:",
+    options=[0.9, 0.95, 0.975, 0.99],
+    default=[0.95, 0.99],
+    format_func=lambda value: f"{value:.1%}",
+)
+
+_, pf_weight_tickers = get_log_returns_and_weights(
+    df_prices=df_prices.loc[first_day:last_day, :],
+    df_shares=df_n_shares,
+    df_registry=df_registry,
+    level="ticker",
+)
+df_var = get_portfolio_var_cvar(
+    df_rets=df_prices.loc[first_day:last_day, :].pct_change(fill_method=None).iloc[1:],
+    weights=pf_weight_tickers,
+    method={
+        "Historical": "historical",
+        "Parametric": "parametric",
+        "Filtered simulation": "filtered",
+    }[var_method],
+    confidence_levels=tuple(sorted(confidence_levels)),
+)
+st.dataframe(df_var.style.format("{:.2%}", na_rep="–"), use_container_width=True)
+
+st.markdown("***")
+
+start_section("Historical stress test")
+st.markdown("## Historical stress test")
+
+st.markdown(
+    """
+    How would the shares you hold <b>today</b> have behaved during past market
+    crises? Scenarios that begin before all your tickers were listed cannot be
+    replayed and are left empty. The recovery is the number of days it took,
+    after the trough, to get back to the previous peak.
+    """,
+    unsafe_allow_html=True,
+)
+
+custom_range = st.date_input(
+    "Add a custom scenario:",
+    value=(),
+    min_value=df_prices.index[0],
+    max_value=df_prices.index[-1],
+    help="Select the first and the last day of the period to replay",
+)
+stress_scenarios = dict(DICT_STRESS_SCENARIOS)
+if len(custom_range) == 2:
+    stress_scenarios["Custom"] = tuple(day.isoformat() for day in custom_range)
+
+df_stress, df_stress_paths = get_stress_scenarios(
+    df_prices=df_prices,
+    df_shares=df_n_shares,
+    scenarios=stress_scenarios,
+)
+st.dataframe(
+    df_stress.style.format(
+        {
+            "total_return": "{:.2%}",
+            "max_drawdown": "{:.2%}",
+            "recovery_days": "{:.0f}",
+        },
+        na_rep="-",
+    ),
+    use_container_width=True,
+)
+if not df_stress_paths.empty:
+    fig = plot_risk_metrics_over_time(df=df_stress_paths)
+    fig.update_layout(xaxis=dict(title="Trading days from the start of the scenario"))
+    st.plotly_chart(fig, use_container_width=True, config=PLT_CONFIG)
+
+st.markdown("***")
 
+start_section("Last year risk metrics")
 st.markdown("## Last year risk metrics")
 df_rets = get_period_returns(
-    df=df_common_history.loc[first_day:last_day, :],
+    df=df_prices.loc[first_day:last_day, :],
     df_registry=df_registry,
     tickers_to_evaluate=ticker_list,
     period=DICT_FREQ_RESAMPLE["Day"],
@@ -199,7 +470,6 @@ df_rets = get_period_returns(
 df_rets = df_rets.iloc[-252:]
 metrics_df = compute_metrics(df_returns=df_rets, trading_days=len(df_rets))
 
-metrics_df.to_excel("metrics.xlsx")
 st.dataframe(metrics_df.style.format("{:.4f}"))
 
 st.markdown("***")
@@ -209,7 +479,7 @@ st.markdown("***")
 #window = st.slider(
 #    "Choose a rolling window:",
 #    min_value=1,
-#    max_value=df_common_history.loc[first_day:last_day, :].shape[0] - 2,
+#    max_value=df_prices.loc[first_day:last_day, :].shape[0] - 2,
 #    value=30,
 #)
 
@@ -233,4 +503,5 @@ st.markdown("***")
 
 
 
-write_disclaimer()
\ No newline at end of file
+write_disclaimer()
+end_rerun()
@@ -0,0 +1,102 @@
+from typing import Dict, List
+
+import pandas as pd
+import numpy as np
+
+
+def ffill_rows(values: np.ndarray) -> np.ndarray:
+    # Forward fill of the NaNs along the rows, column by column; the NaNs before the
+    # first value of a column are left as they are
+    is_valid = ~np.isnan(values)
+    row_pos = np.where(is_valid, np.arange(values.shape[0])[:, np.newaxis], 0)
+    np.maximum.accumulate(row_pos, axis=0, out=row_pos)
+    return np.take_along_axis(values, row_pos, axis=0)
+
+
+def bfill_rows(values: np.ndarray) -> np.ndarray:
+    return ffill_rows(values[::-1])[::-1]
+
+
+def get_available_average(values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Weighted average of each row over its non-NaN values only.
+
+    The weights of the missing values are left out and the others rescaled, e.g. the
+    return of a basket on a day on which one of its tickers was not listed yet is
+    the return of the other tickers. weights can be a vector or a matrix with one
+    column per average; rows with no weight available give NaN.
+    """
+    is_valid = ~np.isnan(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (np.where(is_valid, values, 0) @ weights) / (is_valid @ weights)
+
+
+class PricePanel:
+    """Prices of several tickers on a shared DatetimeIndex.
+
+    The prices are a single C-contiguous dates x tickers array (NaN where a ticker
+    has no price), instead of one Series per ticker with its own index. The dates are
+    the union of those of the tickers, so each ticker keeps its whole history; its
+    listing starts at its first price, and is_listed tells which prices exist.
+    """
+
+    def __init__(self, values: np.ndarray, dates: pd.DatetimeIndex, tickers: List[str]):
+        self.values = np.ascontiguousarray(values)
+        self.dates = dates
+        self.tickers = list(tickers)
+
+    @classmethod
+    def from_series(
+        cls,
+        price_histories: Dict[str, pd.Series],
+        ticker_list: List[str],
+        dtype: np.dtype = np.float64,
+    ) -> "PricePanel":
+        # Histories of the same exchange mostly share their dates: the union only
+        # grows when they differ
+        dates = pd.DatetimeIndex([])
+        for ticker_ in ticker_list:
+            index = price_histories[ticker_].index
+            if not index.equals(dates):
+                dates = dates.union(index)
+        values = np.full((len(dates), len(ticker_list)), np.nan, dtype=dtype)
+        for i, ticker_ in enumerate(ticker_list):
+            history = price_histories[ticker_]
+            values[dates.get_indexer(history.index), i] = history.to_numpy()
+        return cls(values=values, dates=dates, tickers=ticker_list)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.dates.nbytes
+
+    @property
+    def is_listed(self) -> np.ndarray:
+        # From the first price of each ticker onwards
+        return np.logical_or.accumulate(~np.isnan(self.values), axis=0)
+
+    @property
+    def first_valid_dates(self) -> pd.Series:
+        # NaT for the tickers with no price at all
+        is_valid = ~np.isnan(self.values)
+        first_pos = is_valid.argmax(axis=0)
+        return pd.Series(
+            self.dates[first_pos].where(is_valid.any(axis=0)), index=self.tickers
+        )
+
+    def loc(self, start=None, end=None) -> "PricePanel":
+        # Rows between start and end (both included), sharing memory with the panel
+        first, last = self.dates.slice_locs(start, end)
+        return PricePanel(
+            values=self.values[first:last],
+            dates=self.dates[first:last],
+            tickers=self.tickers,
+        )
+
+    def ffill(self) -> "PricePanel":
+        # The last price is carried over the days on which a listed ticker was not
+        # quoted (e.g. holidays of its exchange); prices before the listing stay NaN
+        return PricePanel(
+            values=ffill_rows(self.values), dates=self.dates, tickers=self.tickers
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.values, index=self.dates, columns=self.tickers)
@@ -0,0 +1,413 @@
+"""Timing spans of the page reruns.
+
+Streamlit reruns the whole page at every interaction: each page opens a rerun with
+start_rerun, marks its sections with start_section and closes it with end_rerun.
+In between, the functions decorated with traced (and the blocks wrapped in span)
+record their wall time, cache outcome, input shape and network calls.
+
+The spans of the rerun are shown in the sidebar when the page is opened with
+?perf=1 (or PERF_PANEL_ENV_VAR is set), and appended as a JSON line to the file
+in PERF_LOG_ENV_VAR, if any.
+
+A whole rerun can also be run under a profiler, but only where PROFILER_ENV_VAR
+allows it: "query" profiles the reruns of pages opened with ?profile=1 (or
+?profile=pyinstrument, if installed), "always" profiles every rerun. When unset,
+the query parameter is ignored and nothing is profiled.
+
+Streamlit is only imported by the functions writing to the page, so that the
+analytics can record their spans without it.
+"""
+import cProfile
+import functools
+import inspect
+import json
+import marshal
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List
+
+import pandas as pd
+import numpy as np
+
+from var import PERF_LOG_ENV_VAR, PERF_PANEL_ENV_VAR, PROFILER_ENV_VAR, PROFILER_TOP_N
+from cache import STORAGE_MANAGER, CachedFunction, get_cache_report
+
+# Each session runs its page script on its own thread
+_local = threading.local()
+
+# Read once, so that a disabled profiler costs nothing at each rerun
+PROFILER_MODE = os.environ.get(PROFILER_ENV_VAR, "").lower()
+
+
+def _get_rerun() -> Dict | None:
+    return getattr(_local, "rerun", None)
+
+
+def _get_elapsed_ms(rerun: Dict) -> float:
+    return 1000 * (time.perf_counter() - rerun["started"])
+
+
+def _get_shape(value: Any) -> List[int] | None:
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return list(value.shape)
+    if isinstance(value, (list, tuple, dict, set)):
+        return [len(value)]
+    return None
+
+
+def start_rerun(page: str) -> None:
+    # A rerun interrupted by an exception (e.g. st.stop) never reached end_rerun
+    stale_rerun = _get_rerun()
+    if stale_rerun is not None and stale_rerun["profiler"] is not None:
+        _stop_profiler(stale_rerun["profiler"])
+    _local.rerun = {
+        "page": page,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "started": time.perf_counter(),
+        "section": None,
+        "sections": [],
+        "spans": [],
+        "stack": [],
+        "profiler": _start_profiler() if PROFILER_MODE else None,
+    }
+    start_section("Setup")
+
+
+def start_section(name: str) -> None:
+    # A section lasts until the next one starts, or until the end of the rerun
+    rerun = _get_rerun()
+    if rerun is None:
+        return
+    _close_section(rerun)
+    rerun["section"] = name
+    rerun["sections"].append(
+        {"section": name, "start_ms": _get_elapsed_ms(rerun), "duration_ms": None}
+    )
+
+
+def _close_section(rerun: Dict) -> None:
+    if rerun["sections"] and rerun["sections"][-1]["duration_ms"] is None:
+        last_section = rerun["sections"][-1]
+        last_section["duration_ms"] = _get_elapsed_ms(rerun) - last_section["start_ms"]
+
+
+@contextmanager
+def span(name: str, **inputs) -> Iterator[Dict]:
+    """Record the wall time of the block, and the shape of the given inputs."""
+    rerun = _get_rerun()
+    if rerun is None:
+        yield {}
+        return
+    record = {
+        "name": name,
+        "section": rerun["section"],
+        "depth": len(rerun["stack"]),
+        "start_ms": _get_elapsed_ms(rerun),
+        "duration_ms": None,
+        "cache": None,
+        "input_shape": {
+            k_: shape_ for k_, v_ in inputs.items() if (shape_ := _get_shape(v_))
+        },
+        "network_calls": 0,
+    }
+    rerun["stack"].append(record)
+    try:
+        yield record
+    finally:
+        record["duration_ms"] = _get_elapsed_ms(rerun) - record["start_ms"]
+        rerun["stack"].pop()
+        rerun["spans"].append(record)
+
+
+def record_network_call() -> None:
+    # Counted in every open span, in the same way as their wall time
+    rerun = _get_rerun()
+    if rerun is not None:
+        for record_ in rerun["stack"]:
+            record_["network_calls"] += 1
+
+
+def traced(func: Callable) -> Callable:
+    """Run func inside a span named after it.
+
+    Goes above cache_data: the underlying function is then flagged, so that the
+    span tells a cache hit from a miss.
+    """
+    is_cached = isinstance(func, CachedFunction)
+    if is_cached:
+        compute = func.func
+
+        @functools.wraps(compute)
+        def compute_and_flag(*args, **kwargs):
+            rerun = _get_rerun()
+            if rerun is not None and rerun["stack"]:
+                rerun["stack"][-1]["cache"] = "miss"
+            return compute(*args, **kwargs)
+
+        func.func = compute_and_flag
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _get_rerun() is None:
+            return func(*args, **kwargs)
+        try:
+            inputs = signature.bind_partial(*args, **kwargs).arguments
+        except TypeError:
+            inputs = {}
+        with span(func.__name__, **inputs) as record:
+            if is_cached:
+                record["cache"] = "hit"
+            return func(*args, **kwargs)
+
+    if hasattr(func, "clear"):
+        wrapper.clear = func.clear
+    return wrapper
+
+
+def is_panel_enabled() -> bool:
+    import streamlit as st
+
+    return bool(os.environ.get(PERF_PANEL_ENV_VAR)) or st.query_params.get("perf") in (
+        "1",
+        "true",
+    )
+
+
+def get_spans_table(rerun: Dict) -> pd.DataFrame:
+    return (
+        pd.DataFrame(
+            rerun["spans"],
+            columns=[
+                "name",
+                "section",
+                "depth",
+                "start_ms",
+                "duration_ms",
+                "cache",
+                "input_shape",
+                "network_calls",
+            ],
+        )
+        .sort_values("start_ms")
+        .reset_index(drop=True)
+    )
+
+
+def get_sections_table(rerun: Dict) -> pd.DataFrame:
+    df_sections = pd.DataFrame(
+        rerun["sections"], columns=["section", "start_ms", "duration_ms"]
+    )
+    df_spans = get_spans_table(rerun)
+    # Only the outermost spans, so that nested calls are not counted twice
+    df_top = df_spans[df_spans["depth"].eq(0)].groupby("section", dropna=False)
+    return df_sections.merge(
+        df_top.agg(
+            traced_ms=("duration_ms", "sum"),
+            network_calls=("network_calls", "sum"),
+            cache_misses=("cache", lambda x: x.eq("miss").sum()),
+        ),
+        how="left",
+        left_on="section",
+        right_index=True,
+    ).fillna({"traced_ms": 0, "network_calls": 0, "cache_misses": 0})
+
+
+def write_panel(rerun: Dict) -> None:
+    import streamlit as st
+
+    total_ms = _get_elapsed_ms(rerun)
+    df_spans = get_spans_table(rerun)
+    with st.sidebar.expander("⏱️ Performance of this rerun", expanded=False):
+        st.metric("Rerun time", f"{total_ms / 1000:.2f} s")
+        st.dataframe(
+            get_sections_table(rerun)
+            .drop(columns="start_ms")
+            .rename(
+                columns={
+                    "section": "Section",
+                    "duration_ms": "Time (ms)",
+                    "traced_ms": "Traced (ms)",
+                    "network_calls": "Network calls",
+                    "cache_misses": "Cache misses",
+                }
+            )
+            .style.format(
+                {
+                    "Time (ms)": "{:.0f}",
+                    "Traced (ms)": "{:.0f}",
+                    "Network calls": "{:.0f}",
+                    "Cache misses": "{:.0f}",
+                }
+            ),
+            use_container_width=True,
+            hide_index=True,
+        )
+        st.dataframe(
+            df_spans.assign(
+                name=lambda df_: df_["depth"].map(lambda d_: "· " * d_) + df_["name"],
+                input_shape=lambda df_: df_["input_shape"].astype(str),
+            )
+            .drop(columns=["depth", "start_ms"])
+            .rename(
+                columns={
+                    "name": "Function",
+                    "section": "Section",
+                    "duration_ms": "Time (ms)",
+                    "cache": "Cache",
+                    "input_shape": "Input shape",
+                    "network_calls": "Network calls",
+                }
+            )
+            .style.format({"Time (ms)": "{:.1f}"}),
+            use_container_width=True,
+            hide_index=True,
+        )
+        st.caption(
+            f"Cache: {STORAGE_MANAGER.size_bytes / 2**20:.1f} MB used of "
+            f"{STORAGE_MANAGER.budget_bytes / 2**20:.0f} MB, "
+            f"{STORAGE_MANAGER.n_evictions} entries evicted"
+        )
+        st.dataframe(
+            get_cache_report()
+            .rename(
+                columns={
+                    "function": "Function",
+                    "entries": "Entries",
+                    "max_entries": "Max entries",
+                    "size_mb": "Size (MB)",
+                }
+            )
+            .style.format({"Size (MB)": "{:.2f}", "Max entries": "{:.0f}"}),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+def write_log(rerun: Dict, path: str) -> None:
+    record = {
+        "timestamp": rerun["timestamp"],
+        "page": rerun["page"],
+        "duration_ms": round(_get_elapsed_ms(rerun), 1),
+        "sections": get_sections_table(rerun).round(1).to_dict(orient="records"),
+        "spans": get_spans_table(rerun).round(1).to_dict(orient="records"),
+        "cache_mb": round(STORAGE_MANAGER.size_bytes / 2**20, 1),
+    }
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+def end_rerun() -> None:
+    rerun = _get_rerun()
+    if rerun is None:
+        return
+    _close_section(rerun)
+    if rerun["profiler"] is not None:
+        _stop_profiler(rerun["profiler"])
+        write_profile(rerun)
+    if is_panel_enabled():
+        write_panel(rerun)
+    log_path = os.environ.get(PERF_LOG_ENV_VAR)
+    if log_path:
+        write_log(rerun, log_path)
+    _local.rerun = None
+
+
+def _get_profiler_kind() -> str | None:
+    if PROFILER_MODE == "always":
+        return "cprofile"
+    if PROFILER_MODE == "query":
+        import streamlit as st
+
+        requested = st.query_params.get("profile", "")
+        if requested == "pyinstrument":
+            return "pyinstrument"
+        if requested in ("1", "true", "cprofile"):
+            return "cprofile"
+    return None
+
+
+def _start_profiler() -> Dict | None:
+    kind = _get_profiler_kind()
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            import streamlit as st
+
+            st.sidebar.warning("pyinstrument is not installed, using cProfile")
+            kind = "cprofile"
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return {"kind": kind, "profiler": profiler}
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return {"kind": kind, "profiler": profiler}
+    return None
+
+
+def _stop_profiler(profiler: Dict) -> None:
+    if profiler["kind"] == "pyinstrument":
+        if profiler["profiler"].is_running:
+            profiler["profiler"].stop()
+    else:
+        profiler["profiler"].disable()
+
+
+def get_hotspots(stats: pstats.Stats, top_n: int = PROFILER_TOP_N) -> pd.DataFrame:
+    # Functions by own time, i.e. excluding the time spent in the functions they call
+    df_stats = pd.DataFrame(
+        [
+            (f"{func_} ({os.path.basename(file_)}:{line_})", n_calls, own, cumulative)
+            for (file_, line_, func_), (_, n_calls, own, cumulative, _) in (
+                stats.stats.items()
+            )
+        ],
+        columns=["function", "calls", "own_s", "cumulative_s"],
+    )
+    return df_stats.nlargest(top_n, "own_s").reset_index(drop=True)
+
+
+def write_profile(rerun: Dict) -> None:
+    import streamlit as st
+
+    file_name = rerun["page"].lower().replace(" ", "_").replace("&", "and")
+    with st.sidebar.expander("🔬 Profile of this rerun", expanded=True):
+        if rerun["profiler"]["kind"] == "pyinstrument":
+            profiler = rerun["profiler"]["profiler"]
+            st.download_button(
+                "Download the flame graph",
+                data=profiler.output_html(),
+                file_name=f"{file_name}.html",
+                mime="text/html",
+            )
+            st.code(profiler.output_text(unicode=True, show_all=False))
+            return
+        stats = pstats.Stats(rerun["profiler"]["profiler"])
+        st.download_button(
+            "Download the profile (pstats)",
+            # The format written by pstats.Stats.dump_stats
+            data=marshal.dumps(stats.stats),
+            file_name=f"{file_name}.prof",
+            mime="application/octet-stream",
+        )
+        st.dataframe(
+            get_hotspots(stats)
+            .rename(
+                columns={
+                    "function": "Function",
+                    "calls": "Calls",
+                    "own_s": "Own time (s)",
+                    "cumulative_s": "Cumulative time (s)",
+                }
+            )
+            .style.format({"Own time (s)": "{:.3f}", "Cumulative time (s)": "{:.3f}"}),
+            use_container_width=True,
+            hide_index=True,
+        )
@@ -0,0 +1,154 @@
+import pandas as pd
+import numpy as np
+
+from var import CACHE_EXPIRE_SECONDS, TRADING_DAYS_YEAR
+from cache import cache_data
+from aggregation import get_holdings_history
+from input_output import get_full_price_history
+
+
+def get_flow_adjusted_daily_returns(df_wealth: pd.DataFrame) -> pd.Series:
+    # Daily portfolio returns net of the cash flows of the day (purchases and sales),
+    # i.e. r_t = (V_t - flow_t) / V_(t-1) - 1
+    flows = df_wealth["ap_cum_spent"].diff()
+    previous_value = df_wealth["ap_daily_value"].shift(1)
+    return (
+        (df_wealth["ap_daily_value"] - flows)
+        .div(previous_value.where(previous_value.gt(0)))
+        .sub(1)
+        .dropna()
+    )
+
+
+def get_time_weighted_return(df_wealth: pd.DataFrame) -> tuple[float, float]:
+    # Cumulative and annualised TWR, chaining the flow-adjusted daily returns
+    daily_rets = get_flow_adjusted_daily_returns(df_wealth)
+    cumulative = float(np.expm1(np.log1p(daily_rets).sum()))
+    n_years = (daily_rets.index[-1] - daily_rets.index[0]).days / 365.25
+    annualised = (1 + cumulative) ** (1 / n_years) - 1 if n_years > 0 else np.nan
+    return cumulative, annualised
+
+
+@cache_data(ttl=10 * CACHE_EXPIRE_SECONDS)
+def get_ticker_time_weighted_returns(
+    df_transactions: pd.DataFrame, ticker_list: list[str]
+) -> pd.DataFrame:
+    """Cumulative and annualised TWR of each ticker over the days it was held.
+
+    Flows do not alter the return of a single security, so its TWR chains the price
+    returns of the days on which the position was open at the previous close.
+    """
+    full_history = get_full_price_history(ticker_list)
+    df_prices = pd.concat([full_history[t_] for t_ in ticker_list], axis=1).ffill()
+    df_holdings = get_holdings_history(
+        df_transactions, ticker_list=ticker_list, dates=df_prices.index
+    )
+    is_held = df_holdings.shift(1).fillna(0).ne(0).to_numpy()
+    log_rets = np.log(df_prices / df_prices.shift(1)).fillna(0).to_numpy()
+    cumulative = np.expm1(np.sum(log_rets * is_held, axis=0))
+    n_years = is_held.sum(axis=0) / TRADING_DAYS_YEAR
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annualised = np.where(
+            n_years > 0, (1 + cumulative) ** (1 / n_years) - 1, np.nan
+        )
+    return pd.DataFrame(
+        {"twr": cumulative, "twr_annualised": annualised}, index=ticker_list
+    )
+
+
+def _solve_xirr(
+    amounts: np.ndarray,
+    years: np.ndarray,
+    groups: np.ndarray,
+    n_groups: int,
+    bracket: tuple[float, float] = (-0.999, 100.0),
+    tol: float = 1e-10,
+    max_iter: int = 100,
+) -> np.ndarray:
+    """Internal rate of return of every group of cash flows at once.
+
+    Newton steps on NPV(r) = sum(a / (1+r)^t) are taken on all groups together with
+    one bincount per iteration; a step that leaves the current bracket of a group is
+    replaced by bisection, so each group converges even from a poor starting point.
+    """
+
+    def npv_and_derivative(rate_):
+        discount = (1 + rate_[groups]) ** -years
+        npv_ = np.bincount(groups, weights=amounts * discount, minlength=n_groups)
+        d_npv_ = np.bincount(
+            groups,
+            weights=-years * amounts * discount / (1 + rate_[groups]),
+            minlength=n_groups,
+        )
+        return npv_, d_npv_
+
+    lower = np.full(n_groups, bracket[0])
+    upper = np.full(n_groups, bracket[1])
+    npv_lower, _ = npv_and_derivative(lower)
+    npv_upper, _ = npv_and_derivative(upper)
+    # Groups with no sign change in the bracket have no rate of return to find
+    is_solvable = np.sign(npv_lower) * np.sign(npv_upper) < 0
+    rate = np.full(n_groups, 0.05)
+    for _ in range(max_iter):
+        npv, d_npv = npv_and_derivative(rate)
+        # Shrink the bracket around the root
+        is_same_side = np.sign(npv) == np.sign(npv_lower)
+        lower = np.where(is_same_side, rate, lower)
+        npv_lower = np.where(is_same_side, npv, npv_lower)
+        upper = np.where(is_same_side, upper, rate)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            newton = rate - npv / d_npv
+        is_inside = (newton > lower) & (newton < upper) & np.isfinite(newton)
+        new_rate = np.where(is_inside, newton, (lower + upper) / 2)
+        is_converged = np.abs(new_rate - rate) < tol
+        rate = new_rate
+        if np.all(is_converged | ~is_solvable):
+            break
+    return np.where(is_solvable, rate, np.nan)
+
+
+@cache_data()
+def get_money_weighted_returns(
+    df_transactions: pd.DataFrame,
+    df_last_closing: pd.DataFrame,
+    consider_fees: bool = False,
+) -> pd.Series:
+    """Annualised money-weighted return (XIRR) of each ticker and of the portfolio.
+
+    Purchases are outflows and sales inflows at the transaction price; the current
+    value of each position is a final inflow at its last closing date.
+    """
+    df_flows = df_transactions[["ticker_yf", "transaction_date"]].copy()
+    df_flows["amount"] = -df_transactions["shares"] * df_transactions["price"]
+    if consider_fees:
+        df_flows["amount"] -= df_transactions["fees"].fillna(0)
+    df_final = (
+        df_transactions.groupby("ticker_yf", observed=True)["shares"]
+        .sum()
+        .reset_index()
+        .merge(df_last_closing, how="inner", on="ticker_yf")
+    )
+    df_final["transaction_date"] = pd.to_datetime(df_final["last_closing_date"])
+    df_final["amount"] = (df_final["shares"] * df_final["price"]).astype(float)
+    df_flows = pd.concat(
+        [df_flows, df_final[["ticker_yf", "transaction_date", "amount"]]],
+        ignore_index=True,
+    )
+    df_flows = df_flows[df_flows["ticker_yf"].isin(df_final["ticker_yf"])]
+
+    # Every flow enters its ticker's group and, once more, the portfolio's group
+    codes, tickers = pd.factorize(df_flows["ticker_yf"])
+    n_tickers = len(tickers)
+    dates = df_flows["transaction_date"].to_numpy(dtype="datetime64[D]")
+    first_dates = np.full(n_tickers, dates.max())
+    np.minimum.at(first_dates, codes, dates)
+    years = np.concatenate(
+        [
+            (dates - first_dates[codes]).astype(float) / 365.25,
+            (dates - dates.min()).astype(float) / 365.25,
+        ]
+    )
+    amounts = np.tile(df_flows["amount"].to_numpy(dtype=float), 2)
+    groups = np.concatenate([codes, np.full(len(codes), n_tickers)])
+    xirr = _solve_xirr(amounts, years, groups, n_groups=n_tickers + 1)
+    return pd.Series(xirr, index=list(tickers) + ["Portfolio"], name="xirr")
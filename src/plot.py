@@ -8,8 +8,10 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 
 from var import PLT_FONT_SIZE
+from perf import traced
 
 
+@traced
 def plot_sunburst(df: pd.DataFrame) -> go.Figure:
     fig = px.sunburst(
         data_frame=df.assign(hole=" "),
@@ -26,6 +28,7 @@ def plot_sunburst(df: pd.DataFrame) -> go.Figure:
     return fig
 
 
+@traced
 def plot_pnl_by_asset_class(
     df_pnl: pd.DataFrame,
     group_by: Literal["asset_class", "macro_asset_class"],
@@ -53,6 +56,7 @@ def plot_pnl_by_asset_class(
     return fig
 
 
+@traced
 def plot_wealth(df: pd.DataFrame) -> go.Figure:
     fig = px.area(
         data_frame=df, x=df.index, y="ap_daily_value", custom_data=["diff_previous_day"]
@@ -90,6 +94,7 @@ def plot_wealth(df: pd.DataFrame) -> go.Figure:
     return fig
 
 
+@traced
 def plot_correlation_map(
     df: pd.DataFrame,
     enhance_correlation: Literal["positive", "null", "negative"],
@@ -127,6 +132,7 @@ def plot_correlation_map(
     return fig
 
 
+@traced
 def plot_returns(
     df: pd.DataFrame, annotation_text: str = "", min_resolution: float = 0.005
 ) -> go.Figure:
@@ -159,6 +165,7 @@ def plot_returns(
     return fig
 
 
+@traced
 def plot_rolling_returns(df_roll_ret: pd.DataFrame, window: int) -> go.Figure:
     fig = px.area(df_roll_ret.replace(0, np.nan).dropna())
     fig.update_traces(
@@ -187,6 +194,70 @@ def plot_rolling_returns(df_roll_ret: pd.DataFrame, window: int) -> go.Figure:
     return fig
 
 
+@traced
+def plot_rolling_returns_surface(
+    df_surface: pd.DataFrame, max_dates: int = 1_000
+) -> go.Figure:
+    # Dates are thinned out so that the heatmap payload stays bounded
+    df_surface = df_surface.iloc[:, :: max(1, df_surface.shape[1] // max_dates)]
+    max_abs = np.nanmax(np.abs(df_surface.to_numpy()))
+    fig = go.Figure(
+        go.Heatmap(
+            z=df_surface,
+            x=df_surface.columns,
+            y=df_surface.index,
+            colorscale="RdYlGn",
+            zmid=0,
+            zmin=-max_abs,
+            zmax=max_abs,
+            colorbar=dict(tickformat=".0%"),
+        )
+    )
+    fig.update_traces(
+        hovertemplate="%{y}-trading-day return to %{x}: <b>%{z:.1%}</b><extra></extra>"
+    )
+    fig.update_layout(
+        autosize=False,
+        height=600,
+        margin=dict(l=0, r=0, t=20, b=0),
+        yaxis=dict(title="Rolling window (trading days)", showgrid=False),
+        xaxis=dict(title="", showgrid=False),
+        hoverlabel_font_size=PLT_FONT_SIZE,
+    )
+    return fig
+
+
+@traced
+def plot_worst_rolling_returns(df_worst: pd.DataFrame) -> go.Figure:
+    fig = go.Figure(
+        go.Scatter(
+            x=df_worst.index,
+            y=df_worst["worst_return"],
+            customdata=np.stack(
+                [
+                    df_worst["start"].dt.strftime("%Y-%m-%d"),
+                    df_worst["end"].dt.strftime("%Y-%m-%d"),
+                ],
+                axis=-1,
+            ),
+            mode="lines",
+            fill="tozeroy",
+            line=dict(color="firebrick"),
+            hovertemplate="%{x} trading days: <b>%{y:.1%}</b><br>from %{customdata[0]} to %{customdata[1]}<extra></extra>",
+        )
+    )
+    fig.update_layout(
+        autosize=False,
+        height=400,
+        margin=dict(l=0, r=0, t=20, b=0),
+        yaxis=dict(title="Worst return", showgrid=False, tickformat=".0%"),
+        xaxis=dict(title="Rolling window (trading days)", showgrid=False),
+        hoverlabel_font_size=PLT_FONT_SIZE,
+    )
+    return fig
+
+
+@traced
 def plot_drawdown(df: pd.DataFrame) -> go.Figure:
     fig = px.area(data_frame=df.dropna())
     fig.update_traces(
@@ -206,6 +277,7 @@ def plot_drawdown(df: pd.DataFrame) -> go.Figure:
     return fig
 
 
+@traced
 def plot_horizontal_bar(
     df: pd.DataFrame, field_to_plot: str, xaxis_title: str = ""
 ) -> go.Figure:
@@ -239,6 +311,7 @@ def plot_horizontal_bar(
     return fig
 
 
+@traced
 def plot_sector_allocation(df_sector: pd.DataFrame, df_pivot: pd.DataFrame) -> go.Figure:
     # Convert percentages in df_sector to numeric values
     df_sector = df_sector.set_index('ticker_yf').applymap(lambda x: float(x.strip('%')) / 100)
@@ -278,6 +351,7 @@ def plot_sector_allocation(df_sector: pd.DataFrame, df_pivot: pd.DataFrame) -> g
     )
     return fig
 
+@traced
 def plot_risk_metrics_over_time(df: pd.DataFrame):
     # plot a line chart with the risk metrics over time
     fig = px.line(df, x=df.index, y=df.columns)
@@ -292,10 +366,12 @@ def plot_risk_metrics_over_time(df: pd.DataFrame):
     )
     return fig
 
+@traced
 def plot_correlation(rolling_corrs: pd.DataFrame):
     fig, ax = plt.subplots(1,1, figsize=(28,5))
     return sns.heatmap(rolling_corrs.transpose())
 
+@traced
 def plot_projection(years: int, future_wealth: np.ndarray, wealth_without_investment: np.ndarray):
 
     # Plot the results using Plotly
@@ -330,4 +406,115 @@ def plot_projection(years: int, future_wealth: np.ndarray, wealth_without_invest
         legend_title="Portfolio Scenarios"
     )
 
-    return fig
\ No newline at end of file
+    return fig
+
+
+@traced
+def plot_projection_bands(df_bands: pd.DataFrame, future_wealth: np.ndarray):
+    # Percentile bands are paired from the outside in (e.g. p5-p95, p25-p75),
+    # the middle column (if any) is drawn as a line
+    fig = go.Figure()
+    band_cols = df_bands.columns.to_list()
+    for i_ in range(len(band_cols) // 2):
+        lower_, upper_ = band_cols[i_], band_cols[-1 - i_]
+        fig.add_trace(
+            go.Scatter(
+                x=df_bands.index,
+                y=df_bands[upper_],
+                mode="lines",
+                line=dict(width=0),
+                showlegend=False,
+                hoverinfo="skip",
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=df_bands.index,
+                y=df_bands[lower_],
+                mode="lines",
+                line=dict(width=0),
+                fill="tonexty",
+                fillcolor="rgba(34, 139, 34, 0.2)",
+                name=f"{lower_}-{upper_}",
+                hoverinfo="skip",
+            )
+        )
+    if len(band_cols) % 2:
+        median_col = band_cols[len(band_cols) // 2]
+        fig.add_trace(
+            go.Scatter(
+                x=df_bands.index,
+                y=df_bands[median_col],
+                mode="lines",
+                name=f"Simulated {median_col}",
+                line=dict(color="green", width=2),
+                hovertemplate="Month %{x}: <b>%{y:,.0f}€</b>",
+            )
+        )
+    fig.add_trace(
+        go.Scatter(
+            x=df_bands.index,
+            y=future_wealth,
+            mode="lines",
+            name="Deterministic projection",
+            line=dict(color="bisque", dash="dash", width=2),
+            hovertemplate="Month %{x}: <b>%{y:,.0f}€</b>",
+        )
+    )
+    fig.update_layout(
+        xaxis_title="Months",
+        yaxis=dict(title="Portfolio Value (€)", tickformat=",.0f", ticksuffix=" €"),
+        template="plotly",
+        legend_title="Portfolio Scenarios",
+        hoverlabel_font_size=PLT_FONT_SIZE,
+        hovermode="x",
+    )
+    return fig
+
+
+@traced
+def plot_efficient_frontier(
+    df_frontier: pd.DataFrame, df_assets: pd.DataFrame, pf_point: tuple[float, float]
+) -> go.Figure:
+    fig = go.Figure()
+    fig.add_trace(
+        go.Scatter(
+            x=df_frontier["volatility"],
+            y=df_frontier["return"],
+            mode="lines",
+            name="Efficient frontier",
+            line=dict(color="green", width=3),
+            hovertemplate="Volatility: %{x:.1%}<br>Return: <b>%{y:.1%}</b>",
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=df_assets["volatility"],
+            y=df_assets["return"],
+            mode="markers+text",
+            name="Holdings",
+            text=df_assets.index,
+            textposition="top center",
+            marker=dict(color="steelblue", size=9),
+            hovertemplate="<b>%{text}</b><br>Volatility: %{x:.1%}<br>Return: %{y:.1%}",
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=[pf_point[0]],
+            y=[pf_point[1]],
+            mode="markers",
+            name="Your portfolio",
+            marker=dict(color="firebrick", size=16, symbol="star"),
+            hovertemplate="Volatility: %{x:.1%}<br>Return: <b>%{y:.1%}</b>",
+        )
+    )
+    fig.update_layout(
+        autosize=False,
+        height=600,
+        margin=dict(l=0, r=0, t=20, b=0),
+        xaxis=dict(title="Annualised volatility", tickformat=".0%", showgrid=False),
+        yaxis=dict(title="Annualised return", tickformat=".0%", showgrid=False),
+        hoverlabel_font_size=PLT_FONT_SIZE,
+    )
+    return fig
@@ -0,0 +1,443 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from typing import Callable, Tuple
+import math
+
+import pandas as pd
+import numpy as np
+
+from var import INVESTMENT_INCREASE_INTERVAL_YEARS
+from cache import cache_data
+from panel import get_available_average
+from performance import get_flow_adjusted_daily_returns
+
+
+def get_contribution_schedule(
+    monthly_investment: float,
+    increase_investment: float,
+    months: int,
+    increase_interval_years: int = INVESTMENT_INCREASE_INTERVAL_YEARS,
+) -> np.ndarray:
+    # The monthly investment is raised by increase_investment at the end of every
+    # increase_interval_years, i.e. month m invests (1 + increase)^(m // interval)
+    n_increases = np.arange(months) // (12 * increase_interval_years)
+    return monthly_investment * (1 + increase_investment) ** n_increases
+
+
+def project_wealth(
+    initial_wealth: float | np.ndarray,
+    monthly_growth: float | np.ndarray,
+    contributions: np.ndarray,
+) -> np.ndarray:
+    # Closed form of the recurrence W_m = W_(m-1) * g + c_m, with W_(-1) = W_0:
+    # W_m = g^(m+1) * (W_0 + sum_(k<=m) c_k / g^(k+1)).
+    # Leading axes of monthly_growth and contributions broadcast against each other,
+    # the last axis of contributions is the month
+    months = contributions.shape[-1]
+    growth = np.asarray(monthly_growth, dtype=float)[..., np.newaxis]
+    compounding = growth ** np.arange(1, months + 1)
+    return compounding * (
+        np.asarray(initial_wealth, dtype=float)[..., np.newaxis]
+        + np.cumsum(contributions / compounding, axis=-1)
+    )
+
+
+def simulate_future_growth(
+    initial_wealth: float,
+    annualised_return: float,
+    inflation: float,
+    monthly_investment: float,
+    years: int,
+    increase_investment: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    months = years * 12
+    contributions = get_contribution_schedule(
+        monthly_investment=monthly_investment,
+        increase_investment=increase_investment,
+        months=months,
+    )
+    # Wealth with investment grows at the annualised return adjusted for inflation
+    future_wealth = project_wealth(
+        initial_wealth=initial_wealth,
+        monthly_growth=1 + (annualised_return - inflation) / 12,
+        contributions=contributions,
+    )
+    # Wealth without investment is only eroded by inflation
+    wealth_without_investment = project_wealth(
+        initial_wealth=initial_wealth,
+        monthly_growth=1 - inflation / 12,
+        contributions=contributions,
+    )
+    return future_wealth, wealth_without_investment
+
+
+def simulate_future_growth_grid(
+    initial_wealth: float,
+    annualised_returns: list[float] | np.ndarray,
+    inflations: list[float] | np.ndarray,
+    monthly_investments: list[float] | np.ndarray,
+    years: int,
+    increase_investment: float,
+) -> np.ndarray:
+    """Wealth paths for every (return, inflation, monthly investment) scenario,
+    shaped (n_returns, n_inflations, n_investments, months)."""
+    annualised_returns = np.asarray(annualised_returns, dtype=float)[:, None, None]
+    inflations = np.asarray(inflations, dtype=float)[None, :, None]
+    monthly_investments = np.asarray(monthly_investments, dtype=float)[None, None, :]
+    # The schedule is linear in the monthly investment, so it is computed once
+    schedule = get_contribution_schedule(
+        monthly_investment=1.0,
+        increase_investment=increase_investment,
+        months=years * 12,
+    )
+    return project_wealth(
+        initial_wealth=initial_wealth,
+        monthly_growth=1 + (annualised_returns - inflations) / 12,
+        contributions=monthly_investments[..., np.newaxis] * schedule,
+    )
+
+
+def get_final_wealth_sensitivity(
+    initial_wealth: float,
+    annualised_returns: list[float],
+    inflation: float,
+    monthly_investments: list[float],
+    years: int,
+    increase_investment: float,
+) -> np.ndarray:
+    # Final wealth with investment, shaped (n_returns, n_investments)
+    return simulate_future_growth_grid(
+        initial_wealth=initial_wealth,
+        annualised_returns=annualised_returns,
+        inflations=[inflation],
+        monthly_investments=monthly_investments,
+        years=years,
+        increase_investment=increase_investment,
+    )[:, 0, :, -1]
+
+
+def get_final_wealth(
+    initial_wealth: float,
+    annualised_return: float,
+    inflation: float,
+    monthly_investment: float,
+    months: int,
+    increase_investment: float,
+    increase_interval_years: int = INVESTMENT_INCREASE_INTERVAL_YEARS,
+) -> float:
+    # Closed form of simulate_future_growth's last value: each block of constant
+    # monthly investment contributes a geometric series, compounded up to the end
+    growth_rate = (annualised_return - inflation) / 12
+    interval_months = 12 * increase_interval_years
+    final_wealth = initial_wealth * (1 + growth_rate) ** months
+    for block_ in range(-(-months // interval_months)):
+        block_start = block_ * interval_months
+        block_end = min(block_start + interval_months, months)
+        n_months = block_end - block_start
+        if growth_rate == 0:
+            annuity = n_months
+        else:
+            annuity = math.expm1(n_months * math.log1p(growth_rate)) / growth_rate
+        final_wealth += (
+            monthly_investment
+            * (1 + increase_investment) ** block_
+            * annuity
+            * (1 + growth_rate) ** (months - block_end)
+        )
+    return final_wealth
+
+
+def _find_root_bracketed(
+    func: Callable[[float], float],
+    lower: float,
+    upper: float,
+    xtol: float = 1e-10,
+    max_iter: int = 100,
+) -> float:
+    # Illinois variant of regula falsi: keeps the root bracketed like bisection,
+    # but converges superlinearly on smooth monotone functions
+    f_lower, f_upper = func(lower), func(upper)
+    if f_lower == 0:
+        return lower
+    if f_upper == 0:
+        return upper
+    if f_lower * f_upper > 0:
+        return np.nan
+    side = 0
+    for _ in range(max_iter):
+        x = (lower * f_upper - upper * f_lower) / (f_upper - f_lower)
+        f_x = func(x)
+        if f_x == 0 or upper - lower < xtol:
+            return x
+        if f_x * f_upper > 0:
+            upper, f_upper = x, f_x
+            if side == -1:
+                f_lower /= 2
+            side = -1
+        else:
+            lower, f_lower = x, f_x
+            if side == 1:
+                f_upper /= 2
+            side = 1
+    return x
+
+
+def get_required_monthly_investment(
+    target_wealth: float,
+    initial_wealth: float,
+    annualised_return: float,
+    inflation: float,
+    years: int,
+    increase_investment: float,
+) -> float:
+    # Final wealth is linear in the monthly investment, so it is solved exactly
+    kwargs = dict(
+        annualised_return=annualised_return,
+        inflation=inflation,
+        months=years * 12,
+        increase_investment=increase_investment,
+    )
+    wealth_without_contributions = get_final_wealth(
+        initial_wealth=initial_wealth, monthly_investment=0, **kwargs
+    )
+    wealth_per_unit_investment = get_final_wealth(
+        initial_wealth=0, monthly_investment=1, **kwargs
+    )
+    return max(
+        0.0, (target_wealth - wealth_without_contributions) / wealth_per_unit_investment
+    )
+
+
+def get_required_years(
+    target_wealth: float,
+    initial_wealth: float,
+    annualised_return: float,
+    inflation: float,
+    monthly_investment: float,
+    increase_investment: float,
+    max_years: int = 100,
+) -> float:
+    # The whole path is evaluated at once, so that the first month above the target
+    # is found even when wealth is not monotone (e.g. negative real returns)
+    future_wealth, _ = simulate_future_growth(
+        initial_wealth=initial_wealth,
+        annualised_return=annualised_return,
+        inflation=inflation,
+        monthly_investment=monthly_investment,
+        years=max_years,
+        increase_investment=increase_investment,
+    )
+    if initial_wealth >= target_wealth:
+        return 0.0
+    is_reached = future_wealth >= target_wealth
+    if not is_reached.any():
+        return np.nan
+    return (np.argmax(is_reached) + 1) / 12
+
+
+def get_required_return(
+    target_wealth: float,
+    initial_wealth: float,
+    inflation: float,
+    monthly_investment: float,
+    years: int,
+    increase_investment: float,
+    bracket: Tuple[float, float] = (-0.5, 1.0),
+) -> float:
+    # Final wealth increases with the return, so the root is searched within bracket
+    return _find_root_bracketed(
+        lambda annualised_return: get_final_wealth(
+            initial_wealth=initial_wealth,
+            annualised_return=annualised_return,
+            inflation=inflation,
+            monthly_investment=monthly_investment,
+            months=years * 12,
+            increase_investment=increase_investment,
+        )
+        - target_wealth,
+        *bracket,
+    )
+
+
+def get_flow_adjusted_monthly_returns(df_wealth: pd.DataFrame) -> np.ndarray:
+    # Flow-adjusted daily portfolio returns, compounded to calendar months. The first
+    # month (from the first purchase) and the last one, unless it is over, are only
+    # partly covered: they are left out, not to be resampled as whole months
+    daily_rets = get_flow_adjusted_daily_returns(df_wealth)
+    if daily_rets.empty:
+        return np.empty(0)
+    monthly_rets = daily_rets.add(1).resample("M").prod(min_count=1).sub(1)
+    last_date = daily_rets.index[-1]
+    is_last_month_over = last_date >= last_date + pd.offsets.BMonthEnd(0)
+    monthly_rets = monthly_rets.iloc[1 : None if is_last_month_over else -1]
+    return monthly_rets.dropna().to_numpy()
+
+
+def get_allocation_monthly_returns(
+    df_monthly_rets: pd.DataFrame, weights: pd.Series
+) -> np.ndarray:
+    # Monthly returns of a portfolio rebalanced to constant weights, rescaled each
+    # month over the tickers already listed
+    weights = weights.reindex(df_monthly_rets.columns).fillna(0)
+    pf_rets = get_available_average(
+        df_monthly_rets.to_numpy(dtype=float), weights.to_numpy(dtype=float)
+    )
+    return pf_rets[~np.isnan(pf_rets)]
+
+
+def _simulate_bootstrap_paths(
+    n_paths: int,
+    seed: np.random.SeedSequence,
+    monthly_returns: np.ndarray,
+    block_size: int,
+    initial_wealth: float,
+    contributions: np.ndarray,
+    inflation: float,
+) -> np.ndarray:
+    # Circular block bootstrap: each path glues together blocks of consecutive
+    # historical months, so that short-term autocorrelation is preserved
+    rng = np.random.default_rng(seed)
+    months = contributions.shape[-1]
+    n_blocks = -(-months // block_size)
+    starts = rng.integers(0, monthly_returns.shape[0], size=(n_paths, n_blocks))
+    idx = (starts[:, :, np.newaxis] + np.arange(block_size)) % monthly_returns.shape[0]
+    growth = 1 + monthly_returns[idx.reshape(n_paths, -1)[:, :months]] - inflation / 12
+    # Path-dependent version of project_wealth: g^(m+1) becomes a cumulative product
+    compounding = np.cumprod(growth, axis=1)
+    return compounding * (
+        initial_wealth + np.cumsum(contributions / compounding, axis=1)
+    )
+
+
+def _accumulate_bootstrap_chunk(
+    n_paths: int,
+    seed: np.random.SeedSequence,
+    log_edges: np.ndarray,
+    target_wealth: float,
+    **path_kwargs,
+) -> Tuple[np.ndarray, np.ndarray]:
+    wealth = _simulate_bootstrap_paths(n_paths=n_paths, seed=seed, **path_kwargs)
+    n_reached = (wealth >= target_wealth).sum(axis=0)
+    return _get_wealth_histogram(wealth, log_edges), n_reached
+
+
+def _get_wealth_histogram(wealth: np.ndarray, log_edges: np.ndarray) -> np.ndarray:
+    # Per-month histogram of log-wealth on fixed bins, shaped (months, n_bins); paths
+    # falling outside the edges are counted in the first/last bin
+    months, n_bins = wealth.shape[1], log_edges.shape[0] - 1
+    bin_width = log_edges[1] - log_edges[0]
+    bins = np.floor(
+        (np.log(np.maximum(wealth, np.finfo(float).tiny)) - log_edges[0]) / bin_width
+    )
+    bins = np.clip(bins, 0, n_bins - 1).astype(np.int64)
+    flat_bins = np.arange(months) * n_bins + bins
+    return np.bincount(flat_bins.ravel(), minlength=months * n_bins).reshape(
+        months, n_bins
+    )
+
+
+def _get_histogram_percentiles(
+    histogram: np.ndarray, log_edges: np.ndarray, percentiles: tuple[float, ...]
+) -> np.ndarray:
+    # Percentiles per month, linearly interpolated in log-space within the bin
+    cum_counts = np.cumsum(histogram, axis=1)
+    n_paths = cum_counts[:, -1:]
+    bin_width = log_edges[1] - log_edges[0]
+    months = np.arange(histogram.shape[0])
+    out = np.empty((histogram.shape[0], len(percentiles)))
+    for j, percentile_ in enumerate(percentiles):
+        rank = n_paths[:, 0] * percentile_ / 100
+        bins = np.argmax(cum_counts >= rank[:, np.newaxis], axis=1)
+        below = np.where(bins > 0, cum_counts[months, bins - 1], 0)
+        inside = histogram[months, bins]
+        fraction = np.where(inside > 0, (rank - below) / np.maximum(inside, 1), 0.5)
+        out[:, j] = np.exp(log_edges[bins] + fraction * bin_width)
+    return out
+
+
+@cache_data()
+def simulate_bootstrap_growth(
+    monthly_returns: np.ndarray,
+    initial_wealth: float,
+    inflation: float,
+    monthly_investment: float,
+    years: int,
+    increase_investment: float,
+    target_wealth: float,
+    n_paths: int = 10_000,
+    block_size: int = 12,
+    percentiles: tuple[float, ...] = (5, 25, 50, 75, 95),
+    chunk_size: int = 1_000,
+    n_bins: int = 2_000,
+    seed: int = 42,
+    n_workers: int = 1,
+) -> Tuple[pd.DataFrame, pd.Series]:
+    """Monte Carlo projection block-bootstrapped from historical monthly returns.
+
+    Paths are simulated in seeded chunks (optionally over a process pool) and only
+    per-month histograms are kept, so memory does not grow with n_paths. Returns
+    the percentile bands and the probability of reaching target_wealth, by month;
+    ValueError if there is no monthly return to resample.
+    """
+    monthly_returns = np.asarray(monthly_returns, dtype=float)
+    if monthly_returns.size == 0:
+        raise ValueError(
+            "There is no complete month of returns to resample yet: the Monte Carlo "
+            "projection needs a longer history"
+        )
+    contributions = get_contribution_schedule(
+        monthly_investment=monthly_investment,
+        increase_investment=increase_investment,
+        months=years * 12,
+    )
+    chunk_sizes = [chunk_size] * (n_paths // chunk_size)
+    if n_paths % chunk_size:
+        chunk_sizes.append(n_paths % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    chunk_kwargs = dict(
+        monthly_returns=monthly_returns,
+        block_size=block_size,
+        initial_wealth=initial_wealth,
+        contributions=contributions,
+        inflation=inflation,
+    )
+
+    # The first chunk sets the range of the histogram bins, with a wide margin
+    first_chunk = _simulate_bootstrap_paths(
+        n_paths=chunk_sizes[0], seed=seeds[0], **chunk_kwargs
+    )
+    positive_wealth = first_chunk[first_chunk > 0]
+    log_lo = np.log(positive_wealth.min() / 10) if positive_wealth.size else 0.0
+    log_hi = np.log(positive_wealth.max() * 10) if positive_wealth.size else 1.0
+    log_edges = np.linspace(log_lo, log_hi, n_bins + 1)
+    histogram = _get_wealth_histogram(first_chunk, log_edges)
+    n_reached = (first_chunk >= target_wealth).sum(axis=0)
+    del first_chunk
+
+    # Remaining chunks only return their histograms, which are summed up as soon as
+    # they are yielded, so that at most one chunk of paths per worker is in memory
+    accumulate_chunk = partial(
+        _accumulate_bootstrap_chunk,
+        log_edges=log_edges,
+        target_wealth=target_wealth,
+        **chunk_kwargs,
+    )
+    with (
+        ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else nullcontext()
+    ) as executor:
+        map_ = executor.map if executor is not None else map
+        for histogram_, n_reached_ in map_(
+            accumulate_chunk, chunk_sizes[1:], seeds[1:]
+        ):
+            histogram += histogram_
+            n_reached += n_reached_
+
+    months_range = pd.RangeIndex(1, years * 12 + 1, name="month")
+    df_bands = pd.DataFrame(
+        _get_histogram_percentiles(histogram, log_edges, percentiles),
+        index=months_range,
+        columns=[f"p{percentile_:g}" for percentile_ in percentiles],
+    )
+    prob_target = pd.Series(n_reached / n_paths, index=months_range, name="prob_target")
+    return df_bands, prob_target
@@ -0,0 +1,225 @@
+from typing import Literal
+
+import pandas as pd
+import numpy as np
+
+
+def get_risk_budget_weights(
+    covariance: pd.DataFrame,
+    risk_budgets: pd.Series | None = None,
+    tol: float = 1e-10,
+    max_iter: int = 100,
+) -> pd.Series:
+    """Long-only weights whose relative risk contributions match risk_budgets
+    (equal risk contribution if None).
+
+    Solves min 1/2 y'Σy - b'log(y) with a damped Newton method, as in Spinu (2013):
+    at the optimum y_i (Σy)_i = b_i, so w = y / sum(y) has the required budgets.
+    The problem is strictly convex, so each Newton step is a single N x N solve.
+    """
+    sigma = covariance.to_numpy(dtype=float)
+    n_assets = sigma.shape[0]
+    if risk_budgets is None:
+        budgets = np.full(n_assets, 1 / n_assets)
+    else:
+        budgets = risk_budgets.reindex(covariance.index).fillna(0).to_numpy(float)
+        if not budgets.sum() > 0:
+            raise ValueError("The risk budgets must add up to a positive value")
+        budgets = budgets / budgets.sum()
+    # Assets with a null budget get a null weight and are left out of the problem
+    is_active = budgets > 0
+    sigma_act, budgets_act = sigma[np.ix_(is_active, is_active)], budgets[is_active]
+    # A riskless asset (or one with too few returns) can contribute no risk at all
+    if not np.all(np.diag(sigma_act) > 0):
+        raise ValueError(
+            "Every asset with a risk budget needs a positive variance: choose a "
+            "longer time slice"
+        )
+
+    def objective(y_):
+        return 0.5 * y_ @ sigma_act @ y_ - budgets_act @ np.log(y_)
+
+    # Inverse-volatility starting point, scaled so that y'Σy = sum(b) = 1
+    y = budgets_act / np.sqrt(np.diag(sigma_act))
+    y = y / np.sqrt(y @ sigma_act @ y)
+    f_y = objective(y)
+    for _ in range(max_iter):
+        sigma_y = sigma_act @ y
+        if np.max(np.abs(y * sigma_y - budgets_act)) < tol:
+            break
+        gradient = sigma_y - budgets_act / y
+        hessian = sigma_act + np.diag(budgets_act / y**2)
+        try:
+            step = np.linalg.solve(hessian, -gradient)
+        except np.linalg.LinAlgError as e:
+            # y diverges when no positive weights meet the budgets, e.g. with assets
+            # perfectly (anti-)correlated over a few dates
+            raise ValueError(
+                "The risk budgets cannot be met with the covariances of the selected "
+                "time slice: choose a longer slice"
+            ) from e
+        # Backtracking keeps y strictly positive and the objective decreasing
+        step_size = 1.0
+        while np.any(y + step_size * step <= 0):
+            step_size /= 2
+        while step_size > 1e-12:
+            y_new = y + step_size * step
+            f_new = objective(y_new)
+            if f_new <= f_y + 1e-4 * step_size * gradient @ step:
+                break
+            step_size /= 2
+        y, f_y = y_new, f_new
+
+    weights = np.zeros(n_assets)
+    weights[is_active] = y / y.sum()
+    return pd.Series(weights, index=covariance.index, name="target_weight")
+
+
+def get_rebalancing_trades(
+    df_holdings: pd.DataFrame,
+    df_prices: pd.DataFrame,
+    target_weights: pd.Series,
+    df_registry: pd.DataFrame,
+    level: Literal["ticker", "asset_class", "macro_asset_class"],
+) -> pd.DataFrame:
+    # Current positions, valued at the last available price
+    df_trades = df_holdings.set_index("ticker_yf")[["shares"]].join(
+        df_prices.ffill().iloc[-1].rename("price"), how="inner"
+    )
+    df_trades["current_value"] = df_trades["shares"] * df_trades["price"]
+    pf_value = df_trades["current_value"].sum()
+    if level == "ticker":
+        df_trades["target_value"] = (
+            target_weights.reindex(df_trades.index).fillna(0) * pf_value
+        )
+    else:
+        # The target value of a class is split among its tickers pro rata to their
+        # current value (or evenly, if the class is empty)
+        df_trades[level] = df_registry.drop_duplicates("ticker_yf").set_index(
+            "ticker_yf"
+        )[level]
+        class_value = df_trades.groupby(level)["current_value"].transform("sum")
+        class_size = df_trades.groupby(level)["current_value"].transform("size")
+        share_of_class = np.where(
+            class_value > 0,
+            df_trades["current_value"] / class_value.where(class_value > 0, 1),
+            1 / class_size,
+        )
+        df_trades["target_value"] = (
+            df_trades[level].map(target_weights).fillna(0) * pf_value * share_of_class
+        )
+    df_trades["trade_value"] = df_trades["target_value"] - df_trades["current_value"]
+    df_trades["trade_shares"] = df_trades["trade_value"] / df_trades["price"]
+    return df_trades.rename_axis("ticker_yf").reset_index()
+
+
+def get_trade_fee(df_transactions: pd.DataFrame) -> float:
+    # Typical fee per trade, i.e. the median of the non-null fees in the ledger
+    fees = df_transactions["fees"][df_transactions["fees"].gt(0)]
+    return float(fees.median()) if not fees.empty else 0.0
+
+
+def plan_integer_trades(
+    df_pivot: pd.DataFrame,
+    df_last_closing: pd.DataFrame,
+    target_weights: pd.Series,
+    level: Literal["ticker_yf", "asset_class", "macro_asset_class"],
+    cash: float,
+    fee_per_trade: float = 0.0,
+    allow_sell: bool = False,
+) -> tuple[pd.DataFrame, pd.DataFrame, float]:
+    """Whole-share orders that bring the weights of the level closest to the targets.
+
+    Each group of the level is traded through its largest position. Orders are
+    chosen greedily by the reduction of the absolute drift (in €) net of the fee of
+    opening a new order; consecutive shares of the same ticker are bought in bulk
+    until its drift falls below the runner-up's, so the number of steps grows with
+    the number of groups rather than with the number of shares.
+    Returns the orders, the allocation by group before and after, and the cash left.
+    """
+    df_pos = df_pivot.merge(
+        df_last_closing[["ticker_yf", "price"]], how="left", on="ticker_yf"
+    ).assign(group=lambda df_: df_[level])
+    df_pos["price"] = df_pos["price"].astype(float)
+    df_groups = (
+        df_pos.sort_values("position_value", ascending=False)
+        .groupby("group")
+        .agg(
+            ticker_yf=("ticker_yf", "first"),
+            price=("price", "first"),
+            vehicle_value=("position_value", "first"),
+            value=("position_value", "sum"),
+        )
+    )
+    df_groups["target_weight"] = target_weights.reindex(df_groups.index).fillna(0)
+    total_weight = df_groups["target_weight"].sum()
+    if not total_weight > 0:
+        raise ValueError("The target weights must add up to a positive value")
+    df_groups["target_weight"] /= total_weight
+
+    price = df_groups["price"].to_numpy()
+    value = df_groups["value"].to_numpy(dtype=float, copy=True)
+    held = df_groups["vehicle_value"].to_numpy(dtype=float) / price
+    target = df_groups["target_weight"].to_numpy() * (value.sum() + cash)
+    quantity = np.zeros(len(df_groups), dtype=np.int64)
+    cash_left = cash
+
+    def next_order(drift: np.ndarray, max_shares: np.ndarray) -> tuple[int, int]:
+        # Drift reduction of one more share, net of the fee of a new order
+        gain = np.where(drift >= price, price, 2 * drift - price)
+        gain = gain - np.where(quantity == 0, fee_per_trade, 0)
+        gain[max_shares < 1] = -np.inf
+        best = int(np.argmax(gain))
+        if gain[best] <= 0:
+            return best, 0
+        runner_up = np.max(np.delete(drift, best), initial=0)
+        n_shares = max(1, int((drift[best] - max(runner_up, 0)) // price[best]))
+        if drift[best] >= price[best]:
+            n_shares = min(n_shares, int(drift[best] // price[best]))
+        return best, int(min(n_shares, max_shares[best]))
+
+    if allow_sell:
+        while True:
+            group_, n_shares = next_order(
+                drift=value - target, max_shares=np.floor(held + quantity)
+            )
+            if n_shares == 0:
+                break
+            cash_left -= fee_per_trade * (quantity[group_] == 0)
+            quantity[group_] -= n_shares
+            value[group_] -= n_shares * price[group_]
+            cash_left += n_shares * price[group_]
+    while True:
+        is_new = quantity == 0
+        group_, n_shares = next_order(
+            drift=np.where(quantity >= 0, target - value, -np.inf),
+            max_shares=np.floor((cash_left - fee_per_trade * is_new) / price),
+        )
+        if n_shares == 0:
+            break
+        cash_left -= fee_per_trade * is_new[group_] + n_shares * price[group_]
+        quantity[group_] += n_shares
+        value[group_] += n_shares * price[group_]
+
+    df_groups["quantity"] = quantity
+    df_orders = df_groups[df_groups["quantity"].ne(0)].reset_index()
+    df_orders["order"] = np.where(df_orders["quantity"].gt(0), "Buy", "Sell")
+    df_orders["quantity"] = df_orders["quantity"].abs()
+    df_orders["amount"] = df_orders["quantity"] * df_orders["price"]
+    df_orders["fees"] = fee_per_trade
+    if level == "ticker_yf":
+        df_orders = df_orders.drop(columns="group")
+    else:
+        df_orders = df_orders.rename(columns={"group": level})
+    df_orders = df_orders[
+        list(dict.fromkeys(["ticker_yf", level]))
+        + ["order", "quantity", "price", "amount", "fees"]
+    ]
+    df_allocation = pd.DataFrame(
+        {
+            "current_weight": df_groups["value"] / df_groups["value"].sum(),
+            "target_weight": df_groups["target_weight"],
+            "weight_after": value / value.sum(),
+        }
+    ).rename_axis(level)
+    return df_orders, df_allocation, cash_left
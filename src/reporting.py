@@ -0,0 +1,26 @@
+"""Errors of the analytics meant for the user, e.g. a ticker with no data.
+
+The analytics report them with report_error, which logs them by default (notebooks,
+scripts, worker processes); the app plugs its own reporter, showing them in the page
+(see ui.py).
+"""
+import logging
+from typing import Callable
+
+logger = logging.getLogger("pfn")
+
+
+def log_error(message: str) -> None:
+    logger.error(message)
+
+
+_reporter = log_error
+
+
+def set_error_reporter(reporter: Callable[[str], None]) -> None:
+    global _reporter
+    _reporter = reporter
+
+
+def report_error(message: str) -> None:
+    _reporter(message)
@@ -1,15 +1,13 @@
 from typing import Literal
 import itertools as it
 
-import streamlit as st
 import pandas as pd
 import numpy as np
 
+from cache import cache_data
 
-from var import CACHE_EXPIRE_SECONDS
 
-
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def get_period_returns(
     df: pd.DataFrame,
     df_registry: pd.DataFrame,
@@ -19,8 +17,8 @@ def get_period_returns(
 ):
     # Filtra solo i ticker effettivamente in portafoglio
     df_registry = df_registry[df_registry["ticker_yf"].isin(tickers_to_evaluate)]
-    # Calcolo il ritorno
-    df_rets = df.pct_change()[1:]
+    # Calcolo il ritorno (NaN prima della quotazione del ticker)
+    df_rets = df.pct_change(fill_method=None)[1:]
     # Se il periodo è None, la frequenza è giornaliera
     if period is None:
         # Se il livello è quello del ticker, non devo fare altro
@@ -34,11 +32,14 @@ def get_period_returns(
                 cols_to_sum = df_registry[df_registry[level].eq(class_)][
                     "ticker_yf"
                 ].to_list()
-                df_rets_classes[class_] = df_rets[cols_to_sum].sum(axis=1)
+                df_rets_classes[class_] = df_rets[cols_to_sum].sum(axis=1, min_count=1)
             return df_rets_classes
     # Se il periodo non è None, faccio resampling al periodo desiderato
     else:
-        df_rets_resampled = df_rets.resample(period).agg(lambda x: (x + 1).prod() - 1)
+        # Rendimento composto del periodo, NaN se il ticker non era quotato
+        df_rets_resampled = np.expm1(
+            np.log1p(df_rets).resample(period).sum(min_count=1)
+        )
         if level == "ticker":
             return df_rets_resampled
         else:
@@ -49,10 +50,34 @@ def get_period_returns(
                     "ticker_yf"
                 ].to_list()
 
-                df_rets_classes[class_] = df_rets_resampled[cols_to_sum].sum(axis=1)
+                df_rets_classes[class_] = df_rets_resampled[cols_to_sum].sum(
+                    axis=1, min_count=1
+                )
             return df_rets_classes
 
 
+@cache_data()
+def get_cumulative_log_returns(df_prices: pd.DataFrame) -> pd.DataFrame:
+    # Prefix sums of the log-returns, i.e. log(P_t) - log(P_0): the log-return over
+    # any window is the difference between two of its rows
+    return np.log(df_prices).sub(np.log(df_prices.bfill().iloc[0]))
+
+
+def _get_level_tickers(
+    df_registry: pd.DataFrame,
+    tickers_to_evaluate: list[str],
+    level: Literal["ticker", "asset_class", "macro_asset_class"],
+) -> dict[str, list[str]]:
+    # Tickers making up each column of the level
+    if level == "ticker":
+        return {ticker_: [ticker_] for ticker_ in tickers_to_evaluate}
+    df_registry = df_registry[df_registry["ticker_yf"].isin(tickers_to_evaluate)]
+    return {
+        class_: df_registry[df_registry[level].eq(class_)]["ticker_yf"].to_list()
+        for class_ in df_registry[level].unique()
+    }
+
+
 def get_rolling_returns(
     df_prices: pd.DataFrame,
     df_registry: pd.DataFrame,
@@ -60,32 +85,86 @@ def get_rolling_returns(
     window: int,
     level: Literal["ticker", "asset_class", "macro_asset_class"],
 ) -> pd.DataFrame:
-    # Filtra solo i ticker effettivamente in portafoglio
-    df_registry = df_registry[df_registry["ticker_yf"].isin(tickers_to_evaluate)]
-
-    df_log_ret = np.log(df_prices.div(df_prices.shift(1)))
-    df_roll_log_ret = df_log_ret.rolling(window=window).sum()
-    df_roll_ret = np.exp(df_roll_log_ret) - 1
+    df_cum_log_ret = get_cumulative_log_returns(df_prices)
+    df_roll_ret = np.expm1(df_cum_log_ret - df_cum_log_ret.shift(window))
 
     # Se il livello è quello del ticker, non devo fare altro
     if level == "ticker":
         return df_roll_ret
     # Altrimenti aggrego al livello richiesto
     else:
-        classes = df_registry[level].unique()
-        df_roll_ret_classes = pd.DataFrame(columns=classes)
-        for class_ in classes:
-            cols_to_sum = df_registry[df_registry[level].eq(class_)][
-                "ticker_yf"
-            ].to_list()
+        return pd.DataFrame(
+            {
+                class_: df_roll_ret[cols_to_sum].sum(axis=1, min_count=1)
+                for class_, cols_to_sum in _get_level_tickers(
+                    df_registry, tickers_to_evaluate, level
+                ).items()
+            }
+        )
+
+
+@cache_data()
+def get_rolling_returns_surface(
+    df_prices: pd.DataFrame,
+    df_registry: pd.DataFrame,
+    tickers_to_evaluate: list[str],
+    windows: tuple[int],
+    level: Literal["ticker", "asset_class", "macro_asset_class"],
+    column: str,
+) -> pd.DataFrame:
+    """Rolling returns of one column of the level for many windows at once.
+
+    Returns a (windows x dates) frame: each row is a gather and a subtraction over
+    the cumulative log-returns, with no rolling sum per window.
+    """
+    cum_log_ret = get_cumulative_log_returns(df_prices)[
+        _get_level_tickers(df_registry, tickers_to_evaluate, level)[column]
+    ].to_numpy()
+    windows_ = np.asarray(windows)
+    positions = np.arange(cum_log_ret.shape[0]) - windows_[:, np.newaxis]
+    is_valid = positions >= 0
+    surface = np.zeros(positions.shape)
+    has_return = np.zeros(positions.shape, dtype=bool)
+    # Class returns are the sum of the returns of their tickers, as elsewhere; a
+    # ticker not listed yet at the start of a window is left out of it
+    for col_ in range(cum_log_ret.shape[1]):
+        values = cum_log_ret[:, col_]
+        window_ret = np.expm1(values - values[np.maximum(positions, 0)])
+        surface += np.nan_to_num(window_ret)
+        has_return |= ~np.isnan(window_ret)
+    surface[~(is_valid & has_return)] = np.nan
+    return pd.DataFrame(
+        surface, index=pd.Index(windows_, name="window"), columns=df_prices.index
+    )
+
 
-            df_roll_ret_classes[class_] = df_roll_ret[cols_to_sum].sum(axis=1)
-        return df_roll_ret_classes
+def get_worst_rolling_returns(df_surface: pd.DataFrame) -> pd.DataFrame:
+    # Worst return over every window length, with the period in which it happened
+    surface = df_surface.to_numpy()
+    has_data = ~np.all(np.isnan(surface), axis=1)
+    end_pos = np.argmin(np.where(np.isnan(surface), np.inf, surface), axis=1)
+    start_pos = np.maximum(end_pos - df_surface.index.to_numpy(), 0)
+    return pd.DataFrame(
+        {
+            "worst_return": np.where(
+                has_data, surface[np.arange(len(surface)), end_pos], np.nan
+            ),
+            "start": df_surface.columns[start_pos].where(has_data),
+            "end": df_surface.columns[end_pos].where(has_data),
+        },
+        index=df_surface.index,
+    )
 
 
 def correlation_analysis(df, lookback_window):
     etfs_pairs = list(it.combinations(df.columns, 2))
     correlation = pd.DataFrame()
     for pair in etfs_pairs:
-        correlation[str(pair[0])+' <--> '+str(pair[1])] = df[list(pair)].rolling(lookback_window).corr().iloc[0::2,-1].droplevel(1, axis=0)
-    return correlation
\ No newline at end of file
+        correlation[str(pair[0]) + " <--> " + str(pair[1])] = (
+            df[list(pair)]
+            .rolling(lookback_window)
+            .corr()
+            .iloc[0::2, -1]
+            .droplevel(1, axis=0)
+        )
+    return correlation
@@ -1,87 +1,99 @@
+from statistics import NormalDist
 from typing import Literal
 
-import streamlit as st
 import pandas as pd
 import numpy as np
-import yfinance as yf
 
-from var import CACHE_EXPIRE_SECONDS, TRADING_DAYS_YEAR
+from var import (
+    TRADING_DAYS_YEAR,
+    COVARIANCE_EWMA_HALFLIFE,
+    DICT_VAR_HORIZONS,
+)
+from cache import cache_data
+from covariance import get_covariance_matrix
+from panel import get_available_average
+from perf import traced
+from aggregation import get_holdings_history
+from input_output import get_treasury_bill_rate
 
 import pandas as pd
 import numpy as np
 
 # 1. Sharpe Ratio
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def sharpe_ratio(returns: pd.Series, risk_free_rate: float = 3, trading_days: int = 252) -> float:
     mean_return = returns.mean() * trading_days
     std_dev = returns.std() * np.sqrt(trading_days)
     return (mean_return - risk_free_rate) / std_dev if std_dev != 0 else np.nan
 
 # 2. Sortino Ratio
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def sortino_ratio(returns: pd.Series, risk_free_rate: float = 3, trading_days: int = 252) -> float:
     downside = returns[returns < 0].std() * np.sqrt(trading_days)
     mean_return = returns.mean() * trading_days
     return (mean_return - risk_free_rate) / downside if downside != 0 else np.nan
 
 # 3. Calmar Ratio
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def calmar_ratio(returns: pd.Series, trading_days: int = 252) -> float:
     annualized_return = returns.mean() * trading_days
     max_dd = get_max_dd(returns)
     return annualized_return / abs(max_dd) if max_dd != 0 else np.nan
 
 # 4. Max Drawdown
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def get_max_dd(returns: pd.Series) -> float:
     cumulative = (1 + returns).cumprod()
     drawdown = cumulative / cumulative.cummax() - 1
     return drawdown.min()
 
 # 5. Volatility
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def volatility(returns: pd.Series, trading_days: int = 252) -> float:
     return returns.std() * np.sqrt(trading_days)
 
 # 6. Annualized Return
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def annualized_return(returns: pd.Series, trading_days: int = 252) -> float:
     return returns.mean() * trading_days
 
 # 7. Downside Deviation
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def downside_deviation(returns: pd.Series, trading_days: int = 252) -> float:
     downside = returns[returns < 0]
     return downside.std() * np.sqrt(trading_days)
 
 # 8. Pain Index
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def pain_index(returns: pd.Series, trading_days: int = 252) -> float:
     downside = returns[returns < 0]
     return downside.sum() / trading_days
 
 # 9. Value at Risk (VaR)
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def value_at_risk(returns: pd.Series, confidence_level: float = 0.05) -> float:
-    return np.percentile(returns, 100 * confidence_level)
+    return np.nanpercentile(returns, 100 * confidence_level)
 
 # 10. Conditional Value at Risk (CVaR)
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def conditional_value_at_risk(returns: pd.Series, confidence_level: float = 0.05) -> float:
     var = value_at_risk(returns, confidence_level)
     return returns[returns <= var].mean()
 
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@traced
+@cache_data()
 def compute_metrics(
     df_returns: pd.DataFrame, 
-    risk_free_rate: float = yf.Ticker("^IRX").history(period="1y").Close.mean(),
+    risk_free_rate: float | None = None,
     trading_days: int = 252
 ) -> pd.DataFrame:
     metrics = {}
 
+    # The default rate is downloaded when needed, not when the module is imported
+    if risk_free_rate is None:
+        risk_free_rate = get_treasury_bill_rate()
     daily_risk_free_rate = risk_free_rate / 100 / trading_days
 
-    df_returns.to_excel('df_returns.xlsx')
     for col in df_returns.columns:
         returns = df_returns[col]
         metrics[col] = {
@@ -101,7 +113,7 @@ def compute_metrics(
 
 
 # 1. Sharpe Ratio (Rolling)
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def rolling_sharpe_ratio(returns: pd.Series, risk_free_rate: float = 3, trading_days: int = 252, window: int = 21) -> pd.Series:
     """Calculate rolling Sharpe ratio."""
     excess_returns = returns - (risk_free_rate / 100 / trading_days)
@@ -111,7 +123,7 @@ def rolling_sharpe_ratio(returns: pd.Series, risk_free_rate: float = 3, trading_
 
 
 # 2. Sortino Ratio (Rolling)
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def rolling_sortino_ratio(returns: pd.Series, risk_free_rate: float = 3, trading_days: int = 252, window: int = 21) -> pd.Series:
     """Calculate rolling Sortino ratio."""
     downside = returns[returns < 0]
@@ -121,7 +133,7 @@ def rolling_sortino_ratio(returns: pd.Series, risk_free_rate: float = 3, trading
 
 
 # 3. Calmar Ratio (Rolling)
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def rolling_calmar_ratio(returns: pd.Series, trading_days: int = 252, window: int = 21) -> pd.Series:
     """Calculate rolling Calmar ratio."""
     rolling_return = returns.rolling(window).mean() * trading_days
@@ -130,47 +142,47 @@ def rolling_calmar_ratio(returns: pd.Series, trading_days: int = 252, window: in
 
 
 # 4. Max Drawdown (Rolling)
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def rolling_get_max_dd(returns: pd.Series) -> float:
     cumulative = (1 + returns).cumprod()
     drawdown = cumulative / cumulative.cummax() - 1
     return drawdown.min()
 
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def rolling_max_drawdown_rolling(returns: pd.Series, window: int = 21) -> pd.Series:
     """Calculate rolling Max Drawdown."""
     return returns.rolling(window).apply(get_max_dd)
 
 
 # 5. Volatility (Rolling)
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def rolling_volatility(returns: pd.Series, trading_days: int = 252, window: int = 21) -> pd.Series:
     """Calculate rolling volatility."""
     return returns.rolling(window).std() * np.sqrt(trading_days)
 
 
 # 6. Annualized Return (Rolling)
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def rolling_annualized_return(returns: pd.Series, trading_days: int = 252, window: int = 21) -> pd.Series:
     """Calculate rolling annualized return."""
     return returns.rolling(window).mean() * trading_days
 
 
 # 7. Downside Deviation (Rolling)
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def rolling_downside_deviation(returns: pd.Series, trading_days: int = 252, window: int = 21) -> pd.Series:
     """Calculate rolling downside deviation."""
     downside = returns[returns < 0]
     return downside.rolling(window).std() * np.sqrt(trading_days)
 
 # 8. Pain Index (Rolling)
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def rolling_pain_index(returns: pd.Series, trading_days: int = 252, window: int = 21) -> pd.Series:
     """Calculate rolling pain index."""
     downside = returns[returns < 0]
     return downside.rolling(window).sum() / trading_days
 
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def compute_rolling_metrics(
     df_returns: pd.DataFrame, 
     risk_free_rate: float = 3, 
@@ -208,11 +220,10 @@ def compute_rolling_metrics(
     df = pd.DataFrame(reshaped_metrics)
     # Pivot to required format: index as (Asset, Date), columns as Metric, values as Value
     df_pivoted = df.pivot(index=['Asset', 'Date'], columns='Metric', values='Value').reset_index()
-    df_pivoted.to_excel('df_metrics_pivoted.xlsx')
 
     return df_pivoted
 
-@st.cache_data(ttl=CACHE_EXPIRE_SECONDS, show_spinner=False)
+@cache_data()
 def get_drawdown(df: pd.DataFrame) -> pd.DataFrame:
     df = df.fillna(0.0)
     cumulative_rets = (df + 1).cumprod()
@@ -225,70 +236,270 @@ def get_max_dd(df: pd.DataFrame) -> float:
 
 
 def get_portfolio_variance(
-    weights: pd.Series, returns: pd.DataFrame, trading_days=TRADING_DAYS_YEAR
+    weights: pd.Series,
+    returns: pd.DataFrame | None = None,
+    trading_days=TRADING_DAYS_YEAR,
+    covariance: pd.DataFrame | None = None,
 ) -> float:
-    return trading_days * np.dot(weights.T, np.dot(returns.cov(), weights))
+    if covariance is None:
+        covariance = returns.cov()
+    return trading_days * np.dot(weights.T, np.dot(covariance, weights))
 
 
 def get_relative_risk_contributions(
-    weights: pd.Series, returns: pd.DataFrame
+    weights: pd.Series,
+    returns: pd.DataFrame | None = None,
+    covariance: pd.DataFrame | None = None,
 ) -> pd.Series:
-    volatility = np.sqrt(get_portfolio_variance(weights, returns))
-    covariance = returns.cov()
+    if covariance is None:
+        covariance = returns.cov()
+    volatility = np.sqrt(get_portfolio_variance(weights, covariance=covariance))
     marginal_vols = np.dot(covariance, weights) / volatility
     risk_contrib = marginal_vols * weights
     relative_risk_contrib = risk_contrib / risk_contrib.sum()
     return relative_risk_contrib
 
 
-def get_portfolio_relative_risk_contribution(
+def get_log_returns_and_weights(
     df_prices: pd.DataFrame,
     df_shares: pd.DataFrame,
     df_registry: pd.DataFrame,
     level: Literal["ticker", "asset_class", "macro_asset_class"],
+) -> tuple[pd.DataFrame, pd.Series]:
+    # NaN before the listing of a ticker, for the covariance to skip those dates
+    df_log_rets = np.log(df_prices.div(df_prices.shift())).iloc[1:]
+    # Weights from the last price and the shares held
+    df_weights = (
+        df_prices.ffill().tail(1).T.merge(df_shares, left_index=True, right_index=True)
+    )
+    df_weights.columns = ["last_price", "shares"]
+    total_invested = df_weights["last_price"] * df_weights["shares"]
+    # Log-returns and invested amounts are summed up within each class
+    df_rets = sum_by_level(df_log_rets, df_registry=df_registry, level=level)
+    total_invested = sum_by_level(
+        total_invested.to_frame().T, df_registry=df_registry, level=level
+    ).iloc[0]
+    pf_weight = total_invested.div(total_invested.sum()).rename("pf_weight")
+    return df_rets, pf_weight
+
+
+def sum_by_level(
+    df: pd.DataFrame,
+    df_registry: pd.DataFrame,
+    level: Literal["ticker", "asset_class", "macro_asset_class"],
 ) -> pd.DataFrame:
-    df_log_rets = np.log(df_prices.div(df_prices.shift())).fillna(0)
+    # Sum ticker columns up to the columns of the requested level
     if level == "ticker":
-        # Log-returns
-        df_rets = df_log_rets
-        # Weights
-        df_weights = df_prices.tail(1).T.merge(
-            df_shares, left_index=True, right_index=True
-        )
-        df_weights.columns = ["last_price", "shares"]
-        df_weights["total_invested"] = df_weights["last_price"] * df_weights["shares"]
-        df_weights["pf_weight"] = df_weights["total_invested"].div(
-            df_weights["total_invested"].sum()
-        )
-    else:
-        classes = df_registry[level].unique()
-        df_rets = pd.DataFrame(columns=classes)
-        df_weights = pd.DataFrame(columns=["total_invested"])
-        # Log-returns & weights per class
-        for class_ in classes:
-            # Tickers belonging to class_
-            cols_to_sum = df_registry[df_registry[level].eq(class_)][
-                "ticker_yf"
-            ].to_list()
-            # Log-return of class_
-            df_rets[class_] = df_log_rets[cols_to_sum].sum(axis=1)
-            # Weight of class_
-            df_ = (
-                df_prices[cols_to_sum]
-                .tail(1)
-                .T.merge(df_shares.loc[cols_to_sum], left_index=True, right_index=True)
-            )
-            df_.columns = ["last_price", "shares"]
-            df_["total_invested"] = df_["last_price"] * df_["shares"]
-            df_weights.loc[class_] = df_["total_invested"].sum()
-        df_weights["pf_weight"] = df_weights["total_invested"].div(
-            df_weights["total_invested"].sum()
-        )
+        return df
+    ticker_to_class = df_registry.drop_duplicates("ticker_yf").set_index("ticker_yf")[
+        level
+    ]
+    return df.T.groupby(ticker_to_class, sort=False).sum(min_count=1).T
+
+
+def get_portfolio_covariance(
+    df_prices: pd.DataFrame,
+    df_shares: pd.DataFrame,
+    df_registry: pd.DataFrame,
+    level: Literal["ticker", "asset_class", "macro_asset_class"],
+    covariance_method: Literal["sample", "ewma"] = "sample",
+    halflife: float = COVARIANCE_EWMA_HALFLIFE,
+    shrinkage: Literal["ledoit_wolf"] | float | None = None,
+) -> tuple[pd.DataFrame, pd.Series]:
+    df_rets, pf_weight = get_log_returns_and_weights(
+        df_prices=df_prices, df_shares=df_shares, df_registry=df_registry, level=level
+    )
+    # Computed once per time slice and level, and shared with other risk analyses
+    covariance = get_covariance_matrix(
+        df_rets, method=covariance_method, halflife=halflife, shrinkage=shrinkage
+    )
+    return covariance.loc[pf_weight.index, pf_weight.index], pf_weight
+
+
+def get_portfolio_relative_risk_contribution(
+    df_prices: pd.DataFrame,
+    df_shares: pd.DataFrame,
+    df_registry: pd.DataFrame,
+    level: Literal["ticker", "asset_class", "macro_asset_class"],
+    covariance_method: Literal["sample", "ewma"] = "sample",
+    halflife: float = COVARIANCE_EWMA_HALFLIFE,
+    shrinkage: Literal["ledoit_wolf"] | float | None = None,
+) -> pd.DataFrame:
+    covariance, pf_weight = get_portfolio_covariance(
+        df_prices=df_prices,
+        df_shares=df_shares,
+        df_registry=df_registry,
+        level=level,
+        covariance_method=covariance_method,
+        halflife=halflife,
+        shrinkage=shrinkage,
+    )
 
     df = pd.DataFrame(
-        get_relative_risk_contributions(df_weights["pf_weight"], df_rets).rename(
+        get_relative_risk_contributions(pf_weight, covariance=covariance).rename(
             "relative_risk_contribution"
         )
-    ).merge(df_weights["pf_weight"], right_index=True, left_index=True)
+    ).merge(pf_weight, right_index=True, left_index=True)
 
     return df
+
+
+def get_rolling_relative_risk_contribution(
+    df_prices: pd.DataFrame,
+    df_transactions: pd.DataFrame,
+    df_registry: pd.DataFrame,
+    level: Literal["ticker", "asset_class", "macro_asset_class"],
+    window: int,
+) -> pd.DataFrame:
+    # A ticker is not held before its listing, so its missing returns there weigh
+    # nothing and can be taken as zero
+    df_log_rets = sum_by_level(
+        np.log(df_prices.div(df_prices.shift())).fillna(0),
+        df_registry=df_registry,
+        level=level,
+    )
+    # Weights from the shares actually held on each date, according to the ledger
+    df_values = sum_by_level(
+        get_holdings_history(
+            df_transactions, ticker_list=df_prices.columns, dates=df_prices.index
+        )
+        * df_prices.ffill(),
+        df_registry=df_registry,
+        level=level,
+    )[df_log_rets.columns]
+    total_value = df_values.sum(axis=1).to_numpy()
+    weights = (
+        df_values.to_numpy()
+        / np.where(total_value > 0, total_value, np.nan)[:, np.newaxis]
+    )
+
+    # Rolling window sums are updated with one rank-one term in and one out per
+    # date; returns are shifted by the first window mean to limit cancellation
+    rets = df_log_rets.to_numpy()
+    rets = rets - rets[:window].mean(axis=0)
+    sum_rets = rets[:window].sum(axis=0)
+    sum_cross = rets[:window].T @ rets[:window]
+    rrc = np.full(rets.shape, np.nan)
+    for t_ in range(window - 1, rets.shape[0]):
+        if t_ >= window:
+            sum_rets += rets[t_] - rets[t_ - window]
+            sum_cross += np.outer(rets[t_], rets[t_]) - np.outer(
+                rets[t_ - window], rets[t_ - window]
+            )
+        if np.isnan(weights[t_]).any():
+            continue
+        covariance = (sum_cross - np.outer(sum_rets, sum_rets) / window) / (window - 1)
+        marginal_risk = covariance @ weights[t_]
+        rrc[t_] = weights[t_] * marginal_risk / (weights[t_] @ marginal_risk)
+
+    return pd.DataFrame(rrc, index=df_log_rets.index, columns=df_log_rets.columns)[
+        window - 1 :
+    ]
+
+
+def _get_tail_losses(
+    sorted_rets: np.ndarray, confidence_levels: tuple[float, ...]
+) -> tuple[np.ndarray, np.ndarray]:
+    # VaR and CVaR (as positive losses) for all confidence levels from a single
+    # sorted array: quantiles are interpolated as in np.percentile, tail means come
+    # from the prefix sums of the sorted returns
+    alphas = 1 - np.asarray(confidence_levels)
+    n_obs = sorted_rets.shape[0]
+    if n_obs == 0:
+        # e.g. a horizon longer than the sample: no loss to take the tail of
+        return np.full(alphas.shape, np.nan), np.full(alphas.shape, np.nan)
+    position = alphas * (n_obs - 1)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, n_obs - 1)
+    quantiles = sorted_rets[lower] + (position - lower) * (
+        sorted_rets[upper] - sorted_rets[lower]
+    )
+    n_tail = np.maximum(np.searchsorted(sorted_rets, quantiles, side="right"), 1)
+    tail_means = np.cumsum(sorted_rets)[n_tail - 1] / n_tail
+    return -quantiles, -tail_means
+
+
+def _simulate_filtered_log_returns(
+    log_rets: np.ndarray,
+    horizon: int,
+    n_simulations: int,
+    ewma_lambda: float,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    # Filtered historical simulation: returns are standardised by their EWMA
+    # volatility, then standardised residuals are resampled and rescaled by the
+    # volatility path, starting from today's, that the simulated returns imply
+    variance = (
+        pd.Series(log_rets**2)
+        .ewm(alpha=1 - ewma_lambda, adjust=False)
+        .mean()
+        .to_numpy()
+    )
+    # Volatility forecast for day t is the EWMA up to day t-1
+    residuals = log_rets[1:] / np.sqrt(variance[:-1])
+    residuals = residuals[np.isfinite(residuals)]
+    if residuals.size == 0:
+        # Fewer than two returns, or none with a volatility yet: no residual to
+        # resample, and no loss to take the tail of
+        return np.empty(0)
+    sim_variance = np.full(n_simulations, variance[-1])
+    sim_log_rets = np.zeros(n_simulations)
+    for _ in range(horizon):
+        step_rets = np.sqrt(sim_variance) * rng.choice(residuals, size=n_simulations)
+        sim_log_rets += step_rets
+        sim_variance = ewma_lambda * sim_variance + (1 - ewma_lambda) * step_rets**2
+    return sim_log_rets
+
+
+@cache_data()
+def get_portfolio_var_cvar(
+    df_rets: pd.DataFrame,
+    weights: pd.Series,
+    method: Literal["historical", "parametric", "filtered"] = "historical",
+    confidence_levels: tuple[float, ...] = (0.95, 0.99),
+    horizons: dict[str, int] = DICT_VAR_HORIZONS,
+    n_simulations: int = 10_000,
+    ewma_lambda: float = 0.94,
+    seed: int = 42,
+) -> pd.DataFrame:
+    """Portfolio VaR and CVaR (as positive fractions of the portfolio value) for
+    every horizon (rows) and confidence level (columns)."""
+    # Returns of today's weights, rescaled on each date over the listed tickers
+    weights = weights.reindex(df_rets.columns).fillna(0)
+    pf_rets = get_available_average(df_rets.to_numpy(dtype=float), weights.to_numpy())
+    pf_rets = pf_rets[~np.isnan(pf_rets)]
+    log_rets = np.log1p(pf_rets)
+    cum_log_rets = np.concatenate([[0], np.cumsum(log_rets)])
+    rng = np.random.default_rng(seed)
+
+    rows = []
+    for horizon_label, horizon in horizons.items():
+        if method == "parametric":
+            # Normal h-day log-returns, with mean and variance scaled by h
+            mean, std = horizon * log_rets.mean(), np.sqrt(horizon) * log_rets.std()
+            alphas = 1 - np.asarray(confidence_levels)
+            z = np.array([NormalDist().inv_cdf(alpha_) for alpha_ in alphas])
+            tail_z = -np.array([NormalDist().pdf(z_) for z_ in z]) / alphas
+            var, cvar = -np.expm1(mean + z * std), -np.expm1(mean + tail_z * std)
+        else:
+            if method == "historical":
+                # Overlapping h-day log-returns as differences of prefix sums
+                horizon_log_rets = cum_log_rets[horizon:] - cum_log_rets[:-horizon]
+            else:
+                horizon_log_rets = _simulate_filtered_log_returns(
+                    log_rets,
+                    horizon=horizon,
+                    n_simulations=n_simulations,
+                    ewma_lambda=ewma_lambda,
+                    rng=rng,
+                )
+            var, cvar = _get_tail_losses(
+                np.sort(np.expm1(horizon_log_rets)), confidence_levels
+            )
+        row = {"horizon": horizon_label}
+        for confidence_, var_, cvar_ in zip(confidence_levels, var, cvar):
+            # 97.5% rather than 98%, 95% rather than 95.0%
+            row[f"VaR {100 * confidence_:g}%"] = var_
+            row[f"CVaR {100 * confidence_:g}%"] = cvar_
+        rows.append(row)
+    return pd.DataFrame(rows).set_index("horizon")
@@ -3,7 +3,10 @@ from bs4 import BeautifulSoup
 
 import pandas as pd
 
+from perf import traced, record_network_call
 
+
+@traced
 def retrieve_sector(df_anagrafica: pd.DataFrame) -> pd.DataFrame:
     # filter only specified url
     df_anagrafica = df_anagrafica[df_anagrafica["sector_url"] != '']
@@ -24,6 +27,7 @@ def retrieve_sector(df_anagrafica: pd.DataFrame) -> pd.DataFrame:
     return df_sector
 
 def retrieve_page(url: str) -> bytes:
+    record_network_call()
     response = requests.get(
         url,
         headers={
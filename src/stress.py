@@ -0,0 +1,180 @@
+from typing import Literal
+
+import pandas as pd
+import numpy as np
+
+from cache import cache_data
+
+
+@cache_data()
+def get_stress_scenarios(
+    df_prices: pd.DataFrame,
+    df_shares: pd.DataFrame,
+    scenarios: dict[str, tuple[str, str]],
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Replay historical windows on the shares held today.
+
+    All scenarios are evaluated in one pass: the log-value of today's portfolio is
+    computed once over the whole history, then every window is gathered into a
+    (scenarios x days) matrix. Returns a summary by scenario and the value paths.
+    """
+    shares = df_shares.iloc[:, 0].reindex(df_prices.columns).fillna(0).to_numpy()
+    pf_value = df_prices.ffill().to_numpy() @ shares
+    log_value = np.log(np.where(pf_value > 0, pf_value, np.nan))
+    dates = df_prices.index
+
+    names = list(scenarios.keys())
+    starts = dates.searchsorted(pd.to_datetime([s_ for s_, _ in scenarios.values()]))
+    ends = (
+        dates.searchsorted(
+            pd.to_datetime([e_ for _, e_ in scenarios.values()]), "right"
+        )
+        - 1
+    )
+    # Windows starting before the available history cannot be replayed
+    is_available = (
+        pd.to_datetime([s_ for s_, _ in scenarios.values()]) >= dates[0]
+    ) & (ends > starts)
+    lengths = np.where(is_available, ends - starts + 1, 0)
+    starts = np.minimum(starts, len(dates) - 1)
+
+    offsets = np.arange(max(lengths.max(initial=0), 1))
+    in_window = offsets < lengths[:, np.newaxis]
+    idx = np.minimum(starts[:, np.newaxis] + offsets, len(dates) - 1)
+    window_log_value = np.where(in_window, log_value[idx], np.nan)
+    path = window_log_value - window_log_value[:, :1]
+
+    running_max = np.fmax.accumulate(np.nan_to_num(path, nan=-np.inf), axis=1)
+    drawdown = np.where(in_window, path - running_max, np.nan)
+    has_data = is_available & ~np.all(np.isnan(drawdown), axis=1)
+    trough = np.where(has_data, np.argmin(np.nan_to_num(drawdown, nan=0), axis=1), 0)
+    rows_ = np.arange(len(names))
+    max_drawdown = np.where(has_data, np.expm1(drawdown[rows_, trough]), np.nan)
+    total_return = np.where(
+        has_data, np.expm1(path[rows_, np.maximum(lengths - 1, 0)]), np.nan
+    )
+
+    # Recovery: first date after the trough (also beyond the window) on which the
+    # portfolio is back to the peak preceding the trough
+    trough_pos = starts + trough
+    peak_log_value = log_value[starts] + running_max[rows_, trough]
+    is_recovered = (log_value[np.newaxis, :] >= peak_log_value[:, np.newaxis]) & (
+        np.arange(len(dates)) > trough_pos[:, np.newaxis]
+    )
+    recovery_pos = np.argmax(is_recovered, axis=1)
+    recovery_days = np.where(
+        has_data & is_recovered.any(axis=1) & (max_drawdown < 0),
+        (dates[recovery_pos] - dates[trough_pos]).days,
+        np.nan,
+    )
+
+    df_summary = pd.DataFrame(
+        {
+            "start": np.where(has_data, dates[starts].date, None),
+            "end": np.where(has_data, dates[np.maximum(ends, 0)].date, None),
+            "total_return": total_return,
+            "max_drawdown": max_drawdown,
+            "trough_date": np.where(has_data, dates[trough_pos].date, None),
+            "recovery_days": recovery_days,
+        },
+        index=pd.Index(names, name="scenario"),
+    )
+    df_paths = pd.DataFrame(
+        np.expm1(path[has_data]).T,
+        index=pd.RangeIndex(path.shape[1], name="trading_day"),
+        columns=[name_ for name_, ok_ in zip(names, has_data) if ok_],
+    )
+    return df_summary, df_paths
+
+
+class ShockEngine:
+    """Instant PnL of price shocks applied along the macro asset class → asset class
+    → ticker hierarchy.
+
+    Shocks add up along the hierarchy, e.g. Stocks -20% and EMs Stocks -5% move an
+    emerging market ETF by -25%. Position values are grouped once at construction,
+    so the total impact of a scenario is a dot product per level.
+    """
+
+    def __init__(self, df_positions: pd.DataFrame, df_dimensions: pd.DataFrame):
+        df_exp = df_positions[["ticker_yf", "position_value"]].merge(
+            df_dimensions.drop_duplicates("ticker_yf")[
+                ["ticker_yf", "name", "asset_class", "macro_asset_class"]
+            ],
+            how="left",
+            on="ticker_yf",
+        )
+        self.values = df_exp["position_value"].to_numpy(dtype=float)
+        self.tickers = pd.Index(df_exp["ticker_yf"])
+        self.names = df_exp["name"].to_numpy()
+        self.class_codes, self.classes = pd.factorize(df_exp["asset_class"])
+        self.macro_codes, self.macro_classes = pd.factorize(df_exp["macro_asset_class"])
+        self.class_values = np.bincount(self.class_codes, weights=self.values)
+        self.macro_values = np.bincount(self.macro_codes, weights=self.values)
+
+    @staticmethod
+    def _to_array(shocks: dict[str, float] | None, labels: pd.Index) -> np.ndarray:
+        if not shocks:
+            return np.zeros(len(labels))
+        return pd.Series(shocks, dtype=float).reindex(labels).fillna(0).to_numpy()
+
+    def get_total_impact(
+        self,
+        macro_shocks: dict[str, float] | None = None,
+        class_shocks: dict[str, float] | None = None,
+        ticker_shocks: dict[str, float] | None = None,
+    ) -> float:
+        return float(
+            self.macro_values @ self._to_array(macro_shocks, self.macro_classes)
+            + self.class_values @ self._to_array(class_shocks, self.classes)
+            + self.values @ self._to_array(ticker_shocks, self.tickers)
+        )
+
+    def get_impact(
+        self,
+        macro_shocks: dict[str, float] | None = None,
+        class_shocks: dict[str, float] | None = None,
+        ticker_shocks: dict[str, float] | None = None,
+    ) -> pd.DataFrame:
+        shock = (
+            self._to_array(macro_shocks, self.macro_classes)[self.macro_codes]
+            + self._to_array(class_shocks, self.classes)[self.class_codes]
+            + self._to_array(ticker_shocks, self.tickers)
+        )
+        return pd.DataFrame(
+            {
+                "ticker_yf": self.tickers,
+                "name": self.names,
+                "asset_class": self.classes[self.class_codes],
+                "macro_asset_class": self.macro_classes[self.macro_codes],
+                "position_value": self.values,
+                "shock": shock,
+                "pnl": self.values * shock,
+                "value_after": self.values * (1 + shock),
+            }
+        )
+
+    def get_impact_by_level(
+        self,
+        df_impact: pd.DataFrame,
+        level: Literal["asset_class", "macro_asset_class"],
+    ) -> pd.DataFrame:
+        codes, labels = (
+            (self.class_codes, self.classes)
+            if level == "asset_class"
+            else (self.macro_codes, self.macro_classes)
+        )
+        pnl = np.bincount(
+            codes, weights=df_impact["pnl"].to_numpy(), minlength=len(labels)
+        )
+        values = np.bincount(codes, weights=self.values, minlength=len(labels))
+        return pd.DataFrame(
+            {level: labels, "position_value": values, "pnl": pnl, "shock": pnl / values}
+        )
+
+
+@cache_data()
+def get_shock_engine(
+    df_positions: pd.DataFrame, df_dimensions: pd.DataFrame
+) -> ShockEngine:
+    return ShockEngine(df_positions=df_positions, df_dimensions=df_dimensions)
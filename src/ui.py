@@ -0,0 +1,70 @@
+"""Streamlit side of the analytics.
+
+The messages written by the pages around the data, and what the analytics get when
+they run in the app: importing this module plugs st.error as their error reporter.
+Their results are cached as everywhere else, in the process by cache.py, within the
+memory budget. The analytics themselves never import Streamlit.
+"""
+from pathlib import Path
+from typing import Tuple
+
+import streamlit as st
+import pandas as pd
+
+from var import COMPACT_DTYPES
+from reporting import set_error_reporter
+from input_output import read_workbook
+
+
+def write_error(message: str) -> None:
+    st.error(message, icon="😔")
+
+
+set_error_reporter(write_error)
+
+
+def write_disclaimer() -> None:
+    st.markdown("***")
+    st.markdown(
+        '<center> <span style="font-size:0.7em; font-style:italic">\
+        This content is for educational purposes only and is under no circumstances intended\
+        to be used or considered as financial or investment advice\
+        </span> </center>',
+        unsafe_allow_html=True,
+    )
+
+
+def write_load_message(df_data: pd.DataFrame, df_dimensions: pd.DataFrame) -> None:
+    n_transactions = df_data.shape[0]
+    n_tickers = df_data["ticker"].nunique()
+    min_date, max_date = (
+        str(df_data["transaction_date"].min())[:10],
+        str(df_data["transaction_date"].max())[:10],
+    )
+    set_data_tickers = sorted(df_data["ticker"].unique())
+    set_dimensions_tickers = sorted(df_dimensions["ticker"].unique())
+    n_data_na = df_data.isnull().sum().sum()
+    n_dimensions_na = df_dimensions.isnull().sum().sum()
+
+    if n_data_na > 0 or n_dimensions_na > 0:
+        st.error(
+            f"There are null values: {n_data_na} among transactions, {n_dimensions_na} among tickers' descriptions"
+        )
+        st.stop()
+
+    if set_data_tickers != set_dimensions_tickers:
+        st.warning(
+            "There is some inconsistency between the tickers traded and the tickers' descriptions"
+        )
+
+    st.success(
+        f"Successfully loaded **{n_transactions} transactions** relating to **{n_tickers} tickers** and spanning from {min_date} to {max_date}"
+    )
+
+
+def load_data(
+    full_path: Path, compact: bool = COMPACT_DTYPES
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    df_storico, df_anagrafica = read_workbook(full_path, compact=compact)
+    write_load_message(df_data=df_storico, df_dimensions=df_anagrafica)
+    return df_storico, df_anagrafica
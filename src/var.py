@@ -54,11 +54,70 @@ PLT_CONFIG = {
 
 PLT_CONFIG_NO_LOGO = {"displaylogo": False}
 CACHE_EXPIRE_SECONDS = 600
+# Cache policy: entries kept per function and memory shared by all of them
+CACHE_MAX_ENTRIES = 64
+CACHE_MEMORY_BUDGET_MB = 1024
+CACHE_MAX_ENTRIES_ENV_VAR = "PFN_CACHE_MAX_ENTRIES"
+CACHE_BUDGET_ENV_VAR = "PFN_CACHE_BUDGET_MB"
+# Functions whose entries are whole price or return histories, i.e. one per time
+# slice, frequency or level selected in the pages
+DICT_CACHE_MAX_ENTRIES = {
+    "get_price_panel": 8,
+    "get_period_returns": 16,
+    "get_cumulative_log_returns": 8,
+    "get_rolling_returns_surface": 8,
+    "compute_rolling_metrics": 8,
+    "get_wealth_history": 8,
+    "get_ticker_time_weighted_returns": 8,
+    "get_stress_scenarios": 8,
+    "get_covariance_engine": 16,
+    "simulate_bootstrap_growth": 8,
+}
+# Per-ticker market data shared by the sessions, and concurrent downloads
+MARKET_DATA_MAX_TICKERS = 5000
+MARKET_DATA_MAX_WORKERS = 8
+# Opt-in compact representation: categorical tickers and float32 price panels
+COMPACT_DTYPES = os.environ.get("PFN_COMPACT_DTYPES", "") not in ("", "0")
+PRICE_DTYPE = "float32" if COMPACT_DTYPES else "float64"
+# Tickers whose holdings are expanded at once in the wealth history
+WEALTH_TICKERS_PER_BLOCK = 64
 PLT_FONT_SIZE = 14
 
 # Others
 
 TRADING_DAYS_YEAR = 252
+INVESTMENT_INCREASE_INTERVAL_YEARS = 5
+COVARIANCE_EWMA_HALFLIFE = 63
+FRONTIER_RIDGE = 1e-4
+FRONTIER_MAX_CONDITION = 1e12
+PERF_PANEL_ENV_VAR = "PFN_PERF_PANEL"
+PERF_LOG_ENV_VAR = "PFN_PERF_LOG"
+PROFILER_ENV_VAR = "PFN_PROFILER"
+PROFILER_TOP_N = 25
+DICT_STRESS_SCENARIOS = {
+    "2008 financial crisis": ("2007-10-09", "2009-03-09"),
+    "2010 flash crash": ("2010-04-23", "2010-07-02"),
+    "2011 euro debt crisis": ("2011-07-07", "2011-10-04"),
+    "2015-16 China slowdown": ("2015-08-10", "2016-02-11"),
+    "2018 Q4 sell-off": ("2018-09-20", "2018-12-24"),
+    "2020 COVID-19 crash": ("2020-02-19", "2020-03-23"),
+    "2022 rate shock": ("2022-01-03", "2022-10-12"),
+}
+DICT_VAR_HORIZONS = {
+    "1 day": 1,
+    "10 days": 10,
+    "1 month": 21,
+}
+DICT_BENCHMARKS = {
+    "^GSPC": "S&P 500",
+    "^IXIC": "Nasdaq Composite",
+    "^STOXX": "STOXX Europe 600",
+    "^STOXX50E": "Euro Stoxx 50",
+    "^GDAXI": "DAX",
+    "^FCHI": "CAC 40",
+    "^FTSE": "FTSE 100",
+    "^N225": "Nikkei 225",
+}
 DICT_GROUPBY_LEVELS = {
     "Macro Asset Classes": "macro_asset_class",
     "Asset Classes": "asset_class",
@@ -71,3 +130,15 @@ DICT_FREQ_RESAMPLE = {
     "Week": "W",
     "Day": None,
 }
+DICT_FREQ_PERIODS_YEAR = {
+    "Year": 1,
+    "Quarter": 4,
+    "Month": 12,
+    "Week": 52,
+    "Day": TRADING_DAYS_YEAR,
+}
+DICT_COVARIANCE_ESTIMATORS = {
+    "Sample": dict(covariance_method="sample"),
+    "Exponentially weighted": dict(covariance_method="ewma"),
+    "Sample with shrinkage": dict(covariance_method="sample", shrinkage="ledoit_wolf"),
+}